@@ -0,0 +1,190 @@
+"""Time the plugin collecting and running a synthetic libtbx distribution.
+
+Also timed is the cost of importing the plugin on top of pytest, which every
+pytest session pays whether or not it has anything to do with libtbx.
+
+Usage: python benchmarks/run.py [--modules N] [--entries M] [--output FILE]
+
+Each run is appended to a JSON history file (benchmarks/results.json by
+default) along with the git revision, so results can be compared over time.
+Pass --max-ratio to fail if any timing is slower than the previous run
+with the same parameters by more than that factor.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SRC = os.path.join(os.path.dirname(_HERE), "src")
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ["git", "-C", _HERE, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _time_pytest(root, args, repeat):
+    """Run pytest against the tree and return the wall times of each run"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root, _SRC] + [x for x in [env.get("PYTHONPATH")] if x]
+    )
+    env["PYTEST_DISABLE_PLUGIN_AUTOLOAD"] = "1"
+    command = [
+        sys.executable,
+        "-m",
+        "pytest",
+        "-p",
+        "pytest_libtbx.plugin",
+        "-p",
+        "no:cacheprovider",
+        "-q",
+        *args,
+        root,
+    ]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=root, env=env, capture_output=True)
+        times.append(time.perf_counter() - start)
+        # The tree always has tests, so finding none is a failure too
+        if result.returncode != 0:
+            sys.exit(
+                f"pytest failed with exit code {result.returncode}:\n"
+                + result.stdout.decode(errors="replace")[-4000:]
+                + result.stderr.decode(errors="replace")[-4000:]
+            )
+    return times
+
+
+def _time_import(repeat):
+    """Time how much importing the plugin adds to importing pytest alone"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_SRC] + [x for x in [env.get("PYTHONPATH")] if x]
+    )
+
+    def _run(statement):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], env=env, check=True)
+        return time.perf_counter() - start
+
+    times = []
+    for _ in range(repeat):
+        baseline = _run("import pytest")
+        times.append(max(0.0, _run("import pytest, pytest_libtbx.plugin") - baseline))
+    return times
+
+
+def _summarise(times):
+    return {
+        "min": round(min(times), 4),
+        "median": round(statistics.median(times), 4),
+        "runs": len(times),
+    }
+
+
+def _previous(history, tree):
+    for record in reversed(history):
+        if record["tree"] == tree:
+            return record
+    return None
+
+
+def run_benchmarks(options):
+    with tempfile.TemporaryDirectory(prefix="libtbx-bench-") as root:
+        tree = synthetic.generate(
+            root,
+            modules=options.modules,
+            entries=options.entries,
+            depth=options.depth,
+            discover_every=options.discover_every,
+        )
+        timings = {
+            "collect": _summarise(
+                _time_pytest(root, ["--collect-only"], options.repeat)
+            ),
+            "run": _summarise(_time_pytest(root, [], options.repeat)),
+            "import": _summarise(_time_import(max(options.repeat, 5))),
+        }
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "tree": tree,
+        "timings": timings,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", type=int, default=20)
+    parser.add_argument("--entries", type=int, default=25)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument(
+        "--discover-every",
+        type=int,
+        default=2,
+        help="Every Nth module calls discover(); the rest become ignore roots",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(_HERE, "results.json"),
+        help="The JSON history file to append results to",
+    )
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        help="Exit with an error if any median time is this many times the "
+        "previous result for the same tree",
+    )
+    options = parser.parse_args(args)
+
+    result = run_benchmarks(options)
+
+    history = []
+    if os.path.isfile(options.output):
+        with open(options.output) as f:
+            history = json.load(f)
+    previous = _previous(history, result["tree"])
+
+    regressed = []
+    print(f"{result['tree']['tests']} tests in {result['tree']['modules']} modules")
+    for name, timing in result["timings"].items():
+        line = f"{name:>8}: {timing['median']:.3f}s median, {timing['min']:.3f}s min"
+        if previous and name in previous["timings"]:
+            ratio = timing["median"] / max(previous["timings"][name]["median"], 1e-6)
+            line += f"  ({ratio:.2f}x previous {previous['revision']})"
+            if options.max_ratio and ratio > options.max_ratio:
+                regressed.append(name)
+        print(line)
+
+    history.append(result)
+    with open(options.output, "w") as f:
+        json.dump(history, f, indent=1)
+
+    if regressed:
+        sys.exit(f"Slower than the previous result: {', '.join(regressed)}")
+
+
+if __name__ == "__main__":
+    main()
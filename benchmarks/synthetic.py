@@ -0,0 +1,154 @@
+"""Generate synthetic libtbx distributions for benchmarking the plugin.
+
+The tree is a real on-disk libtbx package - with a load_env that reads the
+module list from a file - so the plugin can be run against it in a separate
+pytest process exactly as it would be against a real distribution.
+"""
+
+from __future__ import annotations
+
+import os
+
+_LOAD_ENV = """\
+from __future__ import annotations
+
+import os
+
+import libtbx
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Like libtbx's own path objects, the plugin gets a string with abs()
+class _Path(str):
+    def __abs__(self):
+        return str(self)
+
+
+class _Module:
+    def __init__(self, name):
+        self.name = name
+        self.dist_paths = [_Path(os.path.join(_root, name)), None]
+
+
+class _Environment:
+    def __init__(self):
+        with open(os.path.join(_root, "modules.list")) as f:
+            names = [x.strip() for x in f if x.strip()]
+        self.module_list = [_Module(x) for x in names]
+        self.module_dist_paths = {x.name: x.dist_paths[0] for x in self.module_list}
+        self.build_path = os.path.join(_root, "_build")
+
+    def dist_path(self, name):
+        return self.module_dist_paths[name]
+
+    def under_build(self, name):
+        return _Path(os.path.join(self.build_path, name))
+
+    def has_module(self, name):
+        return name in self.module_dist_paths
+
+
+libtbx.env = _Environment()
+"""
+
+_TEST_UTILS_PYTEST = """\
+from __future__ import annotations
+
+
+def discover(*args, **kwargs):
+    return []
+"""
+
+_RUN_TESTS = """\
+from __future__ import annotations
+
+from libtbx.test_utils.pytest import discover
+
+tst_list = [
+{entries}]
+{discover}"""
+
+_SCRIPT = """\
+from __future__ import annotations
+
+import sys
+
+assert sum(range(100)) == 4950
+sys.exit(0)
+"""
+
+
+def _write(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def generate(root, modules=10, entries=20, depth=4, discover_every=2):
+    """Write a synthetic libtbx distribution.
+
+    Args:
+        root: The directory to create the distribution in
+        modules: How many libtbx modules to create, besides libtbx itself
+        entries: How many tst_list entries each module lists
+        depth: How deeply the test scripts (and unrelated python files)
+            are nested inside each module
+        discover_every: Every nth module calls discover(), so pytest looks
+            inside it; the others become ignore roots
+
+    Returns:
+        dict: A description of the generated tree, for recording results
+    """
+    root = os.path.abspath(root)
+    _write(os.path.join(root, "libtbx", "__init__.py"))
+    _write(os.path.join(root, "libtbx", "load_env.py"), _LOAD_ENV)
+    _write(os.path.join(root, "libtbx", "test_utils", "__init__.py"))
+    _write(os.path.join(root, "libtbx", "test_utils", "pytest.py"), _TEST_UTILS_PYTEST)
+    os.makedirs(os.path.join(root, "_build", "libtbx"), exist_ok=True)
+
+    names = [f"module{i:03d}" for i in range(modules)]
+    for index, name in enumerate(names):
+        module = os.path.join(root, name)
+        _write(os.path.join(module, "__init__.py"))
+        os.makedirs(os.path.join(root, "_build", name), exist_ok=True)
+
+        # Scripts are spread over a chain of nested packages, with an
+        # unrelated python file at each level for collection to look at
+        subdirs = [
+            os.path.join(*[f"sub{x}" for x in range(level)] or ["."])
+            for level in range(depth + 1)
+        ]
+        for subdir in subdirs[1:]:
+            _write(os.path.join(module, subdir, "__init__.py"))
+            _write(os.path.join(module, subdir, "helpers.py"), "VALUE = 1\n")
+
+        lines = []
+        for entry in range(entries):
+            subdir = os.path.normpath(subdirs[entry % len(subdirs)])
+            script = os.path.normpath(os.path.join(subdir, f"tst_{entry:03d}.py"))
+            _write(os.path.join(module, script), _SCRIPT)
+            if entry % 3:
+                lines.append(f'    "$D/{script}",\n')
+            else:
+                lines.append(f'    ["$D/{script}", "--option={entry}"],\n')
+
+        calls_discover = discover_every and index % discover_every == 0
+        _write(
+            os.path.join(module, "run_tests.py"),
+            _RUN_TESTS.format(
+                entries="".join(lines),
+                discover="tst_list += discover()\n" if calls_discover else "",
+            ),
+        )
+
+    with open(os.path.join(root, "modules.list"), "w") as f:
+        f.write("\n".join(["libtbx"] + names) + "\n")
+
+    return {
+        "modules": modules,
+        "entries": entries,
+        "depth": depth,
+        "discover_every": discover_every,
+        "tests": modules * entries,
+    }
@@ -0,0 +1,62 @@
+"""Records what python test subprocesses use, or profiles them.
+
+This directory is put first on the PYTHONPATH of subprocesses, so that
+python imports this at startup. Any sitecustomize that it hides is
+imported afterwards.
+"""
+
+from __future__ import annotations
+
+import atexit
+import importlib
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _import_hidden_sitecustomize():
+    """Import the sitecustomize that would have run without this one"""
+    this = sys.modules.pop("sitecustomize")
+    sys.path[:] = [x for x in sys.path if os.path.abspath(x or ".") != _HERE]
+    try:
+        importlib.import_module("sitecustomize")
+    except ImportError:
+        sys.modules["sitecustomize"] = this
+
+
+def _import_from_package(name):
+    """Import from the package this is inside, wherever pytest imported it"""
+    sys.path.append(os.path.dirname(os.path.dirname(_HERE)))
+    try:
+        return importlib.import_module("pytest_libtbx." + name)
+    finally:
+        sys.path.pop()
+
+
+def _start_recording(deps_file):
+    recorder = _import_from_package("record").DependencyRecorder().__enter__()
+
+    def _write():
+        recorder.__exit__(None, None, None)
+        with open(deps_file, "a") as f:
+            f.writelines(x + "\n" for x in recorder.files)
+
+    atexit.register(_write)
+
+
+def _start_profiling(profile_file):
+    profiler = _import_from_package("profiler").SamplingProfiler().__enter__()
+
+    def _write():
+        profiler.__exit__(None, None, None)
+        profiler.write(profile_file)
+
+    atexit.register(_write)
+
+
+_import_hidden_sitecustomize()
+if os.environ.get("PYTEST_LIBTBX_DEPS_FILE"):
+    _start_recording(os.environ["PYTEST_LIBTBX_DEPS_FILE"])
+if os.environ.get("PYTEST_LIBTBX_PROFILE_FILE"):
+    _start_profiling(os.environ["PYTEST_LIBTBX_PROFILE_FILE"])
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from xdist.scheduler import LoadScopeScheduling
+
+from .scheduler import plan_work_units
+
+
+class DurationScheduling(LoadScopeScheduling):
+    """Distribute work units longest-first, by recorded test duration.
+
+    Only imported when pytest-xdist is in use.
+    """
+
+    def __init__(self, config, log=None, history=None):
+        super().__init__(config, log)
+        self._history = history
+        self._scopes = {}
+        self._order = None
+
+    def schedule(self):
+        # The base class checks that all the collections match
+        if self.collection is None and self.registered_collections:
+            collection = list(next(iter(self.registered_collections.values())))
+            plan = plan_work_units(collection, self._history, len(self.nodes))
+            self._order = {}
+            for index, (scope, nodeids) in enumerate(plan):
+                self._order[scope] = index
+                for nodeid in nodeids:
+                    self._scopes[nodeid] = scope
+        super().schedule()
+
+    def _split_scope(self, nodeid):
+        return self._scopes.get(nodeid) or super()._split_scope(nodeid)
+
+    def _assign_work_unit(self, node):
+        # The base class has built the work queue by now; put it in our order
+        if self._order is not None:
+            units = sorted(
+                self.workqueue.items(),
+                key=lambda unit: self._order.get(unit[0], len(self._order)),
+            )
+            self.workqueue.clear()
+            self.workqueue.update(units)
+            self._order = None
+        super()._assign_work_unit(node)
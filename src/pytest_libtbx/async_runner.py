@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import logging
+import signal
+import subprocess
+import threading
+
+from .capture import CHUNK_SIZE, CommandResult, open_captures
+from .resources import wait_with_usage
+from .timeouts import KILL_GRACE, signal_group
+
+logger = logging.getLogger(__name__)
+
+
+async def _pump(stream, capture):
+    try:
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            capture.write(chunk)
+    finally:
+        capture.close()
+
+
+async def _terminate_group(process, waited):
+    """Stop a process started in its own session, and everything it started"""
+    signal_group(process.pid, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(waited), KILL_GRACE)
+    except asyncio.TimeoutError:
+        pass
+    signal_group(process.pid, signal.SIGKILL)
+    await waited
+
+
+class AsyncCommandRunner:
+    """Runs external commands concurrently on a background event loop.
+
+    Commands are started in submission order, with at most `limit` running at
+    once. Each submission returns a concurrent.futures.Future, so the test
+    items can be run - and report - in their usual order while the processes
+    for later tests are already running.
+
+    Each process is waited for in a thread with wait_with_usage, rather than
+    by asyncio, so that what it used is measured on its own and not counted
+    against the test running when it happens to finish.
+    """
+
+    def __init__(self, limit, capture_limit=None):
+        """
+        Args:
+            limit: The most commands to run at once
+            capture_limit: If set, the most bytes of each output stream to
+                keep in memory for each command, otherwise keep everything
+        """
+        self._capture_limit = capture_limit
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(limit)
+        self._waiters = concurrent.futures.ThreadPoolExecutor(
+            max_workers=limit, thread_name_prefix="libtbx-async-wait"
+        )
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="libtbx-async-runner", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, command, cwd, log_prefix=None, timeout=None, env=None):
+        """Queue a command to be run.
+
+        Args:
+            command: The command and arguments to run
+            cwd: The working directory to run the command in
+            log_prefix: With a capture limit, where to write the full output
+            timeout: Seconds to let the command run for once started, after
+                which its whole process group is killed
+            env: The environment to run the command in, if not this one
+
+        Returns:
+            concurrent.futures.Future: Resolves to a CommandResult
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._run([str(x) for x in command], str(cwd), log_prefix, timeout, env),
+            self._loop,
+        )
+
+    @staticmethod
+    async def _communicate(readers, waited, stdout, stderr):
+        await asyncio.gather(_pump(readers[0], stdout), _pump(readers[1], stderr))
+        await asyncio.shield(waited)
+
+    async def _open_reader(self, pipe):
+        reader = asyncio.StreamReader()
+        transport, _ = await self._loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), pipe
+        )
+        return reader, transport
+
+    async def _run(self, command, cwd, log_prefix, timeout, env):
+        async with self._semaphore:
+            logger.debug("Starting %s", command)
+            process = subprocess.Popen(
+                command,
+                cwd=cwd,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+            waited = self._loop.run_in_executor(self._waiters, wait_with_usage, process)
+            stdout, stderr = open_captures(self._capture_limit, log_prefix)
+            out_reader, out_pipe = await self._open_reader(process.stdout)
+            err_reader, err_pipe = await self._open_reader(process.stderr)
+            timed_out = False
+            try:
+                await asyncio.wait_for(
+                    self._communicate((out_reader, err_reader), waited, stdout, stderr),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                logger.debug("Timed out after %ss: %s", timeout, command)
+                timed_out = True
+                await _terminate_group(process, waited)
+            except asyncio.CancelledError:
+                await _terminate_group(process, waited)
+                raise
+            finally:
+                out_pipe.close()
+                err_pipe.close()
+            return CommandResult(
+                process.returncode,
+                stdout.text(),
+                stderr.text(),
+                timed_out,
+                usage=waited.result(),
+            )
+
+    @staticmethod
+    async def _cancel_all():
+        tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancelled tasks to kill their processes
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(self):
+        """Cancel any commands still waiting or running, and stop the loop"""
+        asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._waiters.shutdown()
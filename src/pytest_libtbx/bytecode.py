@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import struct
+import sys
+import types
+
+logger = logging.getLogger(__name__)
+
+# Cache files start with the interpreter magic, then source mtime_ns and size
+_HEADER = struct.Struct("<4sqq")
+
+
+class CodeCache:
+    """Compiled code objects for test scripts, kept in memory and on disk.
+
+    Scripts run as __main__ never get a .pyc written, so without this the
+    same script would be recompiled for every parameterised test entry and
+    every session. Entries are invalidated when the script mtime or size
+    changes.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Args:
+            directory: Where to store compiled code between sessions, or
+                None to only cache in memory
+        """
+        self._directory = directory
+        self._memory = {}
+
+    def get(self, path):
+        """Get the compiled code object for a python script"""
+        path = str(path)
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._memory.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        code = self._read(path, key)
+        if code is None:
+            with open(path, "rb") as f:
+                code = compile(f.read(), path, "exec", dont_inherit=True)
+            self._write(path, key, code)
+        self._memory[path] = (key, code)
+        return code
+
+    def _cache_file(self, path):
+        name = hashlib.sha1(path.encode()).hexdigest()
+        return os.path.join(str(self._directory), name + ".pyc")
+
+    def _read(self, path, key):
+        if self._directory is None:
+            return None
+        try:
+            with open(self._cache_file(path), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, mtime_ns, size = _HEADER.unpack_from(data)
+        if magic != importlib.util.MAGIC_NUMBER or (mtime_ns, size) != key:
+            return None
+        try:
+            return marshal.loads(data[_HEADER.size :])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def _write(self, path, key, code):
+        if self._directory is None:
+            return
+        filename = self._cache_file(path)
+        temporary = f"{filename}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                f.write(_HEADER.pack(importlib.util.MAGIC_NUMBER, *key))
+                f.write(marshal.dumps(code))
+            os.replace(temporary, filename)
+        except OSError as e:
+            logger.debug("Could not write bytecode cache for %s: %s", path, e)
+
+
+def run_code_as_main(code, path):
+    """Execute a compiled script as __main__, like runpy.run_path.
+
+    Args:
+        code: The compiled code for the script
+        path: The script filename
+
+    Returns:
+        dict: The globals of the script after running
+    """
+    module = types.ModuleType("__main__")
+    module.__dict__.update(
+        __file__=str(path), __cached__=None, __loader__=None, __package__=""
+    )
+    module.__spec__ = None
+    prior_main = sys.modules.get("__main__")
+    sys.modules["__main__"] = module
+    try:
+        exec(code, module.__dict__)
+    finally:
+        if prior_main is None:
+            del sys.modules["__main__"]
+        else:
+            sys.modules["__main__"] = prior_main
+    return module.__dict__.copy()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+
+from .runtests import RunTestsInfo
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the format of the stored RunTestsInfo changes, or how it
+# is read does, so that nothing read the old way is kept
+CACHE_VERSION = 7
+CACHE_KEY = "libtbx/collection"
+
+
+def libtbx_env_fingerprint(env) -> str:
+    """Summarise a libtbx environment so that cached results can be invalidated.
+
+    Args:
+        env: The libtbx.env object (or a fake equivalent)
+
+    Returns:
+        A hex digest that changes whenever the module configuration or the
+        build environment file changes.
+    """
+    digest = hashlib.sha256()
+    for name, path in sorted(env.module_dist_paths.items()):
+        try:
+            path = abs(path)
+        except TypeError:
+            pass
+        digest.update(f"{name}={path}\n".encode())
+
+    # The environment pickle is rewritten whenever libtbx is reconfigured
+    build_path = getattr(env, "build_path", None)
+    if build_path is not None:
+        try:
+            build_path = abs(build_path)
+        except TypeError:
+            pass
+        try:
+            stat = os.stat(os.path.join(str(build_path), "libtbx_env"))
+            digest.update(f"libtbx_env={stat.st_mtime_ns}:{stat.st_size}\n".encode())
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class RunTestsCache:
+    """Persistent store of information extracted from run_tests.py files.
+
+    Entries are keyed on the run_tests.py path and are only valid while the
+    file content and the libtbx environment fingerprint are unchanged. The
+    file mtime and size are checked first so that the common case doesn't
+    need to read the file at all.
+    """
+
+    def __init__(self, store, fingerprint):
+        """
+        Args:
+            store: A pytest config.cache-like object, or None to only cache
+                for the current session
+            fingerprint: The libtbx environment fingerprint
+        """
+        self._store = store
+        self._fingerprint = fingerprint
+        self._entries = {}
+        self._dirty = False
+        if store is not None:
+            data = store.get(CACHE_KEY, None) or {}
+            if (
+                data.get("version") == CACHE_VERSION
+                and data.get("fingerprint") == fingerprint
+            ):
+                self._entries = data.get("entries", {})
+            elif data:
+                logger.info("libtbx environment changed; discarding collection cache")
+                self._dirty = True
+
+    def get(self, path, static=True) -> RunTestsInfo | None:
+        """Look up a run_tests.py, returning None if not cached or stale.
+
+        Args:
+            path: The run_tests.py file
+            static: Whether an entry that may have been read without
+                importing the file can be used
+        """
+        entry = self._entries.get(str(path))
+        if entry is None or (entry["static"] and not static):
+            return None
+        try:
+            stat = _file_stat(str(path))
+            if stat != entry["stat"]:
+                # Touched but possibly not changed e.g. by a branch switch
+                if _file_hash(str(path)) != entry["hash"]:
+                    return None
+                entry["stat"] = stat
+                self._dirty = True
+        except OSError:
+            return None
+        return RunTestsInfo.from_dict(entry["info"])
+
+    def set(self, path, info: RunTestsInfo, static: bool) -> None:
+        """Store the extracted information for a run_tests.py file.
+
+        Args:
+            path: The run_tests.py file
+            info: What was read from it
+            static: Whether it may have been read without importing it
+        """
+        try:
+            stat = _file_stat(str(path))
+            file_hash = _file_hash(str(path))
+        except OSError:
+            return
+        self._entries[str(path)] = {
+            "stat": stat,
+            "hash": file_hash,
+            "static": static,
+            "info": info.to_dict(),
+        }
+        self._dirty = True
+
+    def save(self) -> None:
+        """Write any changes back to the persistent store"""
+        if self._store is None or not self._dirty:
+            return
+        self._store.set(
+            CACHE_KEY,
+            {
+                "version": CACHE_VERSION,
+                "fingerprint": self._fingerprint,
+                "entries": self._entries,
+            },
+        )
+        self._dirty = False
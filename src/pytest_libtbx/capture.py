@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import argparse
+import subprocess
+import sys
+import threading
+
+from .resources import wait_with_usage
+from .timeouts import KILL_GRACE, terminate_group
+
+# How much to read from a pipe at once
+CHUNK_SIZE = 64 * 1024
+
+_SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(value):
+    """Parse a size in bytes, with an optional K, M or G suffix"""
+    text = value.strip().upper().rstrip("B")
+    multiplier = 1
+    if text and text[-1] in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[text[-1]]
+        text = text[:-1]
+    try:
+        size = int(float(text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {value!r}")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"Size must be positive: {value!r}")
+    return size
+
+
+class CommandResult:
+    """The outcome of running an external command"""
+
+    def __init__(self, exitcode, stdout, stderr, timed_out=False, usage=None):
+        self.exitcode = exitcode
+        self.stdout = stdout
+        self.stderr = stderr
+        # Whether the command was killed for running too long
+        self.timed_out = timed_out
+        # The (user, system, peak_rss) of the command, if measured
+        self.usage = usage
+
+
+class StreamCapture:
+    """Captures an output stream, only keeping the start and end in memory.
+
+    The full output can optionally be written through to a file, so it can
+    still be inspected after the test run, while the report only ever holds
+    at most `limit` bytes.
+    """
+
+    def __init__(self, limit, filename=None):
+        """
+        Args:
+            limit: The most bytes of output to keep in memory; half from the
+                start of the stream and half from the end. None keeps all.
+            filename: Where to write the complete output, if anywhere
+        """
+        if limit is None:
+            limit = sys.maxsize
+        self._head_size = limit // 2
+        self._tail_size = limit - self._head_size
+        self.filename = filename
+        self._file = open(filename, "wb") if filename else None
+        self._head = bytearray()
+        self._tail = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+        space = self._head_size - len(self._head)
+        if space > 0:
+            self._head += data[:space]
+            data = data[space:]
+        if data:
+            self._tail += data
+            if len(self._tail) > self._tail_size:
+                del self._tail[: len(self._tail) - self._tail_size]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def text(self):
+        """Get the kept output, with a note of what was left out"""
+        head = self._head.decode(errors="replace")
+        tail = self._tail.decode(errors="replace")
+        omitted = self.size - len(self._head) - len(self._tail)
+        if not omitted:
+            return head + tail
+        where = f"; full output in {self.filename}" if self.filename else ""
+        return f"{head}\n[... {omitted} bytes omitted{where} ...]\n{tail}"
+
+
+def _pump(stream, capture):
+    with stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            capture.write(chunk)
+    capture.close()
+
+
+def open_captures(limit, log_prefix=None):
+    """Create the (stdout, stderr) captures for a command"""
+    if log_prefix is None:
+        return StreamCapture(limit), StreamCapture(limit)
+    return (
+        StreamCapture(limit, f"{log_prefix}.stdout"),
+        StreamCapture(limit, f"{log_prefix}.stderr"),
+    )
+
+
+def run_streaming(command, limit, cwd=None, log_prefix=None, timeout=None, env=None):
+    """Run a command, keeping a bounded amount of its output in memory.
+
+    The command is started in its own session, so that if it runs out of
+    time (or pytest is interrupted) everything it started is stopped too.
+
+    Args:
+        command: The command and arguments to run
+        limit: The most bytes of each stream to keep for the report, or
+            None to keep everything
+        cwd: The working directory to run in, or the current one if None
+        log_prefix: If given, the complete output is written to files
+            named with this prefix and .stdout/.stderr
+        timeout: Seconds to let the command run for, if limited
+        env: The environment to run the command in, if not this one
+
+    Returns:
+        CommandResult: With the kept output. stderr is only empty if the
+            command wrote nothing to it at all.
+    """
+    stdout, stderr = open_captures(limit, log_prefix)
+    process = subprocess.Popen(
+        [str(x) for x in command],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    threads = [
+        threading.Thread(target=_pump, args=(process.stdout, stdout), daemon=True),
+        threading.Thread(target=_pump, args=(process.stderr, stderr), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    timed_out = False
+    usage = None
+    try:
+        try:
+            usage = wait_with_usage(process, timeout)
+            exitcode = process.returncode
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            terminate_group(process)
+            exitcode = process.returncode
+        for thread in threads:
+            # Something that left the process group could hold the pipes open
+            thread.join(KILL_GRACE if timed_out else None)
+    except BaseException:
+        terminate_group(process)
+        raise
+    return CommandResult(exitcode, stdout.text(), stderr.text(), timed_out, usage)
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import contextlib
+import sys
+import time
+
+
+class _TimingLoader:
+    """Wraps a module loader to time creating and executing the module"""
+
+    def __init__(self, loader, name, profiler):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        if not hasattr(self._loader, "create_module"):
+            return None
+        with self._profiler.timing(self._name):
+            return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timing(self._name):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ProfilingFinder:
+    """A meta path finder that wraps the loaders found by the other finders"""
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+        self._searching = False
+
+    def find_spec(self, name, path, target=None):
+        if self._searching:
+            return None
+        self._searching = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._searching = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimingLoader(spec.loader, name, self._profiler)
+        return spec
+
+
+class ImportProfiler:
+    """Measures the modules imported, and the time spent in each, while active.
+
+    Times are exclusive of nested imports, so they add up to the total cost.
+    """
+
+    def __init__(self):
+        # Module name to exclusive import time
+        self.modules = {}
+        self._stack = []
+        self._finder = _ProfilingFinder(self)
+
+    @contextlib.contextmanager
+    def timing(self, name):
+        # Each entry is [name, start time, time spent in nested imports]
+        self._stack.append([name, time.perf_counter(), 0.0])
+        try:
+            yield
+        finally:
+            name, start, nested = self._stack.pop()
+            elapsed = time.perf_counter() - start
+            self.modules[name] = self.modules.get(name, 0.0) + elapsed - nested
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self._finder)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.meta_path.remove(self._finder)
+
+
+class CollectionRecord:
+    """How long it took to read one run_tests.py.
+
+    For files read ahead of collection in a worker process, this includes
+    the time the worker took.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.method = None
+        self.seconds = 0.0
+        self.imports = {}
+
+
+class CollectionProfile:
+    """Accumulates timings for reading every run_tests.py in a session"""
+
+    def __init__(self):
+        self.records = []
+        # Wall time spent reading ahead in a process pool, if one was used
+        self.pool_seconds = None
+        self.pool_workers = 0
+        # Time each worker spent reading each file, by path
+        self.pool_times = {}
+
+    def add_pool(self, seconds, workers, times):
+        """Record reading run_tests.py files ahead in a process pool.
+
+        Args:
+            seconds: The wall time from starting the pool to it finishing
+            workers: How many processes it used
+            times: The seconds spent reading each file, by path
+        """
+        self.pool_seconds = seconds
+        self.pool_workers = workers
+        self.pool_times.update((str(path), x) for path, x in times.items())
+
+    @contextlib.contextmanager
+    def measure(self, path):
+        record = CollectionRecord(path)
+        profiler = ImportProfiler()
+        start = time.perf_counter()
+        try:
+            with profiler:
+                yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            if record.method == "pool":
+                record.seconds += self.pool_times.get(str(path), 0.0)
+            record.imports = profiler.modules
+            self.records.append(record)
+
+    def report(self, write_line, top=15):
+        """Write a summary table of the slowest run_tests.py and imports.
+
+        Args:
+            write_line: Called with each line of the report
+            top: How many of the slowest imported modules to list
+        """
+        total = sum(x.seconds for x in self.records)
+        write_line(f"Read {len(self.records)} run_tests.py in {total:.2f}s")
+        if self.pool_seconds is not None:
+            write_line(
+                f"Read {len(self.pool_times)} ahead of collection in "
+                f"{self.pool_seconds:.2f}s wall with {self.pool_workers} processes "
+                f"({sum(self.pool_times.values()):.2f}s in the workers)"
+            )
+        write_line(f"{'seconds':>8} {'method':>7} {'imports':>7} {'import s':>8}  path")
+        for record in sorted(self.records, key=lambda x: -x.seconds):
+            write_line(
+                f"{record.seconds:8.3f} {record.method or '-':>7} "
+                f"{len(record.imports):7d} {sum(record.imports.values()):8.3f}  "
+                f"{record.path}"
+            )
+
+        modules = {}
+        for record in self.records:
+            for name, seconds in record.imports.items():
+                modules[name] = modules.get(name, 0.0) + seconds
+        if modules:
+            write_line("")
+            write_line(f"Slowest of {len(modules)} modules imported:")
+            for name, seconds in sorted(modules.items(), key=lambda x: -x[1])[:top]:
+                write_line(f"{seconds:8.3f}  {name}")
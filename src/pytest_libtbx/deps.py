@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import logging
+import os
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+DEPS_KEY = "libtbx/dependencies"
+# Where subprocesses started with bootstrap_environment write what they used
+DEPS_FILE_VARIABLE = "PYTEST_LIBTBX_DEPS_FILE"
+# Where they write their collapsed stacks, if profiling
+PROFILE_FILE_VARIABLE = "PYTEST_LIBTBX_PROFILE_FILE"
+# Directory containing the sitecustomize that records in subprocesses
+BOOTSTRAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_bootstrap")
+
+
+def bootstrap_environment(deps_file, environ=os.environ, profile_file=None):
+    """Get the environment for a subprocess to record its dependencies.
+
+    Every python process started with it, and that inherits it, appends the
+    files it used to deps_file when it exits; and if profile_file is given,
+    its sampled stacks to that too.
+
+    Args:
+        deps_file: Where to write the files used, or None to not record them
+        environ: The environment the subprocess would otherwise get
+        profile_file: Where to write the collapsed stacks, if profiling
+
+    Returns:
+        dict: The variables to add to the environment
+    """
+    paths = [BOOTSTRAP_DIR] + [x for x in [environ.get("PYTHONPATH")] if x]
+    environment = {"PYTHONPATH": os.pathsep.join(paths)}
+    if deps_file is not None:
+        environment[DEPS_FILE_VARIABLE] = str(deps_file)
+    if profile_file is not None:
+        environment[PROFILE_FILE_VARIABLE] = str(profile_file)
+    return environment
+
+
+def read_deps_file(deps_file):
+    """Read the files recorded by subprocesses, removing the record"""
+    try:
+        with open(deps_file) as f:
+            files = {x.rstrip("\n") for x in f if x.strip()}
+        os.unlink(deps_file)
+    except FileNotFoundError:
+        return set()
+    return files
+
+
+class DependencyIndex:
+    """The source files that each test was seen to use, kept between sessions.
+
+    Stored compactly as a table of file paths, with each test listing
+    indices into the table. Only tests whose files changed are written, and
+    they are merged into whatever is stored when saving, so parallel
+    workers don't drop each other's records.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._tests = {}
+        self._updated = {}
+        if store is not None:
+            self._tests = self._load()
+
+    def _load(self):
+        data = self._store.get(DEPS_KEY, None) or {}
+        files = data.get("files", [])
+        return {
+            nodeid: {files[x] for x in indices}
+            for nodeid, indices in data.get("tests", {}).items()
+        }
+
+    def record(self, nodeid, files):
+        files = set(files)
+        if self._tests.get(nodeid) != files:
+            self._tests[nodeid] = self._updated[nodeid] = files
+
+    def files_for(self, nodeid):
+        """Get the recorded files for a test, or None if never recorded"""
+        return self._tests.get(nodeid)
+
+    def save(self):
+        if self._store is None or not self._updated:
+            return
+        tests = self._load()
+        tests.update(self._updated)
+        files = sorted(set().union(*tests.values()))
+        lookup = {name: index for index, name in enumerate(files)}
+        self._store.set(
+            DEPS_KEY,
+            {
+                "files": files,
+                "tests": {
+                    nodeid: sorted(lookup[x] for x in test_files)
+                    for nodeid, test_files in tests.items()
+                },
+            },
+        )
+        self._updated = {}
+
+
+def _git(root, *args):
+    return subprocess.run(
+        ["git", "-C", str(root), *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def changed_paths(spec, roots):
+    """Work out which files have changed.
+
+    Args:
+        spec: Either a file containing a list of changed paths, one per
+            line, or a git ref to compare the working tree against.
+        roots: The directories to look in for git repositories
+
+    Returns:
+        A set of absolute paths. If a repository can't be compared against
+        the ref, the repository root is returned so that everything inside
+        it counts as changed.
+    """
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            return {os.path.abspath(x.strip()) for x in f if x.strip()}
+
+    toplevels = set()
+    for root in roots:
+        try:
+            toplevels.add(_git(root, "rev-parse", "--show-toplevel").strip())
+        except (OSError, subprocess.CalledProcessError):
+            logger.debug("%s is not in a git repository", root)
+
+    changed = set()
+    for toplevel in toplevels:
+        try:
+            names = _git(toplevel, "diff", "--name-only", spec, "--").splitlines()
+            names += _git(
+                toplevel, "ls-files", "--others", "--exclude-standard"
+            ).splitlines()
+        except subprocess.CalledProcessError as e:
+            logger.warning(
+                "Could not compare %s against %s; treating all as changed: %s",
+                toplevel,
+                spec,
+                e.stderr.strip(),
+            )
+            changed.add(toplevel)
+            continue
+        changed.update(os.path.join(toplevel, x) for x in names if x)
+    return changed
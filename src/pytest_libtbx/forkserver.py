@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import resource
+import runpy
+import signal
+import sys
+import tempfile
+import traceback
+
+from .timeouts import KILL_GRACE, signal_group
+
+logger = logging.getLogger(__name__)
+
+# Modules imported once in the fork server, so that each test doesn't need to
+DEFAULT_PRELOAD = ["libtbx.load_env", "scitbx", "cctbx"]
+
+
+class ForkResult:
+    """The outcome of running a script in a forked child"""
+
+    def __init__(
+        self,
+        exitcode,
+        stdout,
+        stderr,
+        error=None,
+        usage=None,
+        timed_out=False,
+        files=None,
+    ):
+        self.exitcode = exitcode
+        self.stdout = stdout
+        self.stderr = stderr
+        # The formatted traceback, if the script raised an exception
+        self.error = error
+        # (user, system, peak RSS bytes) used by the child, if it reported it
+        self.usage = usage
+        # Whether the child was killed for running too long
+        self.timed_out = timed_out
+        # The source files the script used, if recording dependencies
+        self.files = files
+
+    @property
+    def signal(self):
+        """The signal that killed the child, if any"""
+        if self.exitcode is not None and self.exitcode < 0:
+            return signal.Signals(-self.exitcode)
+        return None
+
+
+def _redirect(fd, path):
+    new_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(new_fd, fd)
+    os.close(new_fd)
+
+
+def _run_script(
+    conn, script, argv, cwd, stdout_path, stderr_path, record_deps, profile_file
+):
+    """Run a script as __main__. Runs in the forked child."""
+    # Lead a new process group, so anything the script starts can be killed
+    os.setsid()
+    _redirect(1, stdout_path)
+    _redirect(2, stderr_path)
+    os.chdir(cwd)
+    sys.argv = list(argv)
+    # TBX RULE: Tests rely on old relative-import behaviour
+    sys.path.insert(0, os.path.dirname(script))
+
+    error = None
+    recorder = None
+    if record_deps:
+        from .record import DependencyRecorder
+
+        recorder = DependencyRecorder().__enter__()
+    profiler = None
+    if profile_file:
+        from .profiler import SamplingProfiler
+
+        profiler = SamplingProfiler(root_filename=script).__enter__()
+    try:
+        runpy.run_path(script, run_name="__main__")
+        exitcode = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            exitcode = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            exitcode = 1
+    except BaseException:
+        error = traceback.format_exc()
+        exitcode = 1
+    if profiler is not None:
+        profiler.__exit__(None, None, None)
+        profiler.write(profile_file)
+    files = None
+    if recorder is not None:
+        recorder.__exit__(None, None, None)
+        files = sorted(recorder.files)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    conn.send(
+        (
+            exitcode,
+            error,
+            (usage.ru_utime, usage.ru_stime, usage.ru_maxrss * 1024),
+            files,
+        )
+    )
+    conn.close()
+
+
+class ForkServerRunner:
+    """Runs python scripts in children forked from a preloaded fork server.
+
+    The heavy libtbx imports are done once in the fork server process, so
+    each test is isolated in its own process without paying the startup
+    cost again. A crashing extension module only takes out that child.
+    """
+
+    def __init__(self, preload=None):
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(
+            DEFAULT_PRELOAD if preload is None else list(preload)
+        )
+
+    def run(
+        self, script, argv, cwd, timeout=None, record_deps=False, profile_file=None
+    ) -> ForkResult:
+        """Run a python script in a fresh forked child.
+
+        Args:
+            script: Path to the python script to run as __main__
+            argv: The value of sys.argv for the script
+            cwd: The working directory to run in
+            timeout: Seconds to let the script run for, after which the
+                child and any processes it started are killed
+            record_deps: Whether to record the source files the script uses
+            profile_file: If given, the script is profiled and its collapsed
+                stacks appended to this file
+
+        Returns:
+            The exit status and captured output of the script
+        """
+        stdout_fd, stdout_path = tempfile.mkstemp(prefix="libtbx-stdout-")
+        stderr_fd, stderr_path = tempfile.mkstemp(prefix="libtbx-stderr-")
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_script,
+            args=(
+                sender,
+                str(script),
+                list(argv),
+                str(cwd),
+                stdout_path,
+                stderr_path,
+                record_deps,
+                profile_file,
+            ),
+        )
+        timed_out = False
+        try:
+            process.start()
+            sender.close()
+            exitcode, error, usage, files = None, None, None, None
+            if receiver.poll(timeout):
+                try:
+                    # Read before joining, so a large traceback can't block it
+                    exitcode, error, usage, files = receiver.recv()
+                except EOFError:
+                    # The child died without reporting back e.g. a segfault
+                    pass
+            else:
+                timed_out = True
+                signal_group(process.pid, signal.SIGTERM)
+                process.join(KILL_GRACE)
+                signal_group(process.pid, signal.SIGKILL)
+                # In case it timed out before it could start its own group
+                process.kill()
+            process.join()
+            if exitcode is None:
+                exitcode = process.exitcode
+            with open(stdout_path, errors="replace") as f:
+                stdout = f.read()
+            with open(stderr_path, errors="replace") as f:
+                stderr = f.read()
+        finally:
+            receiver.close()
+            os.unlink(stdout_path)
+            os.unlink(stderr_path)
+        return ForkResult(exitcode, stdout, stderr, error, usage, timed_out, files)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+HISTORY_KEY = "libtbx/history"
+# Weight given to the newest measurement when updating running averages
+SMOOTHING = 0.5
+
+
+class TestHistory:
+    """Per-test measurements kept between sessions in the pytest cache.
+
+    Each record is keyed on the test nodeid and holds a smoothed duration
+    and the run_tests.py file (group) that the test was listed in.
+    """
+
+    __test__ = False
+
+    def __init__(self, store):
+        """
+        Args:
+            store: A pytest config.cache-like object, or None to only keep
+                history for the current session
+        """
+        self._store = store
+        self._records = {}
+        self._dirty = False
+        if store is not None:
+            self._records = store.get(HISTORY_KEY, None) or {}
+
+    def __contains__(self, nodeid):
+        return nodeid in self._records
+
+    def record(self, nodeid, duration, group=None):
+        """Record the wall time that a test took to run"""
+        record = self._records.setdefault(nodeid, {})
+        if "duration" in record:
+            duration = SMOOTHING * duration + (1 - SMOOTHING) * record["duration"]
+        record["duration"] = duration
+        if group is not None:
+            record["group"] = group
+        self._dirty = True
+
+    def duration(self, nodeid, default=None):
+        return self._records.get(nodeid, {}).get("duration", default)
+
+    def group(self, nodeid):
+        return self._records.get(nodeid, {}).get("group")
+
+    def save(self):
+        """Write any changes back to the persistent store"""
+        if self._store is None or not self._dirty:
+            return
+        self._store.set(HISTORY_KEY, self._records)
+        self._dirty = False
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from .pathindex import PathIndex
+from .runmode import RUN_MODES
+
+# Rules that always apply, in the same format as the libtbx_mark_rules ini option
+BUILTIN_RULES = [
+    "xfail libtbx/test_utils/__init__.py "
+    "libtbx/test_utils/__init__.py, insanely, asserts on stack trace length",
+    "skip dials_regression dials_regression has no tests",
+    "requires-env=MMTBX_CCP4_MONOMER_LIB|CLIBD_MON mmtbx "
+    "No monomer library - set MMTBX_CCP4_MONOMER_LIB or CLIBD_MON",
+]
+
+
+class MarkRules:
+    """Marks to apply to libtbx tests based on the location of the test file.
+
+    Built once per session, so that each test only needs a path prefix
+    lookup rather than querying the libtbx environment.
+    """
+
+    def __init__(self):
+        self._index = PathIndex()
+
+    def add(self, path, mark):
+        """Apply a mark to every test at or below a path"""
+        marks = self._index.get(path)
+        if marks is None:
+            marks = []
+            self._index.add(path, marks)
+        marks.append(mark)
+
+    def marks_for(self, path) -> list:
+        """Get all the marks that apply to a test file"""
+        return [mark for marks in self._index.lookup(path) for mark in marks]
+
+    def add_rule(self, rule, env, rootdir, environ=os.environ):
+        """Parse and add a rule.
+
+        Rules are of the form '<action> <path> [reason]', where action is
+        'skip', 'xfail', 'requires-env=VAR[|VAR...]' (skip unless any of
+        the environment variables are set), 'timeout=SECONDS' or
+        'run-mode=MODE' (how to run python scripts). If the first part of the path is
+        a libtbx module name then the path is relative to that module,
+        otherwise it is relative to the rootdir.
+
+        Args:
+            rule: The rule string
+            env: The libtbx environment
+            rootdir: The directory relative paths are taken from
+            environ: The environment variables to check
+        """
+        parts = rule.split(None, 2)
+        if len(parts) < 2:
+            raise pytest.UsageError(f"Invalid libtbx mark rule: {rule!r}")
+        action, path = parts[:2]
+        reason = parts[2] if len(parts) > 2 else f"libtbx mark rule: {rule}"
+
+        module = path.replace("\\", "/").split("/")[0]
+        if env.has_module(module):
+            path = os.path.join(str(env.dist_path(module)), path[len(module) + 1 :])
+        elif not os.path.isabs(path):
+            path = os.path.join(str(rootdir), path)
+
+        if action == "skip":
+            self.add(path, pytest.mark.skip(reason=reason))
+        elif action == "xfail":
+            self.add(path, pytest.mark.xfail(reason=reason))
+        elif action.startswith("requires-env="):
+            variables = action.split("=", 1)[1].split("|")
+            if not any(x in environ for x in variables):
+                self.add(path, pytest.mark.skip(reason=reason))
+        elif action.startswith("timeout="):
+            try:
+                seconds = float(action.split("=", 1)[1])
+            except ValueError:
+                raise pytest.UsageError(f"Invalid libtbx mark rule timeout: {rule!r}")
+            self.add(path, pytest.mark.libtbx_timeout(seconds))
+        elif action.startswith("run-mode="):
+            mode = action.split("=", 1)[1]
+            if mode not in RUN_MODES:
+                raise pytest.UsageError(f"Invalid libtbx mark rule run mode: {rule!r}")
+            self.add(path, pytest.mark.libtbx_run_mode(mode))
+        else:
+            raise pytest.UsageError(f"Unknown libtbx mark rule action: {action!r}")
+
+    @classmethod
+    def from_config(cls, config, env):
+        """Build the rules from the built-ins and the libtbx_mark_rules option"""
+        rules = cls()
+        for rule in BUILTIN_RULES:
+            # Only apply built-in rules to modules that are configured
+            if env.has_module(rule.split()[1].split("/")[0]):
+                rules.add_rule(rule, env, config.rootpath)
+        for rule in config.getini("libtbx_mark_rules"):
+            rules.add_rule(rule, env, config.rootpath)
+        return rules
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import os
+
+
+def _key(path):
+    return os.path.normpath(str(path))
+
+
+class PathIndex:
+    """A collection of paths that can be queried for prefixes of a path.
+
+    Checking whether any stored path contains a query path walks up the
+    query's parent directories with a hash lookup for each, so costs
+    O(depth) regardless of how many paths are stored. Each path can
+    optionally carry a value.
+    """
+
+    def __init__(self, paths=()):
+        self._paths = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path, value=None):
+        self._paths[_key(path)] = value
+
+    def get(self, path, default=None):
+        """Get the value stored for this exact path"""
+        return self._paths.get(_key(path), default)
+
+    def discard(self, path):
+        self._paths.pop(_key(path), None)
+
+    def clear(self):
+        self._paths.clear()
+
+    def __contains__(self, path):
+        """Is this exact path in the index"""
+        return _key(path) in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def _ancestors(self, path):
+        """Yield the stored paths that are, or contain, the given path"""
+        key = _key(path)
+        while True:
+            if key in self._paths:
+                yield key
+            parent = os.path.dirname(key)
+            if parent == key:
+                return
+            key = parent
+
+    def covers(self, path) -> bool:
+        """Is the path, or any of its parents, in the index"""
+        return next(self._ancestors(path), None) is not None
+
+    def lookup(self, path) -> list:
+        """Get the values for every stored path containing this path.
+
+        Returns:
+            The values, outermost path first
+        """
+        return [self._paths[x] for x in self._ancestors(path)][::-1]
@@ -1,36 +1,114 @@
 from __future__ import annotations
 
+import collections
+import contextlib
+import fnmatch
 import importlib
+import importlib.util
 import logging
 import os
-import runpy
 import shlex
 import sys
+import time
+from typing import TYPE_CHECKING
 
-import _pytest.fixtures as fixtures
-import procrunner
 import py.path
 import pytest
-import six
 
-try:
-    import libtbx.load_env
-except ImportError:
-    libtbx = None
-
-from .fake_env import CustomRuntestsEnvironment
+from .capture import parse_size
+from .history import TestHistory
+from .pathindex import PathIndex
+from .runmode import RUN_MODES
+from .runtests import RunTestsInfo, TestSpec
+from .shared import CLONE_METHODS, SharedData
+
+# Everything else is imported where it's used, so that sessions that don't
+# involve libtbx (or don't use a feature) don't pay for importing it
+if TYPE_CHECKING:
+    from .async_runner import AsyncCommandRunner
+    from .bytecode import CodeCache
+    from .cache import RunTestsCache
+    from .collect_profile import CollectionProfile
+    from .deps import DependencyIndex
+    from .forkserver import ForkServerRunner
+    from .marks import MarkRules
+    from .results import ResultCache
+    from .runmode import RunModePolicy
+    from .timings import TimingsWriter
+    from .tmpdirs import TempDirPool
+
+# The libtbx package, once the environment has been loaded
+libtbx = None
 
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Every libtbx test runs in its own temporary directory
+_USE_TMPDIR = pytest.mark.usefixtures("tmpdir")
+
+# Whether the libtbx environment loaded, or None if not tried yet
+_libtbx_loaded: bool | None = None
+# The directory containing the libtbx distribution, found without importing it
+_libtbx_root: str | None = None
+# The config of the running session, for setting up libtbx when needed
+_session_config = None
+# The absolute paths that pytest was asked to collect
+_collection_paths: list[str] = []
 # Module paths we are deliberately ignoring
-_tbx_pytest_ignore_roots: set[py.path.local] = set()
+_tbx_pytest_ignore_roots = PathIndex()
 # Dirs that have already been checked for a run_tests.py
 _collected_dirs = set()
 # run_tests.py that have been found and read but not 'collected' yet
 _precollected_runtests = {}
 # Paths to every configured libtbx module so we don't try to run unused modules
-_valid_libtbx_module_paths = set()
+_valid_libtbx_module_paths = PathIndex()
+# Fixture information shared between tests, by parent node and usefixtures
+_fixtureinfo_cache = {}
+# run_tests.py contents read ahead of collection by a process pool
+_preextracted = {}
+# Persistent store of run_tests.py contents, so we don't need to import them
+_runtests_cache: RunTestsCache | None = None
+# Whether to try reading run_tests.py without importing it
+_static_collection = True
+# Source files used by each test, for working out what changes affect
+_dependencies: DependencyIndex | None = None
+# Tests that passed in previous sessions, if skipping unchanged tests
+_results: ResultCache | None = None
+# Marks to apply to tests based on their location
+_mark_rules: MarkRules | None = None
+# Timings of reading each run_tests.py, if requested
+_collection_profile: CollectionProfile | None = None
+# Fork server for running isolated python tests, created when first needed
+_forkserver: ForkServerRunner | None = None
+# Compiled test scripts, so parameterised tests don't each recompile
+_code_cache: CodeCache | None = None
+# Reused working directories for tests, if not using the tmpdir fixture
+_tmpdirs: TempDirPool | None = None
+# Prepared data directories that tests start from
+_shared_data: SharedData | None = None
+# Background runner for external commands, if running them concurrently
+_async_runner: AsyncCommandRunner | None = None
+# External command tests yet to be started ahead of their turn, in the order
+# they will run, as (position in the session, item); not used under xdist
+_launch_queue: collections.deque = collections.deque()
+# Tests started ahead that haven't had their turn yet, in the same form
+_launched_ahead: collections.deque = collections.deque()
+# The position of each item in the session
+_item_positions: dict = {}
+# Resource use of each test, as user_properties dicts, if reporting
+_resource_reports: list[tuple[str, dict]] | None = None
+# The profiles written by tests, to say where they are
+_profile_files: list[str] = []
+# Learnt choices of how to run each python script, with --libtbx-run-mode=auto
+_run_modes: RunModePolicy | None = None
+# Whether to add the script, parameters and run mode to user_properties
+_detailed_properties = False
+# Writer for the per-test timings export, if requested
+_timings: TimingsWriter | None = None
+# Recorded durations of libtbx tests from previous sessions
+_history: TestHistory | None = None
+# Total duration of the tests currently running, once their call has passed
+_running_durations: dict[str, float] = {}
 
 
 def _get_libtbx_module_list() -> dict[str, set[py.path.local]] | None:
@@ -68,15 +146,118 @@ def _block_xfel_module():
         _valid_libtbx_module_paths.discard(xfel_root)
 
 
+def _find_libtbx_root():
+    """Find the directory that the libtbx distribution lives in, if any.
+
+    This only locates the libtbx package, without importing it or loading
+    the environment. libtbx lives in <modules>/cctbx_project/libtbx, so this
+    is the <modules> directory; any configured module is usually within it.
+    """
+    try:
+        spec = importlib.util.find_spec("libtbx")
+    except ValueError:
+        # Already imported, without a spec; so it could be anywhere
+        return os.path.abspath(os.sep)
+    if spec is None or not spec.origin:
+        return None
+    return os.path.dirname(os.path.dirname(os.path.dirname(spec.origin)))
+
+
 def pytest_sessionstart(session):
     """Start the pytest session.
 
+    The libtbx environment isn't loaded until collection reaches somewhere
+    that could be part of it (see _libtbx_active), because loading it is
+    expensive and most pytest sessions never need it.
+    """
+    global _history, _fixtureinfo_cache, _tmpdirs, _session_config
+    global _libtbx_loaded, _libtbx_root, _run_modes, _collection_paths
+    _fixtureinfo_cache = {}
+    _session_config = session.config
+    invocation_dir = str(session.config.invocation_params.dir)
+    _collection_paths = [
+        os.path.abspath(os.path.join(invocation_dir, x.split("::")[0]))
+        for x in session.config.args
+    ]
+    _libtbx_loaded = None
+    _libtbx_root = _find_libtbx_root()
+    _history = TestHistory(getattr(session.config, "cache", None))
+    if session.config.getoption("--libtbx-run-mode") == "auto":
+        from .runmode import RunModePolicy
+
+        _run_modes = RunModePolicy(getattr(session.config, "cache", None))
+    if session.config.getoption("--libtbx-tmp-base"):
+        from .tmpdirs import TempDirPool
+
+        _tmpdirs = TempDirPool(session.config.getoption("--libtbx-tmp-base"))
+
+
+def _within(path, directory):
+    """Is a path the same as, or inside, a directory"""
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _libtbx_active(path):
+    """Should this path be treated as possibly part of a libtbx distribution.
+
+    Loads the libtbx environment the first time this is true.
+    """
+    if _libtbx_loaded is not None:
+        return _libtbx_loaded
+    if _libtbx_root is None:
+        return False
+    path = str(path)
+    if not _within(path, _libtbx_root):
+        return False
+    # pytest also asks about whatever is beside the paths it was given
+    if not any(_within(path, x) or _within(x, path) for x in _collection_paths):
+        return False
+    return _load_libtbx()
+
+
+def _load_libtbx():
+    """Load the libtbx environment and set up the session for it.
+
     Use this to introspect libtbx and work out the locations/exclusions.
+
+    Returns:
+        bool: Whether the libtbx environment could be loaded
     """
-    configured_modules = set()
-    if libtbx is None:
+    global libtbx, _libtbx_loaded
+    global _runtests_cache, _static_collection, _collection_profile
+    global _mark_rules, _dependencies, _results
+    if _libtbx_loaded is not None:
+        return _libtbx_loaded
+    _libtbx_loaded = False
+    config = _session_config
+    try:
+        import libtbx.load_env  # noqa: F401
+    except ImportError:
         logger.warning("Cannot read libtbx environment. Not allowing any modules.")
-        return
+        return False
+    _libtbx_loaded = True
+
+    from .cache import RunTestsCache, libtbx_env_fingerprint
+    from .deps import DependencyIndex
+    from .marks import MarkRules
+
+    configured_modules = set()
+    fingerprint = libtbx_env_fingerprint(libtbx.env)
+    store = None
+    if not config.getoption("--libtbx-no-collect-cache"):
+        store = getattr(config, "cache", None)
+    _runtests_cache = RunTestsCache(store, fingerprint)
+    _static_collection = config.getoption("--libtbx-collect") == "static"
+    if config.getoption("--libtbx-collect-profile"):
+        from .collect_profile import CollectionProfile
+
+        _collection_profile = CollectionProfile()
+    _mark_rules = MarkRules.from_config(config, libtbx.env)
+    _dependencies = DependencyIndex(getattr(config, "cache", None))
+    if config.getoption("--libtbx-result-cache"):
+        from .results import ResultCache
+
+        _results = ResultCache(getattr(config, "cache", None), fingerprint)
 
     for name, path in libtbx.env.module_dist_paths.items():
         _valid_libtbx_module_paths.add(py.path.local(abs(path)))
@@ -110,16 +291,130 @@ def pytest_sessionstart(session):
     except KeyError:
         pass
 
+    workers = config.getoption("--libtbx-collect-workers")
+    # xdist workers already collect in parallel with each other
+    if workers and not hasattr(config, "workerinput"):
+        _preextract_run_tests(workers)
+    return True
+
+
+def _preextract_run_tests(workers):
+    """Read every configured module's run_tests.py ahead of collection.
+
+    Anything not already cached is read concurrently in a process pool,
+    so that collection doesn't stall on each import in turn.
+    """
+    from .preextract import extract_all
+
+    pending = []
+    for module_path in _valid_libtbx_module_paths:
+        run_tests = py.path.local(module_path) / "run_tests.py"
+        if run_tests.isfile() and not (
+            _runtests_cache and _runtests_cache.get(run_tests, _static_collection)
+        ):
+            pending.append(run_tests)
+    if len(pending) < 2:
+        # Not worth starting a pool for
+        return
+    workers = min(workers, len(pending))
+    logger.info("Reading %d run_tests.py in %d processes", len(pending), workers)
+    times = {}
+    start = time.perf_counter()
+    _preextracted.update(
+        extract_all(pending, workers, static=_static_collection, times=times)
+    )
+    if _collection_profile is not None:
+        _collection_profile.add_pool(time.perf_counter() - start, workers, times)
+
 
 def _read_run_tests(path):
     """
-    Read a libtbx run_tests file and return the module object
+    Read a libtbx run_tests file and return the test lists inside it
+
+    Arguments:
+        path (py.path): The run_tests.py file to read
+
+    Returns:
+        RunTestsInfo: The tests listed, or None if it's not configured
+    """
+    if _collection_profile is not None:
+        with _collection_profile.measure(path) as record:
+            info, record.method = _extract_run_tests(path)
+    else:
+        info, _ = _extract_run_tests(path)
+
+    # If we didn't run discover, we can't trust that files are named properly.
+    # We can probably extract this information even if not configured
+    if not info.ran_discover:
+        logger.info("%s didn't run discover so ignoring for collection", path)
+        _tbx_pytest_ignore_roots.add(path.dirpath())
+
+    return info
+
+
+def _extract_run_tests(path):
+    """
+    Get the test lists from a run_tests file, by the cheapest available method
 
     Arguments:
         path (py.path): The run_tests.py file to read
 
     Returns:
-        ModuleType: The run_tests module, or None if it's not configured
+        Tuple[RunTestsInfo, str]: The tests listed, and how they were read
+    """
+    info = None
+    if _runtests_cache:
+        # With --libtbx-collect=import, lists read statically aren't trusted
+        info = _runtests_cache.get(path, _static_collection)
+    if info is not None:
+        logger.debug("Using cached test list for %s", path)
+        return info, "cache"
+
+    info = _preextracted.pop(path, None)
+    if info is not None:
+        if _runtests_cache:
+            # The worker doesn't say which way it read the file
+            _runtests_cache.set(path, info, _static_collection)
+        return info, "pool"
+
+    method = "static"
+    info = _static_run_tests(path) if _static_collection else None
+    if info is None:
+        method = "import"
+        info = _import_run_tests(path)
+    if _runtests_cache:
+        _runtests_cache.set(path, info, method == "static")
+    return info, method
+
+
+def _static_run_tests(path):
+    """
+    Read a libtbx run_tests file without executing it
+
+    Arguments:
+        path (py.path): The run_tests.py file to read
+
+    Returns:
+        RunTestsInfo: The tests listed, or None if it needs to be imported
+    """
+    from .static import Unresolvable, extract_static
+
+    try:
+        return extract_static(path.read_text("utf-8"), path.strpath)
+    except Unresolvable as e:
+        logger.info("Cannot statically read %s (%s); importing", path, e)
+        return None
+
+
+def _import_run_tests(path):
+    """
+    Import a libtbx run_tests file, intercepting any libtbx test functions
+
+    Arguments:
+        path (py.path): The run_tests.py file to import
+
+    Returns:
+        RunTestsInfo: The tests listed in the imported module
     """
     # Guess the module import path from the location of this file
     test_module = path.dirpath().basename
@@ -132,6 +427,8 @@ def _read_run_tests(path):
     # try:
     # Import, but intercept some of it's registration calls
     # try:
+    from .fake_env import CustomRuntestsEnvironment
+
     try:
         with CustomRuntestsEnvironment() as env:
             run_tests = importlib.import_module(module_import)
@@ -144,48 +441,35 @@ def _read_run_tests(path):
     #     if not module_configured:
     #         run_tests = None
 
-    # If we didn't run discover, we can't trust that files are named properly.
-    # We can probably extract this information even if not configured
-    if not env.ran_discover:
-        logger.info("%s didn't run discover so ignoring for collection", path)
-        _tbx_pytest_ignore_roots.add(path.dirpath())
-
-    # # if we aren't configured, we don't want to return a module at all
-    # if not module_configured:
-    #     return None
+    return RunTestsInfo.from_module(run_tests, env.ran_discover)
 
-    return run_tests
 
-
-def _test_from_list_entry(entry, runtests_file, parent):
+def _spec_from_list_entry(entry, runtests_file, build_dir=None, info=None):
     """
-    Create a LibTBXTest entry from a tst_list entry
+    Describe the test to create from a tst_list entry
 
     Arguments:
         entry (str or Iterable or Callable): The entry in the tst_list. This can
             be a string filename, a list of filename and arguments, or an
-            inline function call (which will be skipped).
+            inline function call or None (which will be skipped).
         file (py.path.local):   The run_tests filename that this entry was from
-
-        parent (pytest.Node):   The parent node for the test
+        build_dir (str):        The module build directory, to replace $B.
+            Looked up from the libtbx environment if not given.
+        info (RunTestsInfo):    The run_tests contents, for per-entry settings
 
     Returns:
-        LibTBXTest: The pytest test object to execute
+        TestSpec: The description of the pytest test object to create
     """
 
     # Accumulate markers to apply to the test
-    markers = [pytest.mark.usefixtures("tmpdir")]
+    markers = [_USE_TMPDIR] if _tmpdirs is None else []
 
     # Extract the file, parameter information
-    if isinstance(entry, six.string_types):
+    if isinstance(entry, str):
         testfile = entry
         testparams = []
         testname = "main"
-    elif hasattr(entry, "__iter__"):
-        testfile = entry[0]
-        testparams = [str(x) for x in entry[1:]]
-        testname = "_".join(str(p) for p in testparams)
-    elif callable(entry):
+    elif entry is None or callable(entry):
         # Only a couple of these cases exist and awkward enough that we
         # can afford to skip them
         markers.append(
@@ -196,82 +480,205 @@ def _test_from_list_entry(entry, runtests_file, parent):
         testfile = runtests_file.strpath
         testparams = []
         testname = "inline"
+    elif hasattr(entry, "__iter__"):
+        testfile = entry[0]
+        testparams = [str(x) for x in entry[1:]]
+        testname = "_".join(str(p) for p in testparams)
 
     # Expand the test file into a real path
     module = runtests_file.dirpath()
     # Convert any placeholder values to absolute paths
-    full_command = testfile.replace("$D", module.strpath).replace(
-        "$B", libtbx.env.under_build(module.basename)
-    )
-
-    # Handle hard-coded behaviour
-
-    # Hard-coded ignore tests
-    custom_test_marks = [
-        (
-            py.path.local(libtbx.env.dist_path("libtbx"))
-            / "test_utils"
-            / "__init__.py",
-            pytest.mark.xfail(
-                reason="libtbx/test_utils/__init__.py, insanely, asserts on stack trace length"
-            ),
-        )
-    ]
-    if libtbx.env.has_module("dials_regression"):
-        custom_test_marks.append(
-            (
-                py.path.local(libtbx.env.dist_path("dials_regression")),
-                pytest.mark.skip("dials_regression has no tests"),
-            )
-        )
-
-    for path, reason in custom_test_marks:
-        if path.common(py.path.local(full_command)) == path:
-            markers.append(reason)
-
-    # Skip anything in mmtbx if no monomer library present
-    if libtbx.env.has_module("mmtbx"):
-        lib = py.path.local(libtbx.env.dist_path("mmtbx"))
-        has_env = "MMTBX_CCP4_MONOMER_LIB" in os.environ or "CLIBD_MON" in os.environ
-        if py.path.local(full_command).common(lib) == lib and not has_env:
-            markers.append(
-                pytest.mark.skip(
-                    reason="No monomer library - set MMTBX_CCP4_MONOMER_LIB or CLIBD_MON"
-                )
+    if build_dir is None:
+        build_dir = libtbx.env.under_build(module.basename)
+    full_command = testfile.replace("$D", module.strpath).replace("$B", str(build_dir))
+
+    # Apply any marks e.g. hard-coded skips for this location
+    markers.extend(_mark_rules.marks_for(full_command))
+    # Per-entry settings go after the rules, so that they take precedence
+    if info is not None and testfile in info.timeouts:
+        markers.append(pytest.mark.libtbx_timeout(info.timeouts[testfile]))
+    if info is not None and testfile in info.run_modes:
+        mode = info.run_modes[testfile]
+        if mode not in RUN_MODES:
+            raise pytest.UsageError(
+                f"Unknown run mode {mode!r} for {testfile} in {runtests_file}"
             )
+        markers.append(pytest.mark.libtbx_run_mode(mode))
 
     # Generate a short path to use as the name
     # shortpath = testfile.replace("$D/", module.basename + "/").replace("$B/", module.basename+"/build/")
     shortpath = testfile.replace("$D/", "").replace("$B/", "build/")
-    # Create a file parent object
-    pytest_file_object = pytest.File(shortpath, parent)
     logger.info("Found libtbx test %s::%s", shortpath, testname)
 
-    test = LibTBXTest(
-        testname, pytest_file_object, full_command, testparams, markers=markers
+    return TestSpec(
+        testname, shortpath, full_command, testparams, markers, runtests_file
     )
 
-    return test
+
+def _get_forkserver(config):
+    """Get the session fork server, starting it if not already running"""
+    global _forkserver
+    if _forkserver is None:
+        from .forkserver import ForkServerRunner
+
+        _forkserver = ForkServerRunner(
+            config.getini("libtbx_forkserver_preload") or None
+        )
+    return _forkserver
+
+
+def _recording_dependencies(config):
+    """Should tests record the source files they use"""
+    return bool(config.getoption("--libtbx-record-deps") or _results is not None)
+
+
+def _record_dependencies(item, files):
+    """Save the libtbx module files that a test was seen to use"""
+    files = {x for x in files if _valid_libtbx_module_paths.covers(x)}
+    files.add(os.path.abspath(item.test_cmd))
+    _dependencies.record(item.nodeid, files)
+
+
+def _select_changed(config, items):
+    """Deselect libtbx tests that can't be affected by the changed files"""
+    spec = config.getoption("--libtbx-changed-since")
+    modules = PathIndex()
+    for path in _valid_libtbx_module_paths:
+        modules.add(path, path)
+    from .deps import changed_paths
+
+    changed = PathIndex(changed_paths(spec, list(modules)))
+    changed_modules = {module for path in changed for module in modules.lookup(path)}
+    logger.info(
+        "%d changed files in modules %s", len(changed), ", ".join(changed_modules)
+    )
+
+    selected, deselected = [], []
+    for item in items:
+        if not isinstance(item, LibTBXTest):
+            selected.append(item)
+            continue
+        files = _dependencies.files_for(item.nodeid)
+        if files is None:
+            # Never recorded, so assume it depends on everything in its module
+            affected = any(x in changed_modules for x in modules.lookup(item.origin))
+        else:
+            candidates = files | {item.test_cmd, str(item.origin)}
+            affected = any(changed.covers(x) for x in candidates)
+        (selected if affected else deselected).append(item)
+
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def _get_code_cache(config):
+    """Get the session cache of compiled test scripts"""
+    global _code_cache
+    if _code_cache is None:
+        from .bytecode import CodeCache
+
+        cache = getattr(config, "cache", None)
+        _code_cache = CodeCache(cache.mkdir("libtbx-bytecode") if cache else None)
+    return _code_cache
+
+
+def _get_shared_data(config):
+    """Get the session's shared prepared data directories"""
+    global _shared_data
+    if _shared_data is None:
+        _shared_data = SharedData(
+            config._tmp_path_factory.mktemp("libtbx-shared", numbered=True),
+            method=config.getoption("--libtbx-shared-clone"),
+        )
+    return _shared_data
+
+
+def _shared_setup_command(config, runtests_file, info, build_dir):
+    """Get the expanded shared setup command for a module, if it has one.
+
+    This is tst_shared_setup from the run_tests.py, unless overridden by
+    the libtbx_shared_setup ini option.
+    """
+    module = runtests_file.dirpath()
+    entry = info.shared_setup
+    for line in config.getini("libtbx_shared_setup"):
+        parts = shlex.split(line)
+        if len(parts) > 1 and parts[0] == module.basename:
+            entry = parts[1:]
+    if not entry:
+        return None
+    if isinstance(entry, str):
+        entry = [entry]
+    return [
+        str(x).replace("$D", module.strpath).replace("$B", str(build_dir))
+        for x in entry
+    ]
+
+
+def _safe_dirname(name):
+    """Make a test name usable as a directory name"""
+    return "".join(x if x.isalnum() or x in "-_." else "_" for x in name)[:64]
+
+
+def _profile_dir(config):
+    """Where to write test profiles: beside the junit report, if writing one,
+    otherwise in the session's base temporary directory"""
+    xmlpath = getattr(config.option, "xmlpath", None)
+    if xmlpath:
+        base = os.path.dirname(os.path.abspath(xmlpath))
+    else:
+        base = str(config._tmp_path_factory.getbasetemp())
+    return os.path.join(base, "libtbx-profiles")
 
 
 class LibTBXRunTestsFile(pytest.File):
     """A Collector to collect tests from run_tests.py"""
 
-    def __init__(self, path, run_tests, parent):
-        super().__init__(path, parent)
+    def __init__(self, *, run_tests, **kwargs):
+        super().__init__(**kwargs)
         self._run_tests = run_tests
         assert run_tests
 
     def collect(self):
-        # Collect each test in this file - if it has a test list
-        for test in self._run_tests.__dict__.get("tst_list", []):
-            yield _test_from_list_entry(test, self.fspath, self.parent)
-
+        # Only look this up once, rather than for every test
+        build_dir = libtbx.env.under_build(self.fspath.dirpath().basename)
+
+        info = self._run_tests
+        specs = [
+            _spec_from_list_entry(test, self.fspath, build_dir, info)
+            for test in info.tst_list
+        ]
         # Now, handle tst_list_slow
-        for test in self._run_tests.__dict__.get("tst_list_slow", []):
-            test = _test_from_list_entry(test, self.fspath, self.parent)
-            test.add_marker(pytest.mark.regression)
-            yield test
+        for test in info.tst_list_slow:
+            spec = _spec_from_list_entry(test, self.fspath, build_dir, info)
+            spec.markers.append(pytest.mark.regression)
+            specs.append(spec)
+
+        shared_setup = _shared_setup_command(
+            self.config, self.fspath, self._run_tests, build_dir
+        )
+
+        # Entries running the same script share a single file node
+        files = {}
+        for spec in specs:
+            spec.shared_setup = shared_setup
+            if spec.shortpath not in files:
+                files[spec.shortpath] = LibTBXScriptFile.from_parent(
+                    self.parent, path=self.path.parent / spec.shortpath
+                )
+            yield LibTBXTest.from_spec(spec, files[spec.shortpath])
+
+
+class LibTBXScriptFile(pytest.File):
+    """The script that a group of libtbx tests run, to hold them in the tree.
+
+    The tests are created when the run_tests.py is collected, so this
+    never collects anything itself.
+    """
+
+    def collect(self):
+        return []
 
 
 class LibTBXTestException(Exception):
@@ -279,9 +686,34 @@ class LibTBXTestException(Exception):
 
 
 class LibTBXTest(pytest.Item):
-    def __init__(self, name, parent, test_command, test_parameters, markers=None):
+    def __init__(
+        self,
+        name,
+        parent,
+        test_command,
+        test_parameters,
+        markers=None,
+        origin=None,
+        shared_setup=None,
+    ):
         super().__init__(name, parent)
         self.test_cmd = test_command
+        # The run_tests.py that listed this test
+        self.origin = origin
+        # Command preparing data to copy into the working directory, if any
+        self.shared_setup = shared_setup
+        # Interpreter state that running the test in-process changed
+        self.state_leaks = []
+        # Future result, if the external command was started in the background
+        self.launched = None
+        # Pooled working directory the background command was started in
+        self._launch_dir = None
+        # Where subprocesses write the files they used, if recording
+        self._deps_file = None
+        # Where the collapsed stacks are written, once profiling has started
+        self._profile_file = None
+        if origin is not None:
+            self.user_properties.append(("libtbx_origin", str(origin)))
 
         # Build the full list of arguments
         # test_parameters is a list, but this is pointless because the
@@ -289,52 +721,406 @@ class LibTBXTest(pytest.Item):
         # so it needs to be joined and re-shell-split anyway.
         self.test_params = shlex.split(" ".join(test_parameters))
         self.full_cmd = [self.test_cmd] + self.test_params
+        if _detailed_properties:
+            self.user_properties.append(("libtbx_script", self.test_cmd))
+            self.user_properties.append(("libtbx_params", self.test_params))
 
         for marker in markers:
             self.add_marker(marker)
 
-        # Handle fixtures from this test/for markers
-        self._fixtureinfo = self.session._fixturemanager.getfixtureinfo(
-            self, self.runtest, self
+    @classmethod
+    def from_spec(cls, spec, parent):
+        """Create the test described by a TestSpec"""
+        return cls.from_parent(
+            parent,
+            name=spec.name,
+            test_command=spec.command,
+            test_parameters=spec.params,
+            markers=spec.markers,
+            origin=spec.origin,
+            shared_setup=spec.shared_setup,
+        )
+
+    @property
+    def _fixtureinfo(self):
+        """Fixtures for this test/for markers.
+
+        Only worked out once a test is set up, so deselected tests never
+        need it, and shared between all tests with the same parent and
+        fixtures - which is nearly all tests in a module.
+        """
+        key = (
+            self.parent.nodeid,
+            tuple(
+                name
+                for marker in self.iter_markers(name="usefixtures")
+                for name in marker.args
+            ),
         )
+        info = _fixtureinfo_cache.get(key)
+        if info is None:
+            info = _fixtureinfo_cache[key] = (
+                self.session._fixturemanager.getfixtureinfo(self, None, None)
+            )
+        return info
+
+    @property
+    def fixturenames(self):
+        """Fixtures to fill before running, as for a test function"""
+        return self._fixtureinfo.names_closure
+
+    @property
+    def timeout(self):
+        """Seconds this test may run for, or None if unlimited.
+
+        The last libtbx_timeout mark applied wins; so a run_tests.py entry
+        overrides mark rules, which override --libtbx-timeout.
+        """
+        marks = [x for x in self.own_markers if x.name == "libtbx_timeout"]
+        if marks:
+            return marks[-1].args[0] or None
+        return self.config.getoption("--libtbx-timeout") or None
+
+    @property
+    def run_mode(self):
+        """How to run this test: 'inprocess', 'forkserver' or 'subprocess'.
+
+        Commands that aren't python scripts always run as a subprocess. For
+        scripts the last libtbx_run_mode mark applied wins, then the
+        --libtbx-run-mode option; which with 'auto' picks a mode from how
+        the script behaved when it was run before.
+        """
+        if not self.test_cmd.endswith(".py"):
+            return "subprocess"
+        marks = [x for x in self.own_markers if x.name == "libtbx_run_mode"]
+        if marks:
+            return marks[-1].args[0]
+        mode = self.config.getoption("--libtbx-run-mode")
+        if mode == "auto":
+            mode, reason = _run_modes.choose(self.test_cmd)
+            logger.debug("Running %s %s: %s", self.nodeid, mode, reason)
+        return mode
 
     def runtest(self):
         "Called by pytest to run the actual test"
 
-        # Build the tmpdir fixture request
+        if _results is not None and _results.passed(self.nodeid, self._result_key()):
+            # Nothing it depends on has changed since it last passed
+            self.user_properties.append(("libtbx_cached", True))
+            return
+
+        self._start_profile()
         self.funcargs = {}
-        request = fixtures.FixtureRequest(self)
-        request._fillfixtures()
+        if _tmpdirs is None:
+            # Build the tmpdir fixture request
+            import _pytest.fixtures as fixtures
+
+            request = fixtures.TopRequest(self, _ispytest=True)
+            request._fillfixtures()
+            workdir = str(self.funcargs["tmpdir"])
+        else:
+            workdir = _tmpdirs.acquire()
         # Switch to this function
-        self.funcargs["tmpdir"].chdir()
+        prior_cwd = os.getcwd()
+        os.chdir(workdir)
+
+        from .resources import ResourceMonitor
+
+        self._resource_monitor = ResourceMonitor()
+        passed = False
+        try:
+            if self.shared_setup:
+                _get_shared_data(self.config).prepare(self.shared_setup, os.getcwd())
+            mode = self.run_mode
+            if _detailed_properties:
+                self.user_properties.append(("libtbx_mode", mode))
+            with self._resource_monitor:
+                if mode == "subprocess":
+                    self._run_external()
+                elif mode == "forkserver":
+                    self._run_forkserver()
+                else:
+                    self._run_in_process()
+            passed = True
+        finally:
+            os.chdir(prior_cwd)
+            if _tmpdirs is not None:
+                keep_as = None if passed else _safe_dirname(self.name)
+                _tmpdirs.release(workdir, keep_as=keep_as)
+                if self._launch_dir is not None:
+                    _tmpdirs.release(self._launch_dir, keep_as=keep_as)
+            if _results is not None:
+                # Dependencies may have just been recorded, so key afterwards
+                key = self._result_key() if passed else None
+                _results.record(self.nodeid, key, passed)
+            usage = self._resource_monitor.usage
+            if usage is not None:
+                self.add_report_section("call", "resources", usage.format())
+                self.user_properties.extend(usage.as_properties())
+            self._finish_profile()
+
+    def _start_profile(self):
+        """Prepare to profile this test, if it matches --libtbx-profile"""
+        pattern = self.config.getoption("--libtbx-profile")
+        if self._profile_file is not None or not pattern:
+            return
+        if not fnmatch.fnmatchcase(self.nodeid, pattern):
+            return
+        import hashlib
+
+        # Node IDs can be long, so keep them apart by hash once truncated
+        digest = hashlib.sha1(self.nodeid.encode()).hexdigest()[:8]
+        directory = _profile_dir(self.config)
+        os.makedirs(directory, exist_ok=True)
+        self._profile_file = os.path.join(
+            directory, f"{_safe_dirname(self.nodeid)}-{digest}.collapsed"
+        )
+        # Every process appends to it, so clear any from an earlier session
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._profile_file)
 
-        if self.test_cmd.endswith(".py"):
-            # We are running a python script. Run it in-process for speed
-            # Save the old command line arguments
-            prior_argv = sys.argv
-            # TBX RULE: Tests rely on old relative-import behaviour
-            prior_path = list(sys.path)
-            dir_path = py.path.local(self.test_cmd).dirname
-            try:
-                sys.argv = self.full_cmd
-                sys.path.insert(0, dir_path)
-                runpy.run_path(self.test_cmd, run_name="__main__")
-            except SystemExit as e:
-                if e.code != 0:
-                    raise LibTBXTestException("Script exited with non-zero error code")
-            finally:
-                sys.argv = prior_argv
-                sys.path = prior_path
+    def _finish_profile(self):
+        """Tidy up the profile written by the test, and report where it is"""
+        if self._profile_file is None or not os.path.exists(self._profile_file):
+            return
+        from .profiler import merge_collapsed
+
+        samples = merge_collapsed(self._profile_file)
+        logger.info("Wrote %d samples to %s", samples, self._profile_file)
+        self.user_properties.append(("libtbx_profile", self._profile_file))
+
+    def _result_key(self):
+        """Get the key to cache the result of this test by, if possible.
+
+        Only python scripts with recorded dependencies can be cached; for
+        anything else we can't tell what might change the outcome.
+        """
+        if not self.test_cmd.endswith(".py"):
+            return None
+        files = _dependencies.files_for(self.nodeid)
+        if files is None:
+            return None
+        files = files | {os.path.abspath(self.test_cmd)}
+        command = list(self.full_cmd)
+        if self.shared_setup:
+            # The data the test starts with depends on the setup script too
+            command += ["--shared-setup"] + self.shared_setup
+            files.update(x for x in self.shared_setup if os.path.isfile(x))
+        return _results.key(command, files)
+
+    def _run_in_process(self):
+        """Run a python script in-process, for speed"""
+        from .bytecode import run_code_as_main
+        from .record import DependencyRecorder
+        from .resources import _current_rss
+        from .state import InterpreterSnapshot
+        from .timeouts import alarm
+
+        # Save the old command line arguments
+        prior_argv = sys.argv
+        # TBX RULE: Tests rely on old relative-import behaviour
+        prior_path = list(sys.path)
+        dir_path = py.path.local(self.test_cmd).dirname
+        snapshot = None
+        if not self.config.getoption("--libtbx-no-restore"):
+            snapshot = InterpreterSnapshot(local_paths=[dir_path])
+        recorder = None
+        if _recording_dependencies(self.config):
+            recorder = DependencyRecorder()
+        profiler = None
+        if self._profile_file is not None:
+            from .profiler import SamplingProfiler
+
+            # Only the frames from the script down, not pytest's
+            profiler = SamplingProfiler(root_filename=self.test_cmd)
+        start_rss = _current_rss()
+        try:
+            sys.argv = self.full_cmd
+            sys.path.insert(0, dir_path)
+            with snapshot or contextlib.nullcontext():
+                with recorder or contextlib.nullcontext():
+                    code = _get_code_cache(self.config).get(self.test_cmd)
+                    # Raises TestTimeout from wherever the script has got to
+                    with alarm(self.timeout), profiler or contextlib.nullcontext():
+                        run_code_as_main(code, self.test_cmd)
+        except SystemExit as e:
+            if e.code != 0:
+                raise LibTBXTestException("Script exited with non-zero error code")
+        finally:
+            sys.argv = prior_argv
+            sys.path = prior_path
+            if snapshot is not None:
+                self.state_leaks = snapshot.leaks
+            if recorder is not None:
+                _record_dependencies(self, recorder.files)
+            if profiler is not None:
+                profiler.write(self._profile_file)
+            if _run_modes is not None:
+                # What running it left behind, for choosing how to run it next
+                end_rss = _current_rss()
+                if start_rss is not None and end_rss is not None:
+                    self.user_properties.append(
+                        ("libtbx_retained_rss", end_rss - start_rss)
+                    )
+                self.user_properties.append(
+                    ("libtbx_state_leaks", list(self.state_leaks))
+                )
+
+    def _run_forkserver(self):
+        """Run a python script in a child forked from the preloaded server"""
+        timeout = self.timeout
+        record_deps = _recording_dependencies(self.config)
+        result = _get_forkserver(self.config).run(
+            self.test_cmd,
+            self.full_cmd,
+            os.getcwd(),
+            timeout=timeout,
+            record_deps=record_deps,
+            profile_file=self._profile_file,
+        )
+        if result.files is not None:
+            _record_dependencies(self, result.files)
+        self.add_report_section("call", "stdout", result.stdout)
+        self.add_report_section("call", "stderr", result.stderr)
+        if result.usage is not None:
+            self._resource_monitor.add_external(*result.usage)
+        if result.timed_out:
+            from .timeouts import timeout_message
+
+            raise LibTBXTestException(
+                timeout_message(timeout, result.stdout, result.stderr)
+            )
+        if result.signal is not None:
+            raise LibTBXTestException(f"Script was killed by {result.signal.name}")
+        if result.error:
+            raise LibTBXTestException(f"Script raised an exception:\n{result.error}")
+        if result.exitcode != 0:
+            raise LibTBXTestException("Script exited with non-zero error code")
+
+    def _run_external(self):
+        """Run the test command as an external program"""
+        print("Procrunning ", self.test_cmd)
+        command = self._external_command()
+        timeout = self.timeout
+        timed_out = False
+        usage = None
+        if self.launched is not None:
+            # Already started in the background; wait for it to finish
+            result = self.launched.result()
+            stdout, stderr, exitcode = result.stdout, result.stderr, result.exitcode
+            timed_out = result.timed_out
+            usage = result.usage
+        elif self.config.getoption("--libtbx-capture-limit") or timeout:
+            # Also needed for timeouts, to kill anything the command started
+            from .capture import run_streaming
+
+            environment = self._subprocess_environment()
+            result = run_streaming(
+                command,
+                self.config.getoption("--libtbx-capture-limit"),
+                log_prefix=self._output_log_prefix(),
+                timeout=timeout,
+                env={**os.environ, **environment} if environment else None,
+            )
+            stdout, stderr, exitcode = result.stdout, result.stderr, result.exitcode
+            timed_out = result.timed_out
+            usage = result.usage
         else:
-            print("Procrunning ", self.test_cmd)
-            # Not a python script. Assume that we can run as an external program
+            import procrunner
+
+            environment = self._subprocess_environment()
             result = procrunner.run(
-                self.full_cmd, print_stdout=False, print_stderr=False
+                command,
+                print_stdout=False,
+                print_stderr=False,
+                environment_override=environment,
             )
-            self.add_report_section("call", "stdout", result["stdout"])
-            self.add_report_section("call", "stderr", result["stderr"])
-            if result["stderr"] or result["exitcode"] != 0:
-                raise LibTBXTestException("Script exited with non-zero error code")
+            stdout, stderr = result["stdout"], result["stderr"]
+            exitcode = result["exitcode"]
+        if usage is not None:
+            # Measured on its own, so not counted by the monitor
+            self._resource_monitor.add_external(*usage)
+        if self._deps_file is not None:
+            from .deps import read_deps_file
+
+            _record_dependencies(self, read_deps_file(self._deps_file))
+        self.add_report_section("call", "stdout", stdout)
+        self.add_report_section("call", "stderr", stderr)
+        if timed_out:
+            from .timeouts import timeout_message
+
+            raise LibTBXTestException(timeout_message(timeout, stdout, stderr))
+        # Python scripts can warn on stderr, as they may when run in-process
+        if exitcode != 0 or (stderr and not self.test_cmd.endswith(".py")):
+            raise LibTBXTestException("Script exited with non-zero error code")
+
+    def _subprocess_environment(self):
+        """Get extra environment variables for running the external command.
+
+        When recording dependencies, python processes started by the test
+        are bootstrapped to write the files they use to a file for the
+        test, which is kept as self._deps_file. With
+        --libtbx-profile-subprocesses they are likewise bootstrapped to
+        write their stacks to the test's profile.
+
+        Returns:
+            dict: The variables to set, or None if there aren't any
+        """
+        profile_file = None
+        if self.config.getoption("--libtbx-profile-subprocesses"):
+            profile_file = self._profile_file
+        if not _recording_dependencies(self.config) and profile_file is None:
+            return None
+        from .deps import bootstrap_environment
+
+        if _recording_dependencies(self.config):
+            import tempfile
+
+            fd, self._deps_file = tempfile.mkstemp(prefix="libtbx-deps-")
+            os.close(fd)
+        return bootstrap_environment(self._deps_file, profile_file=profile_file)
+
+    def _external_command(self):
+        """The command line to run this test as an external program"""
+        if self.test_cmd.endswith(".py"):
+            return [sys.executable] + self.full_cmd
+        return self.full_cmd
+
+    def launch(self, runner):
+        """Start running an external command test ahead of its turn"""
+        if _tmpdirs is not None:
+            workdir = self._launch_dir = _tmpdirs.acquire()
+        else:
+            workdir = self.config._tmp_path_factory.mktemp(
+                "libtbx-" + self.name, numbered=True
+            )
+        if self.shared_setup:
+            try:
+                _get_shared_data(self.config).prepare(self.shared_setup, workdir)
+            except Exception:
+                # Leave it to fail when it runs in the normal way
+                return
+        self._start_profile()
+        environment = self._subprocess_environment()
+        self.launched = runner.submit(
+            self._external_command(),
+            workdir,
+            log_prefix=self._output_log_prefix(),
+            timeout=self.timeout,
+            env={**os.environ, **environment} if environment else None,
+        )
+
+    def _output_log_prefix(self):
+        """Where to keep the full output of the command, if limiting capture"""
+        if not self.config.getoption("--libtbx-capture-limit"):
+            return None
+        logdir = self.config._tmp_path_factory.mktemp(
+            "libtbx-output-" + self.name, numbered=True
+        )
+        return str(logdir / "output")
+
+    def reportinfo(self):
+        return self.path, None, self.name
 
     def repr_failure(self, excinfo):
         """Trim the stack trace to the instantiated function"""
@@ -346,9 +1132,9 @@ class LibTBXTest(pytest.Item):
         return super().repr_failure(excinfo)
 
 
-def pytest_collect_file(path, parent):
-    # if ".py" in path.strpath:
-    logger.info("Collecting " + str(path))
+def pytest_collect_file(file_path, parent):
+    path = py.path.local(file_path)
+    logger.debug("Collecting %s", path)
 
     # Problem: We may want to ignore a folder, but we don't know until we
     # read run_tests.py. But we may not get run_tests.py first.
@@ -371,6 +1157,8 @@ def pytest_collect_file(path, parent):
         # Look for a run_tests.py
         run_tests = dirpath / "run_tests.py"
         if path == run_tests or run_tests.isfile():
+            # Wherever it is, we need libtbx to know if it's a configured module
+            _load_libtbx()
             is_configured = path.dirpath() in _valid_libtbx_module_paths
             # Check that we are in a configured module
             if is_configured:
@@ -397,20 +1185,24 @@ def pytest_collect_file(path, parent):
         # We *must* have seen this file before, even if it was immediately above
         run_tests = _precollected_runtests.pop(path)
         if run_tests is not None:
-            return LibTBXRunTestsFile(path, run_tests, parent)
+            return LibTBXRunTestsFile.from_parent(
+                parent, path=file_path, run_tests=run_tests
+            )
 
 
-def pytest_ignore_collect(path, config):
+def pytest_ignore_collect(collection_path, config):
+    path = py.path.local(collection_path)
     # If __init__.py is ignored, the whole module is ignored
     # (Appears to be: Never ignore __init__.py or run_tests.py)
-    logger.info("Ignoring? " + str(path))
+    logger.debug("Ignoring? %s", path)
     moduleinit = path.dirpath() / "__init__.py"
     if path.basename == "run_tests.py" or path == moduleinit:
         return False
 
     # Check if we're in a subdirectory that we want to disable collection
     # e.g. reading a run_tests.py that doesn't discover() will fill this
-    if any(ignore.common(path) == ignore for ignore in _tbx_pytest_ignore_roots):
+    _libtbx_active(path)
+    if _tbx_pytest_ignore_roots.covers(path):
         return True
 
 
@@ -418,6 +1210,8 @@ def pytest_collection_modifyitems(session, config, items):
     # Called after collections, let's clean up our memory usage
     global _collected_dirs
     _collected_dirs = set()
+    if _runtests_cache:
+        _runtests_cache.save()
     # We should have collected everything that we open
     if _precollected_runtests:
         logger.error(
@@ -429,11 +1223,214 @@ def pytest_collection_modifyitems(session, config, items):
     # condition?
     # assert not _precollected_runtests
 
+    if config.getoption("--libtbx-changed-since") and _dependencies is not None:
+        _select_changed(config, items)
+
+
+def pytest_runtest_logreport(report):
+    if _timings is not None:
+        _timings.add(report)
+    properties = dict(report.user_properties)
+    if (
+        _run_modes is not None
+        and report.when == "call"
+        and properties.get("libtbx_mode") == "inprocess"
+        and "libtbx_wall" in properties
+    ):
+        _run_modes.observe(
+            properties["libtbx_script"],
+            properties["libtbx_wall"],
+            properties.get("libtbx_retained_rss"),
+            properties.get("libtbx_state_leaks", []),
+        )
+    if (
+        _resource_reports is not None
+        and report.when == "call"
+        and "libtbx_wall" in properties
+    ):
+        _resource_reports.append((report.nodeid, properties))
+    if report.when == "call" and "libtbx_profile" in properties:
+        _profile_files.append(properties["libtbx_profile"])
+
+    # Record how long libtbx tests take, for scheduling future runs
+    origin = properties.get("libtbx_origin")
+    if _history is None or origin is None:
+        return
+    if report.when == "setup":
+        if report.passed:
+            _running_durations[report.nodeid] = report.duration
+    elif report.nodeid not in _running_durations:
+        return
+    elif report.when == "call" and (
+        not report.passed or properties.get("libtbx_cached")
+    ):
+        # Failures, skips and cached results don't tell us how long it takes
+        del _running_durations[report.nodeid]
+    elif report.when == "call":
+        _running_durations[report.nodeid] += report.duration
+    else:
+        duration = _running_durations.pop(report.nodeid) + report.duration
+        _history.record(report.nodeid, duration, group=origin)
+
+
+def pytest_report_teststatus(report):
+    if report.when == "call" and report.passed:
+        if dict(report.user_properties).get("libtbx_cached"):
+            return "cached", "c", "CACHED"
+
+
+def _will_skip(item):
+    """Can we tell in advance that this item is going to be skipped"""
+    if item.get_closest_marker("skip") or item.get_closest_marker("skipif"):
+        return True
+    return bool(item.get_closest_marker("regression")) and not item.config.getoption(
+        "--regression"
+    )
+
+
+def _launchable(item):
+    """Can this item be started in the background ahead of its turn"""
+    return (
+        isinstance(item, LibTBXTest)
+        and item.run_mode == "subprocess"
+        and not _will_skip(item)
+    )
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtestloop(session):
+    # Start external command tests in the background, so that they overlap
+    global _async_runner, _item_positions
+    limit = session.config.getoption("--libtbx-async-procs")
+    if not limit or session.config.option.collectonly:
+        return
+    external = [
+        (position, item)
+        for position, item in enumerate(session.items)
+        if _launchable(item)
+    ]
+    if not external:
+        return
+    from .async_runner import AsyncCommandRunner
+
+    _async_runner = AsyncCommandRunner(
+        limit, capture_limit=session.config.getoption("--libtbx-capture-limit")
+    )
+    # Under xdist a worker is only given some of the items, as it goes
+    if not hasattr(session.config, "workerinput"):
+        _launch_queue.extend(external)
+        _item_positions = {item: x for x, item in enumerate(session.items)}
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_protocol(item, nextitem):
+    """Start the next few external command tests, before running this one.
+
+    Only as many as can run at once are started ahead, so that working
+    directories and shared data are only prepared shortly before they're
+    needed. An xdist worker only knows which item it will run next.
+    """
+    if _async_runner is None:
+        return
+    if hasattr(item.config, "workerinput"):
+        if nextitem is not None and _launchable(nextitem):
+            nextitem.launch(_async_runner)
+        return
+    position = _item_positions.get(item, -1)
+    while _launched_ahead and _launched_ahead[0][0] <= position:
+        _launched_ahead.popleft()
+    limit = item.config.getoption("--libtbx-async-procs")
+    while _launch_queue and len(_launched_ahead) < limit:
+        queued = _launch_queue.popleft()
+        if queued[0] < position:
+            # Already had its turn, e.g. if deselected by another plugin
+            continue
+        queued[1].launch(_async_runner)
+        _launched_ahead.append(queued)
+
+
+def pytest_sessionfinish(session):
+    global _async_runner, _tmpdirs
+    # Under xdist only the controller sees every result, so only it saves
+    if not hasattr(session.config, "workerinput"):
+        if _history is not None:
+            _history.save()
+        if _run_modes is not None:
+            _run_modes.save()
+    if _dependencies is not None:
+        _dependencies.save()
+    if _results is not None:
+        _results.save()
+    # Don't leave anything running if we stopped early
+    if _async_runner is not None:
+        _async_runner.shutdown()
+        _async_runner = None
+        _launch_queue.clear()
+        _launched_ahead.clear()
+    if _tmpdirs is not None:
+        _tmpdirs.cleanup()
+        _tmpdirs = None
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_make_scheduler(config, log):
+    """Use duration-weighted scheduling with pytest-xdist, if requested"""
+    if not config.getoption("--libtbx-schedule"):
+        return None
+    from ._xdist import DurationScheduling
+
+    return DurationScheduling(config, log, history=_history)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if _collection_profile is not None and _collection_profile.records:
+        terminalreporter.section("libtbx collection profile")
+        _collection_profile.report(terminalreporter.write_line)
+    if _resource_reports:
+        terminalreporter.section("libtbx resource usage")
+        from .resources import summarise_usage
+
+        summarise_usage(_resource_reports, terminalreporter.write_line)
+    if _profile_files:
+        terminalreporter.section("libtbx profiles")
+        directories = sorted({os.path.dirname(x) for x in _profile_files})
+        for directory in directories:
+            count = sum(os.path.dirname(x) == directory for x in _profile_files)
+            terminalreporter.write_line(f"Wrote {count} test profiles to {directory}")
+
 
 def pytest_configure(config):
+    global _resource_reports, _timings, _detailed_properties
+    if config.getoption("--libtbx-resource-report"):
+        _resource_reports = []
+    _detailed_properties = bool(
+        config.getoption("--libtbx-timings-out")
+        or config.getoption("--libtbx-run-mode") == "auto"
+    )
+    # Under xdist the controller sees every report, so only it writes
+    if config.getoption("--libtbx-timings-out") and not hasattr(config, "workerinput"):
+        from .timings import TimingsWriter
+
+        _timings = TimingsWriter(config.getoption("--libtbx-timings-out"))
     config.addinivalue_line(
         "markers", "regression: Mark as a (time-intensive) regression test"
     )
+    config.addinivalue_line(
+        "markers",
+        "libtbx_timeout(seconds): Fail a libtbx test that runs for longer than this",
+    )
+    config.addinivalue_line(
+        "markers",
+        "libtbx_run_mode(mode): Run a libtbx python test script 'inprocess', in "
+        "a 'forkserver' child or as a 'subprocess'",
+    )
+
+
+def pytest_unconfigure(config):
+    global _timings
+    if _timings is not None:
+        _timings.close()
+        _timings = None
 
 
 def pytest_addoption(parser):
@@ -448,6 +1445,183 @@ def pytest_addoption(parser):
     except ValueError:
         # Thrown in case the command line option is already defined
         pass
+    group = parser.getgroup("libtbx")
+    group.addoption(
+        "--libtbx-no-collect-cache",
+        action="store_true",
+        default=False,
+        help="Always re-read run_tests.py files instead of using the cached test lists",
+    )
+    group.addoption(
+        "--libtbx-collect",
+        choices=["static", "import"],
+        default="static",
+        help="How to read run_tests.py files. 'static' parses the file and only "
+        "imports it if the test lists can't be worked out; 'import' always "
+        "imports, and ignores cached lists that were parsed "
+        "(default: %(default)s)",
+    )
+    group.addoption(
+        "--libtbx-collect-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Read the run_tests.py of every configured module ahead of "
+        "collection, using N processes",
+    )
+    group.addoption(
+        "--libtbx-collect-profile",
+        action="store_true",
+        default=False,
+        help="Time reading each run_tests.py and the modules that it imports, "
+        "and print a summary at the end of the session",
+    )
+    group.addoption(
+        "--libtbx-run-mode",
+        choices=[*RUN_MODES, "auto"],
+        default="inprocess",
+        help="How to run python test scripts. 'forkserver' runs each in a child "
+        "forked from a process with libtbx preloaded, and 'subprocess' in a new "
+        "interpreter. 'auto' runs scripts in-process until they are seen to "
+        "leak interpreter state or memory, or to run for long enough that "
+        "isolating them in a forkserver child costs little. Overridden per "
+        "test by tst_run_modes in run_tests.py or 'run-mode=' mark rules "
+        "(default: %(default)s)",
+    )
+    group.addoption(
+        "--libtbx-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Fail libtbx tests that run for longer than this. External commands "
+        "and forkserver children are killed along with everything they started; "
+        "in-process tests are interrupted, which can't happen while inside "
+        "compiled code - use forkserver mode for tests that might hang there. "
+        "Overridden per test by tst_timeouts in run_tests.py or 'timeout=' "
+        "mark rules",
+    )
+    group.addoption(
+        "--libtbx-async-procs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Run external command (non-python) tests in the background, up to "
+        "N at once. Results are still reported in the usual order",
+    )
+    group.addoption(
+        "--libtbx-capture-limit",
+        type=parse_size,
+        default=None,
+        metavar="SIZE",
+        help="Stream the output of external command tests to files, only keeping "
+        "SIZE bytes (e.g. 1M) of the start and end of each stream for the report",
+    )
+    group.addoption(
+        "--libtbx-tmp-base",
+        metavar="PATH",
+        help="Run libtbx tests in reused working directories under PATH (e.g. "
+        "a tmpfs or local disk) instead of the tmpdir fixture. Directories "
+        "are cleaned up in the background at the end of the session; those "
+        "of failed tests are kept for the next few sessions",
+    )
+    group.addoption(
+        "--libtbx-shared-clone",
+        choices=CLONE_METHODS,
+        default="auto",
+        help="How to copy shared setup data into each test's directory. "
+        "'auto' uses copy-on-write reflinks where the filesystem supports "
+        "them, otherwise copies. 'hardlink' is fast everywhere, but only safe "
+        "if tests never modify the shared files in place",
+    )
+    group.addoption(
+        "--libtbx-no-restore",
+        action="store_true",
+        default=False,
+        help="Don't restore modules, environment, working directory, logging or "
+        "signal handlers after running each in-process test",
+    )
+    group.addoption(
+        "--libtbx-resource-report",
+        action="store_true",
+        default=False,
+        help="Print a summary of the libtbx tests using the most CPU time and "
+        "memory at the end of the session",
+    )
+    group.addoption(
+        "--libtbx-timings-out",
+        metavar="FILE",
+        help="Write the origin, command, run mode, outcome and phase durations "
+        "of every libtbx test to FILE as JSON lines. Compare two such files "
+        "with pytest-libtbx-timings",
+    )
+    group.addoption(
+        "--libtbx-profile",
+        metavar="PATTERN",
+        help="Profile the python scripts of libtbx tests with node IDs matching "
+        "the glob PATTERN (e.g. '*tst_slow*') by sampling their stacks, and "
+        "write each test's collapsed stacks - the input to flamegraph tools - "
+        "to a libtbx-profiles directory beside the --junitxml report, or in "
+        "the base temporary directory",
+    )
+    group.addoption(
+        "--libtbx-profile-subprocesses",
+        action="store_true",
+        default=False,
+        help="With --libtbx-profile, also profile python processes started by "
+        "tests run as external commands, by bootstrapping them at startup",
+    )
+    group.addoption(
+        "--libtbx-result-cache",
+        action="store_true",
+        default=False,
+        help="Don't rerun python script tests that passed last time, if neither "
+        "the script nor any libtbx module file it imported has changed since. "
+        "Implies --libtbx-record-deps",
+    )
+    group.addoption(
+        "--libtbx-record-deps",
+        action="store_true",
+        default=False,
+        help="Record which libtbx module files each test imports or runs code "
+        "from, for use by --libtbx-changed-since. Python processes that tests "
+        "start are bootstrapped to record too",
+    )
+    group.addoption(
+        "--libtbx-changed-since",
+        metavar="REF_OR_FILE",
+        default=None,
+        help="Only run libtbx tests affected by files changed since a git ref, "
+        "or listed in a file. Tests without recorded dependencies run if "
+        "anything in their module changed",
+    )
+    group.addoption(
+        "--libtbx-schedule",
+        action="store_true",
+        default=False,
+        help="With pytest-xdist, hand out tests longest-first using recorded "
+        "durations, keeping tests from the same run_tests.py together",
+    )
+    parser.addini(
+        "libtbx_mark_rules",
+        type="linelist",
+        help="Marks to apply to libtbx tests by location, one per line as "
+        "'<skip|xfail|requires-env=VAR[|VAR...]|timeout=SECONDS|run-mode=MODE> "
+        "<path> [reason]'. Paths starting with a libtbx module name are relative to "
+        "that module",
+    )
+    parser.addini(
+        "libtbx_shared_setup",
+        type="linelist",
+        help="Commands preparing data that every test in a module starts "
+        "with, one per line as '<module> <command> [args]'. Run once per "
+        "session and copied into each test's directory. Overrides any "
+        "tst_shared_setup in the module's run_tests.py",
+    )
+    parser.addini(
+        "libtbx_forkserver_preload",
+        type="linelist",
+        help="Modules to import in the fork server before forking tests",
+    )
 
 
 def pytest_runtest_setup(item):
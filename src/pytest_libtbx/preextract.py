@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from .runtests import RunTestsInfo
+from .static import Unresolvable, extract_static
+
+logger = logging.getLogger(__name__)
+
+
+def extract_run_tests(path, static=True):
+    """Read the test lists from a run_tests.py, for running in a worker process.
+
+    This runs in a fresh interpreter, so importing is isolated from the
+    pytest process; only plain data is sent back.
+
+    Args:
+        path: The run_tests.py file
+        static: Whether to try reading the file without importing it first
+
+    Returns:
+        dict: The RunTestsInfo, as a dictionary
+    """
+    if static:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return extract_static(f.read(), path).to_dict()
+        except Unresolvable:
+            pass
+
+    # Inline import; this needs the libtbx environment to be importable
+    from .fake_env import CustomRuntestsEnvironment
+
+    # Import it the same way that collection would
+    directory = os.path.dirname(path)
+    module_import = os.path.basename(directory) + ".run_tests"
+    if os.path.dirname(directory) not in sys.path:
+        sys.path.insert(0, os.path.dirname(directory))
+    with CustomRuntestsEnvironment() as env:
+        module = importlib.import_module(module_import)
+    return RunTestsInfo.from_module(module, env.ran_discover).to_dict()
+
+
+def _timed_extract_run_tests(path, static):
+    """Read a run_tests.py in a worker, also returning how long it took"""
+    start = time.perf_counter()
+    info = extract_run_tests(path, static)
+    return info, time.perf_counter() - start
+
+
+def extract_all(paths, workers, static=True, times=None):
+    """Read many run_tests.py files concurrently, in separate processes.
+
+    Args:
+        paths: The run_tests.py files to read
+        workers: How many processes to use
+        static: Whether to try reading without importing first
+        times: If given, a dictionary to store the seconds each worker
+            took to read each path in
+
+    Returns:
+        dict: RunTestsInfo for each path that could be read. Files that
+            failed are left out, so that reading them again in the pytest
+            process reports the error in the usual way.
+    """
+    results = {}
+    # Spawn, so workers don't inherit pytest's state (or its threads)
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(_timed_extract_run_tests, str(path), static): path
+            for path in paths
+        }
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                info, seconds = future.result()
+                results[path] = RunTestsInfo.from_dict(info)
+                if times is not None:
+                    times[path] = seconds
+            except Exception as e:
+                logger.info("Could not read %s in a worker: %s", path, e)
+    return results
@@ -0,0 +1,114 @@
+"""A sampling profiler writing flamegraph-compatible collapsed stacks.
+
+Kept free of imports beyond the essentials, as this is also imported at
+startup by python subprocesses bootstrapped to profile.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+
+
+def _frame_label(code):
+    """Name a stack frame by function, and file relative to its package"""
+    path = code.co_filename
+    if not path.startswith("<"):
+        path = "/".join(path.replace(os.sep, "/").split("/")[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stack of a thread at intervals while active.
+
+    A background thread looks at the profiled thread's current frame with
+    sys._current_frames, so the profiled code runs unmodified and the cost
+    doesn't depend on how many calls it makes. `counts` holds the number
+    of times each stack was seen, as ';'-joined frame labels from the
+    outermost frame.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, root_filename=None):
+        """
+        Args:
+            interval: Seconds between samples
+            root_filename: If given, stacks start from the outermost frame
+                running code from this file, leaving out the frames of
+                whatever was running it; and samples taken outside of it
+                are dropped
+        """
+        self._interval = interval
+        # The name the code was compiled with might not be absolute
+        self._roots = set()
+        if root_filename:
+            self._roots = {root_filename, os.path.abspath(root_filename)}
+        self._stop = threading.Event()
+        self._labels = {}
+        self.counts = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._thread_id)
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        if self._roots:
+            roots = [i for i, x in enumerate(codes) if x.co_filename in self._roots]
+            del codes[roots[-1] + 1 if roots else 0 :]
+        if codes:
+            stack = ";".join(self._label(x) for x in reversed(codes))
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="libtbx-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, filename):
+        """Append the collapsed stacks to a file, one 'stack count' per line"""
+        if not self.counts:
+            return
+        with open(filename, "a") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.counts.items())
+
+
+def merge_collapsed(filename):
+    """Combine the repeated stacks in a collapsed stack file.
+
+    Several processes can append to the same file; this adds up the counts
+    for each stack, so that every stack appears once.
+
+    Returns:
+        int: The total number of samples
+    """
+    counts = {}
+    with open(filename) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                counts[stack] = counts.get(stack, 0) + int(count)
+    with open(filename, "w") as f:
+        f.writelines(f"{stack} {counts[stack]}\n" for stack in sorted(counts))
+    return sum(counts.values())
@@ -0,0 +1,125 @@
+"""Recorders for the files that a test uses.
+
+Kept free of imports beyond the essentials, as this is also imported at
+startup by every python subprocess bootstrapped to record dependencies.
+"""
+
+from __future__ import annotations
+
+import builtins
+import os
+import sys
+
+
+class ImportRecorder:
+    """Records the files of every module imported while active.
+
+    This wraps builtins.__import__, so modules that were already imported
+    before (e.g. by a previous test in the same process) are still seen.
+    """
+
+    def __init__(self):
+        self._names = set()
+        self.files = set()
+
+    def __enter__(self):
+        self._original = builtins.__import__
+        original, names = self._original, self._names
+
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            module = original(name, globals, locals, fromlist, level)
+            if fromlist:
+                # The module returned is the one named in the from statement
+                names.add(module.__name__)
+                names.update(f"{module.__name__}.{x}" for x in fromlist)
+            elif not level:
+                names.add(name)
+            return module
+
+        builtins.__import__ = _import
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        builtins.__import__ = self._original
+        for name in self._names:
+            filename = getattr(sys.modules.get(name), "__file__", None)
+            if filename:
+                self.files.add(os.path.abspath(filename))
+
+
+class ExecutionRecorder:
+    """Records the source files of all python code that runs while active.
+
+    Uses sys.monitoring (Python 3.12+). Each code object only reports the
+    first time it runs, after which the event is disabled for it, so the
+    overhead is a single callback per function rather than per call.
+    """
+
+    available = hasattr(sys, "monitoring")
+
+    def __init__(self):
+        self.files = set()
+
+    @staticmethod
+    def _free_tool_id():
+        for tool_id in range(6):
+            if sys.monitoring.get_tool(tool_id) is None:
+                return tool_id
+        return None
+
+    def __enter__(self):
+        self._tool_id = self._free_tool_id()
+        if self._tool_id is None:
+            # Something else is using them all; imports are still recorded
+            return self
+        monitoring = sys.monitoring
+        filenames = self._filenames = set()
+
+        def _started(code, offset):
+            filenames.add(code.co_filename)
+            return monitoring.DISABLE
+
+        monitoring.use_tool_id(self._tool_id, "pytest-libtbx")
+        monitoring.register_callback(
+            self._tool_id, monitoring.events.PY_START, _started
+        )
+        monitoring.set_events(self._tool_id, monitoring.events.PY_START)
+        # Code disabled while recording a previous test needs to report again
+        monitoring.restart_events()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._tool_id is None:
+            return
+        monitoring = sys.monitoring
+        monitoring.set_events(self._tool_id, 0)
+        monitoring.register_callback(self._tool_id, monitoring.events.PY_START, None)
+        monitoring.free_tool_id(self._tool_id)
+        self.files.update(
+            os.path.abspath(x) for x in self._filenames if not x.startswith("<")
+        )
+
+
+class DependencyRecorder:
+    """Records the files of the modules imported and the code run while active.
+
+    Imports catch modules that are only used for their data; where
+    sys.monitoring is available, the files whose code actually ran are
+    added.
+    """
+
+    def __init__(self):
+        self._recorders = [ImportRecorder()]
+        if ExecutionRecorder.available:
+            self._recorders.append(ExecutionRecorder())
+        self.files = set()
+
+    def __enter__(self):
+        for recorder in self._recorders:
+            recorder.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for recorder in reversed(self._recorders):
+            recorder.__exit__(exc_type, exc_value, traceback)
+            self.files.update(recorder.files)
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import glob
+import os
+import resource
+import subprocess
+import threading
+import time
+
+# How often to sample memory use and child processes, in seconds
+SAMPLE_INTERVAL = 0.05
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+# Child processes being waited for with wait_with_usage, and the monitors
+# that are active. Their usage is measured on its own, so that processes
+# run in the background for other tests aren't counted against whichever
+# test happens to be running when they finish.
+_measured_pids = set()
+_active_monitors = set()
+_lock = threading.Lock()
+
+
+def _current_rss():
+    """Get the resident set size of this process in bytes, or None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _child_pids():
+    """Get the process IDs of the direct children of this process"""
+    pids = set()
+    for filename in glob.glob(f"/proc/{os.getpid()}/task/*/children"):
+        try:
+            with open(filename) as f:
+                pids.update(int(x) for x in f.read().split())
+        except (OSError, ValueError):
+            pass
+    return pids
+
+
+def wait_with_usage(process, timeout=None):
+    """Wait for a subprocess.Popen to finish, measuring what it used.
+
+    Args:
+        process: The process to wait for. Its returncode is set.
+        timeout: The most seconds to wait, if limited
+
+    Returns:
+        tuple: The (user, system, peak_rss) of the process and any children
+            it waited for, with the peak RSS in bytes
+
+    Raises:
+        subprocess.TimeoutExpired: If the process is still running
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.0005
+    with _lock:
+        _measured_pids.add(process.pid)
+    try:
+        while True:
+            # Unlike Popen.wait, os.wait4 gives the usage of this child alone
+            pid, status, rusage = os.wait4(
+                process.pid, 0 if deadline is None else os.WNOHANG
+            )
+            if pid:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            delay = min(delay * 2, remaining, 0.05)
+            time.sleep(delay)
+    finally:
+        with _lock:
+            _measured_pids.discard(process.pid)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # Linux reports ru_maxrss in kilobytes
+    usage = (rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss * 1024)
+    with _lock:
+        for monitor in _active_monitors:
+            monitor._waited.append(usage)
+    return usage
+
+
+class ResourceUsage:
+    """Resources used by a single test"""
+
+    def __init__(
+        self, wall, user, system, peak_rss_delta, child_peak_rss, child_processes
+    ):
+        self.wall = wall
+        self.user = user
+        self.system = system
+        # Growth of this process' memory, in bytes, or None if not available
+        self.peak_rss_delta = peak_rss_delta
+        # Largest memory use of any child process in bytes, or None
+        self.child_peak_rss = child_peak_rss
+        # Number of child processes seen
+        self.child_processes = child_processes
+
+    def as_properties(self):
+        """Get the usage as a list of (name, value) for user_properties"""
+        return [
+            ("libtbx_wall", round(self.wall, 4)),
+            ("libtbx_cpu_user", round(self.user, 4)),
+            ("libtbx_cpu_system", round(self.system, 4)),
+            ("libtbx_peak_rss_delta", self.peak_rss_delta),
+            ("libtbx_child_peak_rss", self.child_peak_rss),
+            ("libtbx_child_processes", self.child_processes),
+        ]
+
+    def format(self):
+        def _mb(value):
+            return "-" if value is None else f"{value / 1024**2:.1f} MB"
+
+        return (
+            f"wall: {self.wall:.3f}s  user: {self.user:.3f}s  "
+            f"system: {self.system:.3f}s\n"
+            f"peak RSS growth: {_mb(self.peak_rss_delta)}  "
+            f"child peak RSS: {_mb(self.child_peak_rss)}  "
+            f"child processes: {self.child_processes}"
+        )
+
+
+class ResourceMonitor:
+    """Measures the resources used while active.
+
+    CPU time covers this process and any child processes waited for.
+    Memory growth of this process and the number of child processes are
+    sampled in a background thread, so very short-lived peaks or children
+    may be missed.
+
+    Processes waited for with wait_with_usage are left out, even if they
+    finish while active, as they may have been run for another test; the
+    test they belong to should include them with add_external.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._external = []
+        self.usage = None
+
+    def add_external(self, user, system, peak_rss):
+        """Include the usage of a process measured on its own"""
+        self._external.append((user, system, peak_rss))
+
+    def _sample(self):
+        rss = _current_rss()
+        if rss is not None and self._peak_rss is not None:
+            self._peak_rss = max(self._peak_rss, rss)
+        with _lock:
+            measured = set(_measured_pids)
+        self._pids.update(_child_pids() - self._start_pids - measured)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def __enter__(self):
+        self._start_wall = time.perf_counter()
+        self._start_self = resource.getrusage(resource.RUSAGE_SELF)
+        self._start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._start_rss = self._peak_rss = _current_rss()
+        # Ignore long-running children that existed before e.g. a fork server
+        self._start_pids = _child_pids()
+        self._pids = set()
+        self._waited = []
+        with _lock:
+            _active_monitors.add(self)
+        self._thread = threading.Thread(
+            target=self._run, name="libtbx-resource-monitor", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        with _lock:
+            _active_monitors.discard(self)
+        wall = time.perf_counter() - self._start_wall
+        end_self = resource.getrusage(resource.RUSAGE_SELF)
+        end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        # RUSAGE_CHILDREN includes the processes measured on their own
+        user = (
+            (end_self.ru_utime - self._start_self.ru_utime)
+            + (end_children.ru_utime - self._start_children.ru_utime)
+            - sum(x[0] for x in self._waited)
+        )
+        system = (
+            (end_self.ru_stime - self._start_self.ru_stime)
+            + (end_children.ru_stime - self._start_children.ru_stime)
+            - sum(x[1] for x in self._waited)
+        )
+        # ru_maxrss is the largest child ever; it only tells us about this
+        # test if it went up, and not because of one measured on its own.
+        # Linux reports it in kilobytes.
+        child_peak_rss = None
+        if end_children.ru_maxrss > self._start_children.ru_maxrss:
+            child_peak_rss = end_children.ru_maxrss * 1024
+            if child_peak_rss <= max((x[2] for x in self._waited), default=0):
+                child_peak_rss = None
+        for ext_user, ext_system, ext_peak_rss in self._external:
+            user += ext_user
+            system += ext_system
+            child_peak_rss = max(child_peak_rss or 0, ext_peak_rss)
+
+        peak_rss_delta = None
+        if self._start_rss is not None:
+            peak_rss_delta = self._peak_rss - self._start_rss
+        self.usage = ResourceUsage(
+            wall,
+            user,
+            system,
+            peak_rss_delta,
+            child_peak_rss,
+            len(self._pids) + len(self._external),
+        )
+
+
+def summarise_usage(reports, write_line, top=10):
+    """Write the tests that used the most CPU and memory.
+
+    Args:
+        reports: A list of (nodeid, user_properties dict) for each test
+        write_line: Called with each line of the summary
+        top: How many tests to list in each category
+    """
+
+    def _cpu(properties):
+        return properties["libtbx_cpu_user"] + properties["libtbx_cpu_system"]
+
+    def _memory(properties):
+        return max(
+            properties["libtbx_peak_rss_delta"] or 0,
+            properties["libtbx_child_peak_rss"] or 0,
+        )
+
+    total_cpu = sum(_cpu(x) for _, x in reports)
+    total_wall = sum(x["libtbx_wall"] for _, x in reports)
+    children = sum(x["libtbx_child_processes"] for _, x in reports)
+    write_line(
+        f"{len(reports)} tests: {total_wall:.1f}s wall, {total_cpu:.1f}s CPU, "
+        f"{children} child processes"
+    )
+    write_line("")
+    write_line("Most CPU time:")
+    for nodeid, properties in sorted(reports, key=lambda x: -_cpu(x[1]))[:top]:
+        write_line(f"{_cpu(properties):9.2f}s  {nodeid}")
+    write_line("")
+    write_line("Most memory (peak RSS growth, or largest child process):")
+    for nodeid, properties in sorted(reports, key=lambda x: -_memory(x[1]))[:top]:
+        write_line(f"{_memory(properties) / 1024**2:8.1f}MB  {nodeid}")
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import sys
+
+from .cache import _file_hash, _file_stat
+
+logger = logging.getLogger(__name__)
+
+RESULTS_KEY = "libtbx/results"
+# Bump this whenever the way result keys are computed changes
+RESULTS_VERSION = 1
+
+
+class ResultCache:
+    """Remembers which tests passed, and exactly what they were run against.
+
+    Each passing test is stored with a key made from its command line, the
+    content of the script and every file it was recorded as depending on,
+    and the libtbx environment fingerprint. A test whose key is unchanged
+    can be assumed to pass again. File hashes are kept alongside, and only
+    recomputed when a file's mtime or size changes.
+    """
+
+    def __init__(self, store, fingerprint):
+        """
+        Args:
+            store: A pytest config.cache-like object, or None to only cache
+                for the current session
+            fingerprint: The libtbx environment fingerprint
+        """
+        self._store = store
+        self._fingerprint = fingerprint
+        self._passed = {}
+        self._hashes = {}
+        self._updated = {}
+        self._failed = set()
+        if store is not None:
+            self._passed, self._hashes = self._load()
+
+    def _load(self):
+        data = self._store.get(RESULTS_KEY, None) or {}
+        if data.get("version") != RESULTS_VERSION:
+            return {}, {}
+        hashes = data.get("hashes", {})
+        if data.get("fingerprint") != self._fingerprint:
+            logger.info("libtbx environment changed; discarding cached results")
+            return {}, hashes
+        return data.get("passed", {}), hashes
+
+    def _hash(self, path):
+        stat = _file_stat(path)
+        entry = self._hashes.get(path)
+        if entry is None or entry[:2] != stat:
+            entry = self._hashes[path] = stat + [_file_hash(path)]
+        return entry[2]
+
+    def key(self, command, files):
+        """Compute the result key for running a test.
+
+        Args:
+            command: The full command line, as a list
+            files: Every file the outcome depends on
+
+        Returns:
+            The key, or None if any of the files can't be read
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{sys.executable}\n{sys.version}\n".encode())
+        digest.update(f"{self._fingerprint}\n".encode())
+        digest.update("\0".join(str(x) for x in command).encode() + b"\n")
+        try:
+            for path in sorted(str(x) for x in files):
+                digest.update(f"{path}={self._hash(path)}\n".encode())
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    def passed(self, nodeid, key):
+        """Did this test previously pass with exactly the same key"""
+        return key is not None and self._passed.get(nodeid) == key
+
+    def record(self, nodeid, key, passed):
+        """Store the outcome of running a test"""
+        if passed and key is not None:
+            self._passed[nodeid] = self._updated[nodeid] = key
+            self._failed.discard(nodeid)
+        else:
+            self._passed.pop(nodeid, None)
+            self._updated.pop(nodeid, None)
+            self._failed.add(nodeid)
+
+    def save(self):
+        """Merge the results from this session into the persistent store"""
+        if self._store is None or not (self._updated or self._failed):
+            return
+        passed, hashes = self._load()
+        passed.update(self._updated)
+        for nodeid in self._failed:
+            passed.pop(nodeid, None)
+        hashes.update(self._hashes)
+        self._store.set(
+            RESULTS_KEY,
+            {
+                "version": RESULTS_VERSION,
+                "fingerprint": self._fingerprint,
+                "passed": passed,
+                "hashes": hashes,
+            },
+        )
+        self._updated = {}
+        self._failed = set()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ways of running a python test script
+RUN_MODES = ("inprocess", "forkserver", "subprocess")
+RUN_MODES_KEY = "libtbx/run-modes"
+# Isolate scripts that leave more memory than this allocated in pytest
+MAX_RETAINED_RSS = 256 * 1024**2
+# Isolate scripts that take this long, as the cost of isolating is then small
+ISOLATE_AFTER = 60.0
+# Weight given to the newest measurement when updating running averages
+SMOOTHING = 0.5
+
+
+class RunModePolicy:
+    """Chooses whether to run each python script in-process, from experience.
+
+    Running in-process is the fastest, so scripts are run that way until
+    they are seen to leak interpreter state, to leave too much memory
+    allocated, or to take long enough that isolating them costs little.
+    From then on they run in a forked child. Only in-process runs are
+    measured, so the decision to isolate a script sticks until the
+    recorded experience is cleared.
+    """
+
+    def __init__(
+        self, store, max_retained_rss=MAX_RETAINED_RSS, isolate_after=ISOLATE_AFTER
+    ):
+        """
+        Args:
+            store: A pytest config.cache-like object, or None to only learn
+                for the current session
+            max_retained_rss: Bytes of memory growth to isolate scripts at
+            isolate_after: Seconds of wall time to isolate scripts at
+        """
+        self._store = store
+        self._max_retained_rss = max_retained_rss
+        self._isolate_after = isolate_after
+        self._records = {}
+        self._updated = set()
+        if store is not None:
+            self._records = store.get(RUN_MODES_KEY, None) or {}
+
+    def observe(self, script, wall, retained_rss=None, leaks=()):
+        """Record what happened when a script was run in-process.
+
+        Args:
+            script: The test script path
+            wall: How long it took to run
+            retained_rss: How much the memory use of pytest grew, if known
+            leaks: The kinds of interpreter state it changed
+        """
+        record = self._records.setdefault(script, {"runs": 0, "leaks": []})
+        if record["runs"]:
+            wall = SMOOTHING * wall + (1 - SMOOTHING) * record["wall"]
+        record["wall"] = wall
+        record["runs"] += 1
+        if retained_rss is not None:
+            record["retained_rss"] = max(record.get("retained_rss", 0), retained_rss)
+        record["leaks"] = sorted(set(record["leaks"]) | set(leaks))
+        self._updated.add(script)
+
+    def choose(self, script):
+        """Pick how to run a script.
+
+        Returns:
+            Tuple[str, str]: The run mode, and why it was chosen
+        """
+        record = self._records.get(script)
+        if record is None:
+            return "inprocess", "not run before"
+        if record["leaks"]:
+            return "forkserver", "leaked " + ", ".join(record["leaks"])
+        if record.get("retained_rss", 0) > self._max_retained_rss:
+            megabytes = record["retained_rss"] / 1024**2
+            return "forkserver", f"retained {megabytes:.0f} MB"
+        if record["wall"] > self._isolate_after:
+            return "forkserver", f"took {record['wall']:.0f}s"
+        return "inprocess", "fast and clean in-process"
+
+    def save(self):
+        """Merge the experience from this session into the persistent store"""
+        if self._store is None or not self._updated:
+            return
+        records = self._store.get(RUN_MODES_KEY, None) or {}
+        records.update((x, self._records[x]) for x in self._updated)
+        self._store.set(RUN_MODES_KEY, records)
+        self._updated = set()
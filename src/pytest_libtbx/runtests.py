@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+
+def normalise_entry(entry):
+    """Convert a tst_list entry into plain, serialisable data.
+
+    Args:
+        entry: A string filename, an iterable of filename and arguments, or
+            an inline callable.
+
+    Returns:
+        The filename string, a list of filename and string arguments, or
+        None for an inline callable (which the bridge can't run anyway).
+    """
+    if isinstance(entry, str):
+        return entry
+    if entry is None or callable(entry):
+        return None
+    return [str(x) for x in entry]
+
+
+class TestSpec:
+    """A single test listed in a run_tests.py, before any pytest node exists.
+
+    Plain records, so that collecting the full tree costs little memory
+    for the parts of tests that aren't needed until they run.
+    """
+
+    __test__ = False
+    __slots__ = (
+        "name",
+        "shortpath",
+        "command",
+        "params",
+        "markers",
+        "origin",
+        "shared_setup",
+    )
+
+    def __init__(
+        self, name, shortpath, command, params, markers, origin, shared_setup=None
+    ):
+        self.name = name
+        # The test file relative to the module, used to name the pytest node
+        self.shortpath = shortpath
+        self.command = command
+        self.params = params
+        self.markers = markers
+        # The run_tests.py that listed this test
+        self.origin = origin
+        # The expanded command preparing shared data for the test, if any
+        self.shared_setup = shared_setup
+
+    def __repr__(self):
+        return f"TestSpec({self.shortpath}::{self.name})"
+
+
+class RunTestsInfo:
+    """The data extracted from a run_tests.py that collection needs"""
+
+    def __init__(
+        self,
+        tst_list=(),
+        tst_list_slow=(),
+        ran_discover=False,
+        shared_setup=None,
+        timeouts=None,
+        run_modes=None,
+    ):
+        self.tst_list = [normalise_entry(x) for x in tst_list]
+        self.tst_list_slow = [normalise_entry(x) for x in tst_list_slow]
+        self.ran_discover = ran_discover
+        # Command preparing data that every test in the module starts with
+        self.shared_setup = normalise_entry(shared_setup)
+        # Seconds that entries running each test file are allowed to take
+        self.timeouts = {str(k): float(v) for k, v in (timeouts or {}).items()}
+        # How to run each test file, overriding --libtbx-run-mode
+        self.run_modes = {str(k): str(v) for k, v in (run_modes or {}).items()}
+
+    @classmethod
+    def from_module(cls, module, ran_discover):
+        """Extract the test lists from an imported run_tests module"""
+        return cls(
+            tst_list=module.__dict__.get("tst_list", []),
+            tst_list_slow=module.__dict__.get("tst_list_slow", []),
+            ran_discover=ran_discover,
+            shared_setup=module.__dict__.get("tst_shared_setup"),
+            timeouts=module.__dict__.get("tst_timeouts"),
+            run_modes=module.__dict__.get("tst_run_modes"),
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            tst_list=data["tst_list"],
+            tst_list_slow=data["tst_list_slow"],
+            ran_discover=data["ran_discover"],
+            shared_setup=data.get("shared_setup"),
+            timeouts=data.get("timeouts"),
+            run_modes=data.get("run_modes"),
+        )
+
+    def to_dict(self):
+        return {
+            "tst_list": self.tst_list,
+            "tst_list_slow": self.tst_list_slow,
+            "ran_discover": self.ran_discover,
+            "shared_setup": self.shared_setup,
+            "timeouts": self.timeouts,
+            "run_modes": self.run_modes,
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, RunTestsInfo):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "RunTestsInfo(tst_list={}, tst_list_slow={}, ran_discover={})".format(
+            len(self.tst_list), len(self.tst_list_slow), self.ran_discover
+        )
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import statistics
+
+from .history import TestHistory
+
+# Duration assumed for tests if nothing has ever been recorded
+DEFAULT_DURATION = 1.0
+
+
+def _default_scope(nodeid):
+    # The same grouping as pytest-xdist's loadscope
+    return nodeid.rsplit("::", 1)[0]
+
+
+def plan_work_units(nodeids, history: TestHistory, workers: int):
+    """Split tests into units of work, ordered longest-first.
+
+    Tests from the same run_tests.py are kept together so that a worker can
+    reuse the imports, unless the group is so long that it would dominate
+    the run; those are split into chunks no longer than an even share of the
+    total time. Handing the resulting units out in order to whichever worker
+    is free is longest-processing-time-first scheduling.
+
+    Args:
+        nodeids: The collected test nodeids, in collection order
+        history: Recorded test durations and groups
+        workers: The number of workers that will run the tests
+
+    Returns:
+        A list of (scope name, [nodeids]) tuples, longest total first
+    """
+    known = [history.duration(x) for x in nodeids if history.duration(x) is not None]
+    default = statistics.median(known) if known else DEFAULT_DURATION
+    durations = {x: history.duration(x, default) for x in nodeids}
+
+    groups = {}
+    for nodeid in nodeids:
+        group = history.group(nodeid) or _default_scope(nodeid)
+        groups.setdefault(group, []).append(nodeid)
+
+    share = sum(durations.values()) / max(workers, 1)
+    units = []
+    for group, members in groups.items():
+        chunk, chunk_time = [], 0.0
+        for nodeid in members:
+            if chunk and chunk_time + durations[nodeid] > share:
+                units.append((chunk_time, f"{group}[{len(units)}]", chunk))
+                chunk, chunk_time = [], 0.0
+            chunk.append(nodeid)
+            chunk_time += durations[nodeid]
+        units.append((chunk_time, f"{group}[{len(units)}]", chunk))
+
+    units.sort(key=lambda unit: -unit[0])
+    return [(scope, members) for _, scope, members in units]
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+# ioctl to share the extents of one file with another, on btrfs/XFS/etc
+_FICLONE = 0x40049409
+
+CLONE_METHODS = ("auto", "reflink", "hardlink", "copy")
+
+
+class SharedSetupError(Exception):
+    """Raised when the command preparing shared data failed"""
+
+
+def _reflink(source, destination):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+def clone_tree(source, destination, method="auto"):
+    """Copy a prepared directory into a test's directory.
+
+    Args:
+        source: The prepared directory
+        destination: The (existing) directory to copy into
+        method: How to copy each file. 'reflink' shares the data on disk
+            copy-on-write, so is as safe as copying but almost free.
+            'hardlink' is as cheap, but a test modifying a file in place
+            would change it for every test. 'copy' always duplicates the
+            data, and 'auto' tries reflinks before falling back to copying.
+    """
+    use_reflink = method in {"auto", "reflink"}
+    for root, dirs, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            src, dst = os.path.join(root, name), os.path.join(target, name)
+            if method == "hardlink":
+                os.link(src, dst)
+                continue
+            if use_reflink:
+                try:
+                    _reflink(src, dst)
+                    continue
+                except OSError as e:
+                    if method == "reflink" or e.errno not in {
+                        errno.EOPNOTSUPP,
+                        errno.ENOTTY,
+                        errno.EXDEV,
+                        errno.EINVAL,
+                    }:
+                        raise
+                    # Not supported here, so don't keep trying
+                    use_reflink = False
+            shutil.copy2(src, dst)
+
+
+class SharedData:
+    """Directories of prepared data, each built once and cloned into tests.
+
+    A directory is built the first time a test asks for it, by running the
+    setup command inside it. If the command fails, every test that needs
+    it fails with the same error rather than running it again.
+    """
+
+    def __init__(self, base, method="auto"):
+        """
+        Args:
+            base: The directory to build the shared directories in
+            method: How to clone them into tests; see clone_tree
+        """
+        self._base = str(base)
+        self._method = method
+        self._built = {}
+
+    def _build(self, command):
+        directory = os.path.join(self._base, f"shared-{len(self._built)}")
+        os.makedirs(directory)
+        if command[0].endswith(".py"):
+            command = [sys.executable] + command
+        logger.info("Preparing shared data in %s with %s", directory, command)
+        try:
+            result = subprocess.run(command, cwd=directory, capture_output=True)
+        except OSError as e:
+            return SharedSetupError(
+                "Shared setup {} could not be run: {}".format(" ".join(command), e)
+            )
+        if result.returncode:
+            return SharedSetupError(
+                "Shared setup {} failed with exit code {}:\n{}".format(
+                    " ".join(command),
+                    result.returncode,
+                    result.stderr.decode(errors="replace")[-4000:],
+                )
+            )
+        return directory
+
+    def prepare(self, command, destination):
+        """Put the data created by a setup command into a test's directory.
+
+        Args:
+            command: The setup command and arguments, as a list
+            destination: The test's working directory
+
+        Raises:
+            SharedSetupError: If the setup command failed
+        """
+        key = tuple(command)
+        if key not in self._built:
+            self._built[key] = self._build(list(command))
+        built = self._built[key]
+        if isinstance(built, SharedSetupError):
+            raise built
+        clone_tree(built, str(destination), self._method)
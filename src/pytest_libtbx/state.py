@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _logger_handlers():
+    """Get the handlers currently attached to every logger"""
+    loggers = {"": logging.getLogger()}
+    loggers.update(
+        (name, log)
+        for name, log in logging.Logger.manager.loggerDict.items()
+        if isinstance(log, logging.Logger)
+    )
+    return {name: (log, list(log.handlers), log.level) for name, log in loggers.items()}
+
+
+class InterpreterSnapshot:
+    """Saves and restores global interpreter state around an in-process script.
+
+    Covers modules imported, os.environ, the working directory, logging
+    handlers and signal handlers. Only new top-level modules found through
+    the local paths (usually the test script directory, put first on
+    sys.path), and their submodules, are removed, so that the next script
+    imports its own helpers of the same name. Library and extension
+    modules stay imported - even packages that happen to live below a
+    local path: extension modules can't be re-initialised, and keeping
+    them warm is what makes running in-process fast. Loggers created while
+    running are left as they were configured, as libraries set up their
+    own loggers when first imported.
+
+    After exiting, `leaks` lists the kinds of state that the script changed
+    and that needed to be restored.
+    """
+
+    def __init__(self, local_paths=()):
+        """
+        Args:
+            local_paths: Directories whose newly-imported modules are removed
+        """
+        self._local_paths = {os.path.abspath(str(x)) for x in local_paths}
+        self.leaks = []
+        self.dropped_modules = []
+
+    def __enter__(self):
+        self._modules = set(sys.modules)
+        self._environ = dict(os.environ)
+        self._cwd = os.getcwd()
+        self._loggers = _logger_handlers()
+        self._signals = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in signal.valid_signals():
+                try:
+                    self._signals[signum] = signal.getsignal(signum)
+                except (OSError, ValueError):
+                    pass
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._restore_modules()
+        self._restore_environ()
+        self._restore_cwd()
+        self._restore_logging()
+        self._restore_signals()
+        if self.leaks:
+            logger.debug("Restored leaked interpreter state: %s", self.leaks)
+
+    def _found_locally(self, name, module):
+        """Was this top-level module imported from one of the local paths"""
+        filename = getattr(module, "__file__", None)
+        if "." in name or not filename:
+            return False
+        directory = os.path.dirname(os.path.abspath(filename))
+        if os.path.basename(filename).startswith("__init__."):
+            # A package; found in the directory containing it
+            if os.path.basename(directory) != name:
+                return False
+            directory = os.path.dirname(directory)
+        return directory in self._local_paths
+
+    def _restore_modules(self):
+        new = [x for x in sys.modules if x not in self._modules]
+        local = {x for x in new if self._found_locally(x, sys.modules[x])}
+        for name in new:
+            if name.split(".")[0] in local:
+                del sys.modules[name]
+                self.dropped_modules.append(name)
+
+    def _restore_environ(self):
+        if os.environ == self._environ:
+            return
+        self.leaks.append("environ")
+        for key in list(os.environ):
+            if key not in self._environ:
+                del os.environ[key]
+        for key, value in self._environ.items():
+            if os.environ.get(key) != value:
+                os.environ[key] = value
+
+    def _restore_cwd(self):
+        try:
+            changed = os.getcwd() != self._cwd
+        except FileNotFoundError:
+            # The script deleted the directory it was in
+            changed = True
+        if changed:
+            self.leaks.append("cwd")
+            os.chdir(self._cwd)
+
+    def _restore_logging(self):
+        changed = False
+        for name, (log, handlers, level) in _logger_handlers().items():
+            if name not in self._loggers:
+                continue
+            saved_handlers, saved_level = self._loggers[name][1:]
+            if log.handlers != saved_handlers or log.level != saved_level:
+                changed = True
+                log.handlers[:] = saved_handlers
+                log.setLevel(saved_level)
+        if changed:
+            self.leaks.append("logging")
+
+    def _restore_signals(self):
+        changed = False
+        for signum, handler in self._signals.items():
+            try:
+                if handler is None or signal.getsignal(signum) is handler:
+                    continue
+                signal.signal(signum, handler)
+                changed = True
+            except (OSError, ValueError, TypeError):
+                pass
+        if changed:
+            self.leaks.append("signals")
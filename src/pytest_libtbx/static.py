@@ -0,0 +1,410 @@
+from __future__ import annotations
+
+import ast
+import logging
+
+from .runtests import RunTestsInfo
+
+logger = logging.getLogger(__name__)
+
+# The module-level names that collection reads out of run_tests.py
+TEST_LIST_NAMES = {
+    "tst_list",
+    "tst_list_slow",
+    "tst_shared_setup",
+    "tst_timeouts",
+    "tst_run_modes",
+}
+# The fully-qualified name of the libtbx pytest discovery function
+DISCOVER_NAME = "libtbx.test_utils.pytest.discover"
+
+
+class Unresolvable(Exception):
+    """Raised when a run_tests.py can't be understood without importing it."""
+
+
+def _is_main_guard(node):
+    """Is this an 'if __name__ == "__main__":' block, which won't run on import"""
+    test = node.test
+    return (
+        isinstance(test, ast.Compare)
+        and isinstance(test.left, ast.Name)
+        and test.left.id == "__name__"
+        and len(test.comparators) == 1
+        and isinstance(test.comparators[0], ast.Constant)
+        and test.comparators[0].value == "__main__"
+    )
+
+
+def _dotted_name(node):
+    """Convert a Name/Attribute chain to a list of parts, or None"""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return parts[::-1]
+
+
+def _is_discover_call(node):
+    """Could this call node be a call to discover() under any import alias"""
+    if not isinstance(node, ast.Call):
+        return False
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id == "discover"
+    return isinstance(func, ast.Attribute) and func.attr == "discover"
+
+
+def _mutates_test_lists(node):
+    """Does any code under this node bind or mutate the test list names"""
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id in TEST_LIST_NAMES:
+            if not isinstance(child.ctx, ast.Load):
+                return True
+        elif isinstance(child, (ast.Subscript, ast.Attribute)):
+            value = child.value
+            if (
+                not isinstance(child.ctx, ast.Load)
+                and isinstance(value, ast.Name)
+                and value.id in TEST_LIST_NAMES
+            ):
+                return True
+        elif isinstance(child, ast.Global):
+            if TEST_LIST_NAMES.intersection(child.names):
+                return True
+        elif isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute):
+            value = child.func.value
+            if isinstance(value, ast.Name) and value.id in TEST_LIST_NAMES:
+                return True
+    return False
+
+
+def _changed_names(node):
+    """The names that code under this node could rebind or change in place.
+
+    Besides assignment, a method called on a name could change it, and so
+    could any function it is passed to.
+    """
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and not isinstance(child.ctx, ast.Load):
+            names.add(child.id)
+        elif isinstance(child, (ast.Global, ast.Nonlocal)):
+            names.update(child.names)
+        elif isinstance(child, ast.alias):
+            names.add(child.asname or child.name.split(".")[0])
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(child.name)
+        elif isinstance(child, ast.Call):
+            values = [child.func, *child.args, *(x.value for x in child.keywords)]
+        elif isinstance(child, (ast.Subscript, ast.Attribute)):
+            values = [] if isinstance(child.ctx, ast.Load) else [child.value]
+        else:
+            continue
+        if isinstance(child, (ast.Call, ast.Subscript, ast.Attribute)):
+            for value in values:
+                while isinstance(value, (ast.Attribute, ast.Subscript, ast.Starred)):
+                    value = value.value
+                if isinstance(value, ast.Name):
+                    names.add(value.id)
+    return names
+
+
+def _contains(value, target):
+    """Is target, by identity, value or anything inside it"""
+    if value is target:
+        return True
+    if isinstance(value, dict):
+        value = list(value.values())
+    return isinstance(value, (list, tuple)) and any(_contains(x, target) for x in value)
+
+
+def _aliases_test_lists(node):
+    """Could code under this node keep or pass on a reference to a test list.
+
+    An alias, or a function it is passed to, could change the list without
+    naming it. Only concatenating a list, which copies it, and calling its
+    methods as a statement are left for the static evaluation to follow.
+    """
+    parents = {}
+    for parent in ast.walk(node):
+        for child in ast.iter_child_nodes(parent):
+            parents[child] = parent
+    for child, parent in parents.items():
+        if not (
+            isinstance(child, ast.Name)
+            and child.id in TEST_LIST_NAMES
+            and isinstance(child.ctx, ast.Load)
+        ):
+            continue
+        if isinstance(parent, ast.BinOp) and isinstance(parent.op, ast.Add):
+            continue
+        call = parents.get(parent)
+        if (
+            isinstance(parent, ast.Attribute)
+            and isinstance(call, ast.Call)
+            and call.func is parent
+            and isinstance(parents.get(call), ast.Expr)
+        ):
+            continue
+        return True
+    return False
+
+
+class _StaticEvaluator:
+    """Evaluates the literal subset of Python that run_tests.py files use"""
+
+    def __init__(self):
+        self.names = {}
+        # Local names bound to (dotted) imported objects
+        self.imports = {}
+        self.discover_calls = 0
+        # Functions that could change the test lists through another name
+        self.aliasing_functions = set()
+
+    def run(self, tree):
+        for node in tree.body:
+            self.statement(node)
+
+    def statement(self, node):
+        if isinstance(node, ast.If) and _is_main_guard(node):
+            # Not executed when imported for collection
+            return
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # Only matters if the function is used when importing
+            if _aliases_test_lists(node):
+                self.aliasing_functions.add(node.name)
+        elif _aliases_test_lists(node):
+            raise Unresolvable("tst_list referred to other than by concatenation")
+        elif any(
+            isinstance(x, ast.Name) and x.id in self.aliasing_functions
+            for x in ast.walk(node)
+        ):
+            raise Unresolvable("Uses a function that refers to tst_list")
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    self.imports[alias.asname] = alias.name
+                else:
+                    root = alias.name.split(".")[0]
+                    self.imports[root] = root
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                local = alias.asname or alias.name
+                if node.level:
+                    self.imports.pop(local, None)
+                else:
+                    self.imports[local] = f"{node.module}.{alias.name}"
+                self.names.pop(local, None)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            if node.value is None:
+                return
+            try:
+                value = self.expr(node.value)
+            except Unresolvable:
+                # Whatever it is could have side effects
+                self.forget(_changed_names(node.value))
+                value = Unresolvable
+            for target in targets:
+                self.bind(target, value)
+        elif isinstance(node, ast.AugAssign):
+            if not isinstance(node.target, ast.Name):
+                if _mutates_test_lists(node):
+                    raise Unresolvable("Unsupported augmented assignment")
+                self.forget(_changed_names(node))
+                return
+            name = node.target.id
+            try:
+                if not isinstance(node.op, ast.Add) or name not in self.names:
+                    raise Unresolvable(f"Can't update {name}")
+                value = self.expr(node.value)
+                current = self.names[name]
+                if isinstance(current, list) and isinstance(value, (list, tuple)):
+                    # In place, as for a list, so aliases see it too
+                    current.extend(value)
+                    value = current
+                else:
+                    value = self._add(current, value)
+            except Unresolvable:
+                self.forget(_changed_names(node.value))
+                value = Unresolvable
+            self.bind(node.target, value)
+        elif isinstance(node, ast.Expr):
+            self.expression_statement(node)
+        elif _mutates_test_lists(node):
+            raise Unresolvable(f"tst_list altered inside {type(node).__name__}")
+        else:
+            # Not followed, so anything it could change is no longer known
+            changed = _changed_names(node)
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                # Calling it could change anything its body does, but the
+                # test lists are left to aliasing_functions
+                changed -= TEST_LIST_NAMES
+            self.forget(changed)
+
+    def forget(self, names):
+        """Stop tracking names, as something changed them in an unknown way.
+
+        Anything else referring to the same list or dict is forgotten too,
+        as a change in place would be seen through it.
+        """
+        for name in names:
+            self.imports.pop(name, None)
+            if name not in self.names:
+                continue
+            if name in TEST_LIST_NAMES:
+                raise Unresolvable(f"{name} changed in a way that can't be followed")
+            value = self.names.pop(name)
+            if isinstance(value, (list, dict)):
+                self.forget(
+                    [x for x, other in self.names.items() if _contains(other, value)]
+                )
+
+    def expression_statement(self, node):
+        call = node.value
+        if (
+            isinstance(call, ast.Call)
+            and isinstance(call.func, ast.Attribute)
+            and isinstance(call.func.value, ast.Name)
+            and call.func.value.id in self.names
+        ):
+            name = call.func.value.id
+            method = call.func.attr
+            try:
+                target = self.names[name]
+                if (
+                    not isinstance(target, list)
+                    or method not in {"append", "extend"}
+                    or len(call.args) != 1
+                    or call.keywords
+                ):
+                    raise Unresolvable(f"Unsupported call {name}.{method}")
+                value = self.expr(call.args[0])
+                # In place, so that anything else referring to it sees it too
+                if method == "append":
+                    target.append(value)
+                elif isinstance(value, (list, tuple)):
+                    target.extend(value)
+                else:
+                    raise Unresolvable(f"Can't extend {name} statically")
+            except Unresolvable:
+                if name in TEST_LIST_NAMES:
+                    raise
+                self.forget(_changed_names(node))
+        elif _is_discover_call(call):
+            self.expr(call)
+        elif _mutates_test_lists(node):
+            raise Unresolvable("Unsupported expression modifying tst_list")
+        else:
+            self.forget(_changed_names(node))
+
+    def bind(self, target, value):
+        if isinstance(target, ast.Name):
+            self.imports.pop(target.id, None)
+            if value is Unresolvable:
+                if target.id in TEST_LIST_NAMES:
+                    raise Unresolvable(f"Can't evaluate {target.id}")
+                self.names.pop(target.id, None)
+            else:
+                self.names[target.id] = value
+        elif _mutates_test_lists(target):
+            raise Unresolvable("Unsupported assignment to tst_list")
+        else:
+            self.forget(_changed_names(target))
+
+    def expr(self, node):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, (str, int, float, bool, type(None))):
+                return node.value
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            values = []
+            for element in node.elts:
+                if isinstance(element, ast.Starred):
+                    values.extend(self.expr(element.value))
+                else:
+                    values.append(self.expr(element))
+            return values if isinstance(node, ast.List) else tuple(values)
+        elif isinstance(node, ast.Dict):
+            if None in node.keys:
+                raise Unresolvable("Can't statically evaluate ** in a dict")
+            try:
+                return {
+                    self.expr(key): self.expr(value)
+                    for key, value in zip(node.keys, node.values)
+                }
+            except TypeError:
+                raise Unresolvable("Unhashable dict key")
+        elif isinstance(node, ast.Name):
+            if node.id in self.names:
+                return self.names[node.id]
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return self._add(self.expr(node.left), self.expr(node.right))
+        elif isinstance(node, ast.Call):
+            return self.call(node)
+        raise Unresolvable(f"Can't statically evaluate {ast.dump(node)}")
+
+    def call(self, node):
+        parts = _dotted_name(node.func)
+        if parts and parts[0] in self.imports:
+            name = ".".join([self.imports[parts[0]]] + parts[1:])
+            if name == DISCOVER_NAME:
+                # Matches the assertions in CustomRuntestsEnvironment
+                if node.args or node.keywords:
+                    raise Unresolvable("discover() called with arguments")
+                self.discover_calls += 1
+                return []
+        raise Unresolvable(f"Can't statically evaluate call to {parts}")
+
+    @staticmethod
+    def _add(left, right):
+        if isinstance(left, (list, tuple)) and isinstance(right, (list, tuple)):
+            return type(left)(list(left) + list(right))
+        if isinstance(left, str) and isinstance(right, str):
+            return left + right
+        raise Unresolvable("Unsupported addition")
+
+
+def extract_static(source: str, filename: str = "run_tests.py") -> RunTestsInfo:
+    """Read the test lists from a run_tests.py without importing it.
+
+    Only literal lists and dicts, concatenation of previously assigned names
+    and calls to libtbx.test_utils.pytest.discover() are understood.
+
+    Args:
+        source: The contents of the run_tests.py file
+        filename: The filename, for error messages
+
+    Returns:
+        The extracted test lists
+
+    Raises:
+        Unresolvable: If the file does anything that can't be understood
+            without executing it.
+    """
+    try:
+        tree = ast.parse(source, filename)
+    except SyntaxError as e:
+        raise Unresolvable(f"Could not parse {filename}") from e
+
+    evaluator = _StaticEvaluator()
+    evaluator.run(tree)
+
+    # If discover is called anywhere we didn't evaluate, importing might
+    # behave differently, so we can't be sure what the environment does
+    if evaluator.discover_calls != sum(
+        1 for node in ast.walk(tree) if _is_discover_call(node)
+    ):
+        raise Unresolvable("discover() called in unevaluated code")
+
+    return RunTestsInfo(
+        tst_list=evaluator.names.get("tst_list", []),
+        tst_list_slow=evaluator.names.get("tst_list_slow", []),
+        ran_discover=evaluator.discover_calls > 0,
+        shared_setup=evaluator.names.get("tst_shared_setup"),
+        timeouts=evaluator.names.get("tst_timeouts"),
+        run_modes=evaluator.names.get("tst_run_modes"),
+    )
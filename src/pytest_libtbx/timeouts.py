@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import signal
+import subprocess
+import threading
+
+# How long a process group gets to exit after SIGTERM before it is killed
+KILL_GRACE = 5.0
+# How many lines of output to include in a timeout failure message
+TAIL_LINES = 20
+
+
+class TestTimeout(BaseException):
+    """Raised in the main thread when an in-process test runs out of time.
+
+    A BaseException, like KeyboardInterrupt, so that test scripts catching
+    Exception don't swallow it.
+    """
+
+    __test__ = False
+
+
+def signal_group(pid, sig):
+    """Send a signal to a process group, if anything in it is still running"""
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def terminate_group(process, grace=KILL_GRACE):
+    """Stop a subprocess.Popen started in its own session, and its children.
+
+    The group is asked to exit with SIGTERM, then anything left - including
+    children that outlive the leader - is killed once the leader exits or
+    the grace period runs out.
+    """
+    signal_group(process.pid, signal.SIGTERM)
+    try:
+        process.wait(grace)
+    except subprocess.TimeoutExpired:
+        pass
+    signal_group(process.pid, signal.SIGKILL)
+    process.wait()
+
+
+@contextlib.contextmanager
+def alarm(seconds):
+    """Raise TestTimeout in the main thread if the block runs for too long.
+
+    This interrupts python code, but can't interrupt a long-running call
+    into an extension module until it returns to the interpreter. Does
+    nothing if seconds is falsy, or if alarms can't be used here.
+    """
+    if (
+        not seconds
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def _handler(signum, frame):
+        raise TestTimeout(f"Timed out after {seconds:g}s")
+
+    previous = signal.signal(signal.SIGALRM, _handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def timeout_message(seconds, stdout, stderr, lines=TAIL_LINES):
+    """Describe a timeout, with the end of whatever the command printed"""
+    message = f"Timed out after {seconds:g}s; killed the process group"
+    for name, text in (("stdout", stdout), ("stderr", stderr)):
+        tail = text.rstrip().splitlines()[-lines:]
+        if tail:
+            message += f"\n\nLast {len(tail)} lines of {name}:\n" + "\n".join(tail)
+    return message
@@ -0,0 +1,282 @@
+"""Export libtbx test timings, and compare exported timings between runs.
+
+Usage: pytest-libtbx-timings OLD NEW [--threshold RATIO] [--alpha P]
+
+OLD and NEW are files written by --libtbx-timings-out, or directories of
+them; every file in a directory counts as another run of the same build.
+Exits with an error if any test got significantly slower.
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import math
+import os
+import statistics
+import sys
+
+# Written for every test, in this order; the first line of a file lists them
+FIELDS = (
+    "nodeid",
+    "origin",
+    "script",
+    "params",
+    "mode",
+    "outcome",
+    "setup",
+    "call",
+    "teardown",
+)
+
+
+def _outcome(phases):
+    """Combine the reports for each phase into a single test outcome"""
+    setup, call, teardown = (phases.get(x) for x in ("setup", "call", "teardown"))
+    if setup is not None and setup.failed:
+        return "error"
+    if call is None:
+        report = setup or teardown
+        return "xfailed" if hasattr(report, "wasxfail") else report.outcome
+    if hasattr(call, "wasxfail"):
+        return "xpassed" if call.passed else "xfailed"
+    if teardown is not None and teardown.failed and call.passed:
+        return "error"
+    return call.outcome
+
+
+class TimingsWriter:
+    """Writes a JSON line for each libtbx test as it finishes.
+
+    The reports for each phase are gathered until teardown, so every
+    record has the time taken for each phase and the overall outcome.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "w")
+        self._file.write(json.dumps(FIELDS) + "\n")
+        self._phases = {}
+
+    def add(self, report):
+        properties = dict(report.user_properties)
+        if "libtbx_origin" not in properties:
+            return
+        phases = self._phases.setdefault(report.nodeid, {})
+        phases[report.when] = report
+        if report.when != "teardown":
+            return
+        del self._phases[report.nodeid]
+        # The mode and cached marker are only added once the test has run
+        properties = dict(x for phase in phases.values() for x in phase.user_properties)
+        mode = properties.get("libtbx_mode")
+        if properties.get("libtbx_cached"):
+            mode = "cached"
+        record = {
+            "nodeid": report.nodeid,
+            "origin": properties["libtbx_origin"],
+            "script": properties.get("libtbx_script"),
+            "params": properties.get("libtbx_params", []),
+            "mode": mode,
+            "outcome": _outcome(phases),
+        }
+        for when in ("setup", "call", "teardown"):
+            phase = phases.get(when)
+            record[when] = round(phase.duration, 6) if phase is not None else None
+        self._file.write(json.dumps([record[x] for x in FIELDS]) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_timings(paths):
+    """Read exported timings, as records for every run of each test.
+
+    Args:
+        paths: Files written by TimingsWriter, or directories of them
+
+    Returns:
+        dict: A list of record dictionaries for each nodeid
+    """
+    records = {}
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "*")))
+        for filename in files:
+            with open(filename) as f:
+                fields = json.loads(f.readline())
+                for line in f:
+                    if line.strip():
+                        record = dict(zip(fields, json.loads(line)))
+                        records.setdefault(record["nodeid"], []).append(record)
+    return records
+
+
+def _betainc(a, b, x):
+    """The regularized incomplete beta function, by continued fraction"""
+    if x <= 0 or x >= 1:
+        return max(0.0, min(1.0, x))
+    if x > (a + 1) / (a + b + 2):
+        return 1 - _betainc(b, a, 1 - x)
+    front = math.exp(
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log(1 - x)
+    )
+    # Lentz's method
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1) < 1e-12:
+            break
+    return front * result / a
+
+
+def t_sf(t, df):
+    """The probability of a Student's t statistic being at least t"""
+    tail = 0.5 * _betainc(df / 2, 0.5, df / (df + t * t))
+    return tail if t > 0 else 1 - tail
+
+
+def welch_test(old, new):
+    """One-sided Welch's t-test that the new samples have a larger mean.
+
+    Returns:
+        The p-value, or None if there aren't enough samples
+    """
+    if len(old) < 2 or len(new) < 2:
+        return None
+    var_old = statistics.variance(old) / len(old)
+    var_new = statistics.variance(new) / len(new)
+    difference = statistics.mean(new) - statistics.mean(old)
+    if var_old + var_new == 0:
+        return 0.0 if difference > 0 else 1.0
+    t = difference / math.sqrt(var_old + var_new)
+    df = (var_old + var_new) ** 2 / (
+        var_old**2 / (len(old) - 1) + var_new**2 / (len(new) - 1)
+    )
+    return t_sf(t, df)
+
+
+def _durations(records):
+    """The call durations of the runs that actually ran and passed"""
+    return [
+        x["call"]
+        for x in records
+        if x["outcome"] == "passed" and x["mode"] != "cached" and x["call"]
+    ]
+
+
+def compare(old, new, threshold=1.2, alpha=0.01, min_difference=0.5):
+    """Find the tests that got slower between two sets of timings.
+
+    A test is slower if its mean time grew by more than the threshold ratio
+    and min_difference seconds. With at least two runs on each side the
+    increase must also be significant by Welch's t-test at level alpha.
+
+    Args:
+        old: Timings from read_timings for the baseline
+        new: Timings from read_timings to check
+
+    Returns:
+        tuple: A list of (nodeid, old mean, new mean, p-value or None) for
+            each slower test, slowest relative to before first; and the
+            log ratio of new to old mean time for every test in both.
+    """
+    slower = []
+    log_ratios = []
+    for nodeid in sorted(set(old) & set(new)):
+        before, after = _durations(old[nodeid]), _durations(new[nodeid])
+        if not before or not after:
+            continue
+        old_mean, new_mean = statistics.mean(before), statistics.mean(after)
+        log_ratios.append(math.log(new_mean / old_mean))
+        if new_mean < old_mean * threshold or new_mean - old_mean < min_difference:
+            continue
+        p = welch_test(before, after)
+        if p is None or p < alpha:
+            slower.append((nodeid, old_mean, new_mean, p))
+    slower.sort(key=lambda x: x[2] / x[1], reverse=True)
+    return slower, log_ratios
+
+
+def _overall(log_ratios):
+    """Summarise the change in time across every test"""
+    ratio = math.exp(statistics.mean(log_ratios))
+    line = f"Overall: {ratio:.3f}x geometric mean time over {len(log_ratios)} tests"
+    if len(log_ratios) > 2 and statistics.stdev(log_ratios) > 0:
+        t = statistics.mean(log_ratios) / (
+            statistics.stdev(log_ratios) / math.sqrt(len(log_ratios))
+        )
+        line += f" (p={t_sf(abs(t), len(log_ratios) - 1) * 2:.3g})"
+    return line
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]),
+    )
+    parser.add_argument("old", help="Baseline timings file or directory")
+    parser.add_argument("new", help="Timings file or directory to check")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="Only report tests taking this many times as long (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-difference",
+        type=float,
+        default=0.5,
+        metavar="SECONDS",
+        help="Only report tests taking this much longer (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.01,
+        help="Significance level, for tests with two or more runs on each "
+        "side (default: %(default)s)",
+    )
+    options = parser.parse_args(args)
+
+    slower, log_ratios = compare(
+        read_timings([options.old]),
+        read_timings([options.new]),
+        threshold=options.threshold,
+        alpha=options.alpha,
+        min_difference=options.min_difference,
+    )
+    if not log_ratios:
+        sys.exit("No passing tests in common to compare")
+    print(_overall(log_ratios))
+    for nodeid, old_mean, new_mean, p in slower:
+        significance = f"  p={p:.3g}" if p is not None else ""
+        print(
+            f"{new_mean / old_mean:6.2f}x {old_mean:9.3f}s -> {new_mean:9.3f}s  "
+            f"{nodeid}{significance}"
+        )
+    if slower:
+        sys.exit(f"{len(slower)} tests got slower")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import fcntl
+import glob
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+ROOT_PREFIX = "pytest-libtbx-"
+# How many previous sessions' directories to keep
+KEEP_SESSIONS = 3
+
+_REMOVE_SCRIPT = """
+import shutil, sys
+for path in sys.argv[1:]:
+    shutil.rmtree(path, ignore_errors=True)
+"""
+
+
+def _remove_in_background(paths):
+    """Delete directories in a detached process that can outlive pytest"""
+    if not paths:
+        return
+    subprocess.Popen(
+        [sys.executable, "-c", _REMOVE_SCRIPT, *paths],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _is_locked(root):
+    """Is another process still using this session directory"""
+    try:
+        with open(os.path.join(root, ".lock")) as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+    except OSError:
+        pass
+    return False
+
+
+class TempDirPool:
+    """Working directories for tests, reused rather than created for each.
+
+    Each session gets a directory under the base path, containing numbered
+    working directories. A released directory that a test left files in is
+    renamed aside - cheap on any filesystem - and an empty one put back in
+    its place, so nothing is deleted while tests are running. Everything is
+    removed by a background process at the end of the session, along with
+    the directories of older sessions.
+    """
+
+    def __init__(self, base):
+        """
+        Args:
+            base: Where to create the directories, e.g. a tmpfs or local disk
+        """
+        os.makedirs(base, exist_ok=True)
+        self.root = tempfile.mkdtemp(prefix=ROOT_PREFIX, dir=str(base))
+        # Hold a lock while running, so cleanup by other sessions skips us
+        self._lock = open(os.path.join(self.root, ".lock"), "w")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        self._trash = os.path.join(self.root, ".trash")
+        os.mkdir(self._trash)
+        self._free = []
+        self._count = 0
+        self._discarded = 0
+        self._kept = 0
+
+    def acquire(self):
+        """Get an empty directory for a test to work in"""
+        if self._free:
+            return self._free.pop()
+        self._count += 1
+        path = os.path.join(self.root, str(self._count))
+        os.mkdir(path)
+        return path
+
+    def release(self, path, keep_as=None):
+        """Return a directory to the pool once a test has finished with it.
+
+        Args:
+            path: The directory from acquire()
+            keep_as: If given, keep the directory contents (e.g. for
+                inspecting a failure) under this name in the session
+                directory, instead of discarding them
+        """
+        if keep_as is not None:
+            self._kept += 1
+            kept = os.path.join(self.root, "kept", f"{keep_as}-{self._kept}")
+            os.makedirs(os.path.dirname(kept), exist_ok=True)
+            os.rename(path, kept)
+            os.mkdir(path)
+        elif os.listdir(path):
+            self._discarded += 1
+            os.rename(path, os.path.join(self._trash, str(self._discarded)))
+            os.mkdir(path)
+        self._free.append(path)
+
+    def cleanup(self):
+        """Remove all the directories, without waiting for them to be deleted.
+
+        Directories kept for failed tests stay until the session directory
+        is old enough to be removed with the rest.
+        """
+        remove = [self._trash] + [
+            os.path.join(self.root, str(x)) for x in range(1, self._count + 1)
+        ]
+        pattern = os.path.join(os.path.dirname(self.root), ROOT_PREFIX + "*")
+        sessions = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)
+        for old in sessions[KEEP_SESSIONS:]:
+            if old != self.root and not _is_locked(old):
+                remove.append(old)
+        fcntl.flock(self._lock, fcntl.LOCK_UN)
+        self._lock.close()
+        self._free = []
+        _remove_in_background(remove)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 import sys
 from collections import defaultdict
 from types import ModuleType
@@ -7,9 +8,36 @@ from types import ModuleType
 import py.path
 import pytest
 
+import pytest_libtbx
+
 pytest_plugins = "pytester"
 
 
+def pytest_configure(config):
+    # Registered by the plugin, which isn't loaded when testing its modules
+    config.addinivalue_line("markers", "libtbx_timeout(seconds): libtbx test timeout")
+    config.addinivalue_line("markers", "libtbx_run_mode(mode): libtbx test run mode")
+
+
+class DictStore:
+    """Minimal stand-in for pytest's config.cache"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+@pytest.fixture
+def store():
+    """An empty in-memory store, in place of config.cache"""
+    return DictStore()
+
+
 def _build_raiser(message):
     """Builds a callable that raises if called with a custom message"""
 
@@ -19,6 +47,13 @@ def _build_raiser(message):
     return _raise
 
 
+class FakeLibTBXPath(py.path.local):
+    """A module path that, like libtbx's own path objects, works with abs()"""
+
+    def __abs__(self):
+        return self.strpath
+
+
 class FakeLibTBXModule:
     def __init__(self, name, path):
         self.name = name
@@ -95,7 +130,7 @@ class FakeLibTBX:
         Returns:
             The dist path for the new module.
         """
-        path = self._dist_path / name
+        path = FakeLibTBXPath(self._dist_path / name)
         if not path.check():
             path.mkdir()
         if init:
@@ -104,6 +139,28 @@ class FakeLibTBX:
         self.module_dist_paths[name] = path
         return path
 
+    def add_tests(self, name, tst_list, scripts, tst_list_slow=()):
+        """Add a libtbx module with a run_tests.py and the scripts it lists.
+
+        Args:
+            name: The module name
+            tst_list: The tst_list entries to write to the run_tests.py
+            scripts: The contents of each script, by filename in the module
+            tst_list_slow: Any tst_list_slow entries
+
+        Returns:
+            The dist path for the new module.
+        """
+        path = self.add_module(name)
+        (path / "run_tests.py").write(
+            "from libtbx.test_utils.pytest import discover\n"
+            f"tst_list = {list(tst_list)!r} + discover()\n"
+            f"tst_list_slow = {list(tst_list_slow)!r}\n"
+        )
+        for script, content in scripts.items():
+            (path / script).write(content)
+        return path
+
     def dist_path(self, name):
         return self.module_dist_paths[name]
 
@@ -165,8 +222,120 @@ class FakeLibTBX:
 #             f.write(str(libtbx)+"\n")
 
 
+# load_env.py for a libtbx distribution on disk. It reads the modules from a
+# modules.list beside cctbx_project, and notes when it is loaded.
+_DISK_LOAD_ENV = """\
+import os
+
+import libtbx
+
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+open(os.path.join(_root, "loaded"), "a").close()
+
+
+class _Path(str):
+    def __abs__(self):
+        return str(self)
+
+
+class _Module:
+    def __init__(self, name):
+        self.name = name
+        directory = "cctbx_project/libtbx" if name == "libtbx" else name
+        self.dist_paths = [_Path(os.path.join(_root, directory)), None]
+
+
+class _Environment:
+    def __init__(self):
+        with open(os.path.join(_root, "modules.list")) as f:
+            self.module_list = [_Module(x.strip()) for x in f if x.strip()]
+        self.module_dist_paths = {x.name: x.dist_paths[0] for x in self.module_list}
+
+    def dist_path(self, name):
+        return self.module_dist_paths[name]
+
+    def under_build(self, name):
+        return _Path(os.path.join(_root, "_build", name))
+
+    def has_module(self, name):
+        return name in self.module_dist_paths
+
+
+libtbx.env = _Environment()
+"""
+
+
+class DiskLibTBX:
+    """A libtbx distribution on disk, for running pytest against in a subprocess.
+
+    Unlike FakeLibTBX, this is found by importing, so is also seen by any
+    other processes pytest starts, such as xdist workers.
+    """
+
+    def __init__(self, testdir, root):
+        self._testdir = testdir
+        self.root = root
+        libtbx = root.mkdir("cctbx_project").mkdir("libtbx")
+        (libtbx / "__init__.py").write("")
+        (libtbx / "load_env.py").write(_DISK_LOAD_ENV)
+        (libtbx.mkdir("test_utils") / "__init__.py").write("")
+        (libtbx / "test_utils" / "pytest.py").write("def discover():\n    return []\n")
+        (root / "modules.list").write("libtbx\n")
+
+    def add_tests(self, name, tst_list, scripts):
+        """Add a module with a run_tests.py, as FakeLibTBX.add_tests"""
+        path = self.root.mkdir(name)
+        (path / "__init__.py").write("")
+        (path / "run_tests.py").write(
+            "from libtbx.test_utils.pytest import discover\n"
+            f"tst_list = {list(tst_list)!r} + discover()\n"
+        )
+        for script, content in scripts.items():
+            (path / script).write(content)
+        with (self.root / "modules.list").open("a") as f:
+            f.write(name + "\n")
+        return path
+
+    def runpytest(self, *args):
+        """Run pytest with the plugin in a subprocess"""
+        return self._testdir.runpytest_subprocess(
+            "-p", "pytest_libtbx.plugin", "-p", "no:cacheprovider", *args
+        )
+
+
+@pytest.fixture
+def disk_libtbx(testdir, monkeypatch):
+    """Create a libtbx distribution on disk, importable by subprocesses"""
+    root = testdir.mkdir("modules")
+    src = os.path.dirname(os.path.dirname(pytest_libtbx.__file__))
+    monkeypatch.setenv(
+        "PYTHONPATH", os.pathsep.join([str(root / "cctbx_project"), src])
+    )
+    return DiskLibTBX(testdir, root)
+
+
 @pytest.fixture
 def libtbx(testdir):
     """Create a fake libtbx environment and return it"""
     with FakeLibTBX(testdir.tmpdir) as libtbx:
         yield libtbx
+
+
+@pytest.fixture
+def run_libtbx(testdir, libtbx):
+    """Run pytest in-process with the plugin, against the fake environment.
+
+    The plugin keeps its state in module globals for the life of a real
+    session, so every run imports a fresh copy of it.
+    """
+
+    def _run(*args):
+        previous = sys.modules.pop("pytest_libtbx.plugin", None)
+        try:
+            return testdir.runpytest("-p", "pytest_libtbx.plugin", *args)
+        finally:
+            sys.modules.pop("pytest_libtbx.plugin", None)
+            if previous is not None:
+                sys.modules["pytest_libtbx.plugin"] = previous
+
+    return _run
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from pytest_libtbx.async_runner import AsyncCommandRunner
+
+
+def test_commands_overlap(tmpdir):
+    runner = AsyncCommandRunner(limit=4)
+    try:
+        start = time.monotonic()
+        futures = [
+            runner.submit(["sh", "-c", f"sleep 0.3; echo {i}; echo err >&2"], tmpdir)
+            for i in range(4)
+        ]
+        results = [x.result(timeout=10) for x in futures]
+        assert time.monotonic() - start < 1.0
+    finally:
+        runner.shutdown()
+
+    assert [x.stdout for x in results] == ["0\n", "1\n", "2\n", "3\n"]
+    assert all(x.stderr == "err\n" and x.exitcode == 0 for x in results)
+
+
+def test_shutdown_cancels_running(tmpdir):
+    runner = AsyncCommandRunner(limit=1)
+    running = runner.submit(["sleep", "30"], tmpdir)
+    waiting = runner.submit(["sleep", "30"], tmpdir)
+    time.sleep(0.2)
+    start = time.monotonic()
+    runner.shutdown()
+    assert time.monotonic() - start < 5
+    assert running.cancelled() and waiting.cancelled()
+
+
+def test_plugin_launches_commands_ahead(run_libtbx, libtbx, testdir):
+    marker = testdir.tmpdir / "second_started"
+    module = libtbx.add_tests(
+        "mymod",
+        ["$D/tst_first.sh", "$D/tst_second.sh", "$D/tst_python.py"],
+        {
+            # Only passes if the second command starts while this one waits
+            "tst_first.sh": f"#!/bin/sh\nfor i in $(seq 40); do\n"
+            f"  [ -e {marker} ] && exit 0\n  sleep 0.05\ndone\nexit 1\n",
+            "tst_second.sh": f"#!/bin/sh\ntouch {marker}\n",
+            "tst_python.py": "",
+        },
+    )
+    for script in ("tst_first.sh", "tst_second.sh"):
+        (module / script).chmod(0o755)
+
+    result = run_libtbx("-v", "--libtbx-async-procs=2")
+    result.assert_outcomes(passed=3)
+    # Results are still reported in collection order
+    result.stdout.fnmatch_lines(
+        [
+            "*mymod/tst_first.sh::main PASSED*",
+            "*mymod/tst_second.sh::main PASSED*",
+            "*mymod/tst_python.py::main PASSED*",
+        ]
+    )
+
+    # Run one at a time, the first command gives up waiting for the second
+    marker.remove()
+    result = run_libtbx("--libtbx-async-procs=0", "-k", "first")
+    result.assert_outcomes(failed=1, deselected=2)
+
+
+def test_plugin_launches_each_command_once_under_xdist(disk_libtbx, testdir):
+    pytest.importorskip("xdist")
+    runs = testdir.mkdir("runs")
+    names = [f"tst_{i}.sh" for i in range(6)]
+    module = disk_libtbx.add_tests(
+        "mymod",
+        [f"$D/{x}" for x in names],
+        {x: f"#!/bin/sh\necho ran >> {runs / x}\n" for x in names},
+    )
+    for name in names:
+        (module / name).chmod(0o755)
+
+    result = disk_libtbx.runpytest("-n", "2", "--libtbx-async-procs=2", str(module))
+    result.assert_outcomes(passed=6)
+    assert {x.basename: x.read() for x in runs.listdir()} == dict.fromkeys(
+        names, "ran\n"
+    )
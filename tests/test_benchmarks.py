@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+
+
+def test_benchmarks_run(tmp_path):
+    output = tmp_path / "results.json"
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(BENCHMARKS, "run.py"),
+            *("--modules", "2", "--entries", "3", "--depth", "1", "--repeat", "1"),
+            *("--output", str(output)),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.startswith("6 tests in 2 modules")
+    (record,) = json.loads(output.read_text())
+    assert set(record["timings"]) == {"collect", "run", "import"}
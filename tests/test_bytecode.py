@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import os
+import sys
+
+from pytest_libtbx.bytecode import CodeCache, run_code_as_main
+
+
+def test_code_cache(tmpdir, monkeypatch):
+    script = tmpdir / "tst_script.py"
+    script.write("result = 1\n")
+    cache = CodeCache(tmpdir.mkdir("cache"))
+    code = cache.get(script)
+    assert cache.get(script) is code
+    assert len(tmpdir.join("cache").listdir()) == 1
+
+    # A new session loads the code from disk without compiling
+    def _fail(*args, **kwargs):
+        raise AssertionError("Should not compile")
+
+    monkeypatch.setattr("builtins.compile", _fail)
+    assert CodeCache(tmpdir / "cache").get(script) == code
+    monkeypatch.undo()
+
+    # Changing the script invalidates both caches
+    script.write("result = 22\n")
+    stat = os.stat(script.strpath)
+    os.utime(script.strpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run_code_as_main(cache.get(script), script)["result"] == 22
+    assert (
+        run_code_as_main(CodeCache(tmpdir / "cache").get(script), script)["result"]
+        == 22
+    )
+
+
+def test_run_code_as_main(tmpdir):
+    script = tmpdir / "tst_main.py"
+    script.write(
+        "import sys\n"
+        "assert sys.modules['__main__'].__file__ == __file__\n"
+        "if __name__ == '__main__':\n"
+        "    ran = True\n"
+    )
+    prior_main = sys.modules["__main__"]
+    namespace = run_code_as_main(CodeCache().get(script), script)
+    assert namespace["ran"]
+    assert namespace["__file__"] == str(script)
+    assert sys.modules["__main__"] is prior_main
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import os
+import sys
+
+from pytest_libtbx.cache import RunTestsCache, libtbx_env_fingerprint
+from pytest_libtbx.runtests import RunTestsInfo
+
+
+def test_runtests_info_normalises_entries():
+    info = RunTestsInfo(["$D/tst_a.py", ("$D/tst_b.py", 1, "x"), print], [], True)
+    assert info.tst_list == ["$D/tst_a.py", ["$D/tst_b.py", "1", "x"], None]
+    assert RunTestsInfo.from_dict(info.to_dict()) == info
+
+
+def test_cache_roundtrip_and_invalidation(libtbx, tmpdir, store):
+    run_tests = tmpdir / "run_tests.py"
+    run_tests.write("tst_list = ['$D/tst_a.py']\n")
+    info = RunTestsInfo(["$D/tst_a.py"], [], True)
+    fingerprint = libtbx_env_fingerprint(libtbx)
+
+    cache = RunTestsCache(store, fingerprint)
+    assert cache.get(run_tests) is None
+    cache.set(run_tests, info, static=False)
+    cache.save()
+
+    # A new session sees the stored entry
+    assert RunTestsCache(store, fingerprint).get(run_tests) == info
+
+    # Touching without changing content keeps the entry valid
+    stat = os.stat(run_tests.strpath)
+    os.utime(run_tests.strpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert RunTestsCache(store, fingerprint).get(run_tests) == info
+
+    # Changing the content invalidates it
+    run_tests.write("tst_list = ['$D/tst_b.py']\n")
+    assert RunTestsCache(store, fingerprint).get(run_tests) is None
+
+
+def test_cache_discarded_if_environment_changes(libtbx, tmpdir, store):
+    run_tests = tmpdir / "run_tests.py"
+    run_tests.write("tst_list = []\n")
+    cache = RunTestsCache(store, libtbx_env_fingerprint(libtbx))
+    cache.set(run_tests, RunTestsInfo(), static=False)
+    cache.save()
+
+    libtbx.add_module("cctbx")
+    assert RunTestsCache(store, libtbx_env_fingerprint(libtbx)).get(run_tests) is None
+
+
+def test_cache_static_entries_only_when_allowed(libtbx, tmpdir, store):
+    run_tests = tmpdir / "run_tests.py"
+    run_tests.write("tst_list = ['$D/tst_a.py']\n")
+    info = RunTestsInfo(["$D/tst_a.py"], [], True)
+    cache = RunTestsCache(store, libtbx_env_fingerprint(libtbx))
+    cache.set(run_tests, info, static=True)
+    assert cache.get(run_tests) == info
+    assert cache.get(run_tests, static=False) is None
+
+    cache.set(run_tests, info, static=False)
+    assert cache.get(run_tests, static=False) == info
+
+
+def test_plugin_import_ignores_static_cache(run_libtbx, libtbx, testdir, monkeypatch):
+    libtbx.add_tests("mymod", ["$D/tst_a.py"], {"tst_a.py": ""})
+    # Where importing it finds it, as in a libtbx distribution
+    monkeypatch.syspath_prepend(testdir.tmpdir)
+
+    def _method(*args):
+        result = run_libtbx("--collect-only", "--libtbx-collect-profile", *args)
+        result.assert_outcomes()
+        (line,) = [x for x in result.outlines if x.endswith("mymod/run_tests.py")]
+        return line.split()[1]
+
+    try:
+        assert _method() == "static"
+        assert _method() == "cache"
+        # Asking to import means not trusting the static read
+        assert _method("--libtbx-collect=import") == "import"
+        assert _method("--libtbx-collect=import") == "cache"
+        assert _method() == "cache"
+    finally:
+        sys.modules.pop("mymod.run_tests", None)
+        sys.modules.pop("mymod", None)
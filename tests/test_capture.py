@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+
+import pytest
+
+from pytest_libtbx.async_runner import AsyncCommandRunner
+from pytest_libtbx.capture import StreamCapture, parse_size, run_streaming
+
+
+def test_parse_size():
+    assert parse_size("100") == 100
+    assert parse_size("2k") == 2048
+    assert parse_size("1.5M") == 1536 * 1024
+    assert parse_size("1GB") == 1024**3
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_size("lots")
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_size("0")
+
+
+def test_capture_keeps_head_and_tail(tmp_path):
+    capture = StreamCapture(10, str(tmp_path / "out"))
+    for chunk in [b"abc", b"defgh", b"ijklmnopq", b"rstuvwxyz"]:
+        capture.write(chunk)
+    capture.close()
+    assert capture.size == 26
+    assert (tmp_path / "out").read_bytes() == b"abcdefghijklmnopqrstuvwxyz"
+    text = capture.text()
+    assert text.startswith("abcde\n[... 16 bytes omitted; full output in ")
+    assert text.endswith(" ...]\nvwxyz")
+
+
+def test_capture_small_output_unchanged():
+    capture = StreamCapture(10)
+    capture.write(b"short")
+    assert capture.text() == "short"
+
+
+def test_run_streaming(tmp_path):
+    script = "head -c 100000 /dev/zero | tr '\\0' x; echo; echo oops >&2; exit 3"
+    result = run_streaming(
+        ["sh", "-c", script], 100, cwd=tmp_path, log_prefix=tmp_path / "log"
+    )
+    assert result.exitcode == 3
+    assert result.stderr == "oops\n"
+    assert result.stdout.startswith("x" * 50 + "\n[... 99901 bytes omitted")
+    assert result.stdout.endswith("...]\n" + "x" * 49 + "\n")
+    assert "99901 bytes omitted" in result.stdout
+    assert (tmp_path / "log.stdout").stat().st_size == 100001
+
+
+def test_async_runner_capture_limit(tmp_path):
+    runner = AsyncCommandRunner(limit=1, capture_limit=10)
+    try:
+        result = runner.submit(["sh", "-c", "seq 1000"], tmp_path).result(timeout=10)
+    finally:
+        runner.shutdown()
+    assert result.exitcode == 0
+    assert result.stdout.startswith("1\n2\n3\n")
+    assert result.stdout.endswith("\n1000\n")
+    assert "bytes omitted" in result.stdout
+    assert not result.stderr
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import sys
+
+from pytest_libtbx.collect_profile import CollectionProfile, ImportProfiler
+
+
+def test_import_profiler_records_nested_imports(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(tmpdir)
+    (tmpdir / "tst_profile_outer.py").write("import tst_profile_inner\n")
+    (tmpdir / "tst_profile_inner.py").write("import time\ntime.sleep(0.05)\n")
+    try:
+        with ImportProfiler() as profiler:
+            import tst_profile_outer  # noqa: F401
+    finally:
+        sys.modules.pop("tst_profile_outer", None)
+        sys.modules.pop("tst_profile_inner", None)
+
+    assert set(profiler.modules) >= {"tst_profile_outer", "tst_profile_inner"}
+    # The outer module's time excludes the nested import
+    assert profiler.modules["tst_profile_inner"] >= 0.05
+    assert profiler.modules["tst_profile_outer"] < 0.05
+
+
+def test_collection_report():
+    profile = CollectionProfile()
+    with profile.measure("a/run_tests.py") as record:
+        record.method = "static"
+    lines = []
+    profile.report(lines.append)
+    assert lines[0].startswith("Read 1 run_tests.py")
+    assert "static" in lines[2] and lines[2].endswith("a/run_tests.py")
+
+
+def test_collection_report_pool():
+    profile = CollectionProfile()
+    profile.add_pool(1.5, 2, {"a/run_tests.py": 0.75, "b/run_tests.py": 0.5})
+    with profile.measure("a/run_tests.py") as record:
+        record.method = "pool"
+    lines = []
+    profile.report(lines.append)
+    # The time the worker spent reading the file is counted against it
+    assert record.seconds >= 0.75
+    assert lines[1] == (
+        "Read 2 ahead of collection in 1.50s wall with 2 processes "
+        "(1.25s in the workers)"
+    )
+    assert "pool" in lines[3] and lines[3].endswith("a/run_tests.py")
@@ -18,6 +18,39 @@ def test_empty_dials_runtest(testdir, libtbx):
     raise NotImplementedError()
 
 
+def test_collects_run_tests_entries(run_libtbx, libtbx):
+    libtbx.add_tests(
+        "mymod",
+        ["$D/tst_a.py", ["$D/tst_b.py", "1", "x"], ["$D/tst_b.py", "2"]],
+        {"tst_a.py": "", "tst_b.py": ""},
+    )
+    result = run_libtbx("--collect-only", "-q")
+    result.stdout.fnmatch_lines(
+        [
+            "mymod/tst_a.py::main",
+            "mymod/tst_b.py::1_x",
+            "mymod/tst_b.py::2",
+            "3 tests collected*",
+        ]
+    )
+    assert result.ret == 0
+
+
+def test_runs_run_tests_entries(run_libtbx, libtbx):
+    libtbx.add_tests(
+        "mymod",
+        ["$D/tst_pass.py", "$D/tst_fail.py", ["$D/tst_args.py", "a", "b"]],
+        {
+            "tst_pass.py": "print('ran')\n",
+            "tst_fail.py": "import sys\nsys.exit(3)\n",
+            "tst_args.py": "import sys\nassert sys.argv[1:] == ['a', 'b']\n",
+        },
+    )
+    result = run_libtbx("-v")
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines(["*mymod/tst_fail.py::main FAILED*"])
+
+
 # def test_empty_run_tests(testdir):
 #     testdir.makepyfile(run_tests="")
 #     result = testdir.runpytest("--collect-only", "-v")
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pytest_libtbx.deps import (
+    DependencyIndex,
+    bootstrap_environment,
+    changed_paths,
+    read_deps_file,
+)
+from pytest_libtbx.forkserver import ForkServerRunner
+from pytest_libtbx.record import DependencyRecorder, ExecutionRecorder, ImportRecorder
+
+
+def test_import_recorder_sees_already_imported(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(tmpdir)
+    (tmpdir / "tst_deps_helper.py").write("value = 1\n")
+    import tst_deps_helper  # noqa: F401
+
+    try:
+        with ImportRecorder() as recorder:
+            from json import decoder  # noqa: F401
+
+            import tst_deps_helper  # noqa: F401, F811
+    finally:
+        sys.modules.pop("tst_deps_helper", None)
+    assert str(tmpdir / "tst_deps_helper.py") in recorder.files
+    assert sys.modules["json.decoder"].__file__ in recorder.files
+
+
+@pytest.mark.skipif(not ExecutionRecorder.available, reason="Needs sys.monitoring")
+def test_execution_recorder_sees_code_run(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(tmpdir)
+    (tmpdir / "tst_exec_helper.py").write("def f():\n    return 1\n")
+    (tmpdir / "tst_exec_unused.py").write("def g():\n    return 1\n")
+    try:
+        import tst_exec_helper
+        import tst_exec_unused  # noqa: F401
+
+        # Twice, as code that ran while recording before must be seen again
+        for _ in range(2):
+            with ExecutionRecorder() as recorder:
+                tst_exec_helper.f()
+            assert str(tmpdir / "tst_exec_helper.py") in recorder.files
+            assert str(tmpdir / "tst_exec_unused.py") not in recorder.files
+    finally:
+        sys.modules.pop("tst_exec_helper", None)
+        sys.modules.pop("tst_exec_unused", None)
+
+
+def test_bootstrapped_subprocess(tmpdir):
+    (tmpdir / "tst_sub_helper.py").write("value = 1\n")
+    script = tmpdir / "tst_sub.py"
+    script.write("import tst_sub_helper\nimport sitecustomize\nprint('ran')\n")
+    # Any existing sitecustomize still gets imported
+    hidden = tmpdir.mkdir("hidden")
+    (hidden / "sitecustomize.py").write("import os\nos.environ['HIDDEN'] = '1'\n")
+
+    deps_file = tmpdir / "deps.txt"
+    env = dict(os.environ, PYTHONPATH=str(hidden))
+    env.update(bootstrap_environment(deps_file, env))
+    result = subprocess.run(
+        [sys.executable, str(script)],
+        env=env,
+        cwd=tmpdir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout == "ran\n" and result.stderr == ""
+    files = read_deps_file(deps_file)
+    assert str(tmpdir / "tst_sub_helper.py") in files
+    assert str(hidden / "sitecustomize.py") in files
+    assert not deps_file.exists()
+    assert read_deps_file(deps_file) == set()
+
+
+def test_forkserver_records(tmpdir):
+    (tmpdir / "tst_fork_helper.py").write("value = 1\n")
+    script = tmpdir / "tst_fork.py"
+    script.write("import tst_fork_helper\n")
+    result = ForkServerRunner(preload=[]).run(
+        script, [str(script)], tmpdir, record_deps=True
+    )
+    assert str(tmpdir / "tst_fork_helper.py") in result.files
+
+
+def test_dependency_recorder_combines(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(tmpdir)
+    (tmpdir / "tst_combined_helper.py").write("value = 1\n")
+    try:
+        with DependencyRecorder() as recorder:
+            import tst_combined_helper  # noqa: F401
+    finally:
+        sys.modules.pop("tst_combined_helper", None)
+    assert str(tmpdir / "tst_combined_helper.py") in recorder.files
+
+
+def test_dependency_index_merges_on_save(store):
+    first = DependencyIndex(store)
+    second = DependencyIndex(store)
+    first.record("a::main", {"/m/a.py", "/m/common.py"})
+    second.record("b::main", {"/m/b.py", "/m/common.py"})
+    first.save()
+    second.save()
+
+    index = DependencyIndex(store)
+    assert index.files_for("a::main") == {"/m/a.py", "/m/common.py"}
+    assert index.files_for("b::main") == {"/m/b.py", "/m/common.py"}
+    assert index.files_for("c::main") is None
+    assert len(store.data["libtbx/dependencies"]["files"]) == 3
+
+    # Recording the same files again doesn't need saving
+    index.record("a::main", {"/m/common.py", "/m/a.py"})
+    store.data.clear()
+    index.save()
+    assert store.data == {}
+
+
+def test_changed_paths_from_file(tmpdir):
+    listing = tmpdir / "changed.txt"
+    listing.write(f"{tmpdir}/a.py\n\n{tmpdir}/b.py\n")
+    assert changed_paths(str(listing), []) == {f"{tmpdir}/a.py", f"{tmpdir}/b.py"}
+
+
+def test_changed_paths_from_git(tmpdir):
+    def git(*args):
+        subprocess.run(
+            ["git", "-C", str(tmpdir), *args], check=True, capture_output=True
+        )
+
+    git("init", "-q")
+    (tmpdir / "module").ensure(dir=True)
+    (tmpdir / "module" / "same.py").write("")
+    (tmpdir / "module" / "edited.py").write("")
+    git("add", ".")
+    git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "init")
+    (tmpdir / "module" / "edited.py").write("x = 1\n")
+    (tmpdir / "module" / "new.py").write("")
+
+    root = str(tmpdir.realpath())
+    assert changed_paths("HEAD", [tmpdir / "module"]) == {
+        f"{root}/module/edited.py",
+        f"{root}/module/new.py",
+    }
+    # An unknown ref means we can't tell, so everything has changed
+    assert changed_paths("no-such-ref", [tmpdir / "module"]) == {root}
+
+
+def test_plugin_selects_changed(run_libtbx, libtbx, testdir):
+    libtbx.add_tests(
+        "mymod",
+        ["$D/tst_a.py", "$D/tst_b.py"],
+        {"tst_a.py": "import helper\n", "tst_b.py": "", "helper.py": ""},
+    )
+    run_libtbx("--libtbx-record-deps").assert_outcomes(passed=2)
+
+    # Added since dependencies were recorded, so fall back to their module
+    libtbx.add_tests("othermod", ["$D/tst_c.py"], {"tst_c.py": ""})
+    libtbx.add_tests("thirdmod", ["$D/tst_d.py"], {"tst_d.py": ""})
+    changed = testdir.tmpdir / "changed.txt"
+    changed.write(
+        f"{testdir.tmpdir / 'mymod' / 'helper.py'}\n"
+        f"{testdir.tmpdir / 'othermod' / 'notes.txt'}\n"
+    )
+
+    result = run_libtbx("--libtbx-changed-since", str(changed), "-v")
+    result.assert_outcomes(passed=2, deselected=2)
+    result.stdout.fnmatch_lines_random(
+        ["*mymod/tst_a.py::main PASSED*", "*othermod/tst_c.py::main PASSED*"]
+    )
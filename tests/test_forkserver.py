@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import signal
+
+import pytest
+
+from pytest_libtbx.forkserver import ForkServerRunner
+
+
+@pytest.fixture(scope="module")
+def runner():
+    return ForkServerRunner(preload=[])
+
+
+def test_output_and_arguments(runner, tmpdir):
+    script = tmpdir / "tst_args.py"
+    script.write(
+        "import os, sys\nprint(sys.argv[1:])\nprint(os.getcwd())\n"
+        "print('err', file=sys.stderr)\n"
+    )
+    result = runner.run(script, [str(script), "a", "b"], tmpdir)
+    assert result.exitcode == 0
+    assert result.stdout == f"['a', 'b']\n{tmpdir}\n"
+    assert result.stderr == "err\n"
+    assert result.error is None
+
+
+def test_failures(runner, tmpdir):
+    script = tmpdir / "tst_exit.py"
+    script.write("import sys\nsys.exit(3)\n")
+    assert runner.run(script, [str(script)], tmpdir).exitcode == 3
+
+    script = tmpdir / "tst_raise.py"
+    script.write("raise ValueError('broken')\n")
+    result = runner.run(script, [str(script)], tmpdir)
+    assert result.exitcode == 1
+    assert "ValueError: broken" in result.error
+
+
+def test_crash_is_contained(runner, tmpdir):
+    script = tmpdir / "tst_crash.py"
+    script.write("import os, signal\nos.kill(os.getpid(), signal.SIGSEGV)\n")
+    result = runner.run(script, [str(script)], tmpdir)
+    assert result.signal == signal.SIGSEGV
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import pytest
+
+from pytest_libtbx.marks import MarkRules
+
+
+class FakeConfig:
+    def __init__(self, rootpath, rules):
+        self.rootpath = rootpath
+        self._rules = rules
+
+    def getini(self, name):
+        assert name == "libtbx_mark_rules"
+        return self._rules
+
+
+def _names(marks):
+    return [(x.name, x.kwargs.get("reason")) for x in marks]
+
+
+def test_builtin_rules(libtbx, testdir, monkeypatch):
+    monkeypatch.delenv("MMTBX_CCP4_MONOMER_LIB", raising=False)
+    monkeypatch.delenv("CLIBD_MON", raising=False)
+    mmtbx = libtbx.add_module("mmtbx")
+    rules = MarkRules.from_config(FakeConfig(testdir.tmpdir, []), libtbx)
+
+    assert _names(rules.marks_for(mmtbx / "tst_a.py")) == [
+        ("skip", "No monomer library - set MMTBX_CCP4_MONOMER_LIB or CLIBD_MON")
+    ]
+    test_utils = libtbx.dist_path("libtbx") / "test_utils" / "__init__.py"
+    assert [x.name for x in rules.marks_for(test_utils)] == ["xfail"]
+    assert rules.marks_for(libtbx.dist_path("libtbx") / "tst_b.py") == []
+
+    monkeypatch.setenv("CLIBD_MON", "/mon")
+    rules = MarkRules.from_config(FakeConfig(testdir.tmpdir, []), libtbx)
+    assert rules.marks_for(mmtbx / "tst_a.py") == []
+
+
+def test_configured_rules(libtbx, testdir):
+    cctbx = libtbx.add_module("cctbx")
+    rules = MarkRules.from_config(
+        FakeConfig(
+            testdir.tmpdir,
+            ["xfail cctbx/slow Known broken", "skip other/dir", "skip cctbx"],
+        ),
+        libtbx,
+    )
+    assert _names(rules.marks_for(cctbx / "slow" / "tst.py")) == [
+        ("skip", "libtbx mark rule: skip cctbx"),
+        ("xfail", "Known broken"),
+    ]
+    assert [x.name for x in rules.marks_for(testdir.tmpdir / "other" / "dir")] == [
+        "skip"
+    ]
+
+
+def test_timeout_rules(libtbx, testdir):
+    cctbx = libtbx.add_module("cctbx")
+    rules = MarkRules.from_config(
+        FakeConfig(testdir.tmpdir, ["timeout=600 cctbx", "timeout=60 cctbx/fast"]),
+        libtbx,
+    )
+    marks = rules.marks_for(cctbx / "fast" / "tst.py")
+    assert [(x.name, x.args) for x in marks] == [
+        ("libtbx_timeout", (600.0,)),
+        ("libtbx_timeout", (60.0,)),
+    ]
+
+
+def test_run_mode_rules(libtbx, testdir):
+    cctbx = libtbx.add_module("cctbx")
+    rules = MarkRules.from_config(
+        FakeConfig(testdir.tmpdir, ["run-mode=forkserver cctbx"]), libtbx
+    )
+    marks = rules.marks_for(cctbx / "tst.py")
+    assert [(x.name, x.args) for x in marks] == [("libtbx_run_mode", ("forkserver",))]
+
+
+@pytest.mark.parametrize(
+    "rule",
+    ["skip", "explode cctbx", "timeout=soon cctbx", "run-mode=sideways cctbx"],
+)
+def test_invalid_rules(libtbx, testdir, rule):
+    with pytest.raises(pytest.UsageError):
+        MarkRules.from_config(FakeConfig(testdir.tmpdir, [rule]), libtbx)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import py.path
+
+from pytest_libtbx.pathindex import PathIndex
+
+
+def test_prefix_matching(tmpdir):
+    index = PathIndex([tmpdir / "boost", tmpdir / "xfel"])
+    assert index.covers(tmpdir / "boost")
+    assert index.covers(tmpdir / "boost" / "libs" / "test.py")
+    assert not index.covers(tmpdir / "boost_adaptbx" / "test.py")
+    assert not index.covers(tmpdir)
+
+    assert tmpdir / "xfel" in index
+    assert str(tmpdir / "xfel") + "/" in index
+    assert tmpdir / "xfel" / "sub" not in index
+    index.discard(py.path.local(tmpdir / "xfel"))
+    assert not index.covers(tmpdir / "xfel" / "sub")
+    assert len(index) == 1
+
+
+def test_lookup_values_outermost_first(tmpdir):
+    index = PathIndex()
+    index.add(tmpdir / "mmtbx" / "tst.py", "file")
+    index.add(tmpdir / "mmtbx", "module")
+    index.add(tmpdir / "cctbx", "other")
+    assert index.lookup(tmpdir / "mmtbx" / "tst.py") == ["module", "file"]
+    assert index.lookup(tmpdir / "iotbx" / "tst.py") == []
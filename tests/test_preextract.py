@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from pytest_libtbx.preextract import extract_all, extract_run_tests
+
+
+def _module(root, name, run_tests):
+    module = root / name
+    module.mkdir()
+    (module / "__init__.py").write_text("")
+    (module / "run_tests.py").write_text(run_tests)
+    return module / "run_tests.py"
+
+
+def test_extract_run_tests_static(tmp_path):
+    path = _module(tmp_path, "mod", "tst_list = ['$D/tst_a.py', ['$D/tst_b.py', 1]]\n")
+    assert extract_run_tests(str(path)) == {
+        "tst_list": ["$D/tst_a.py", ["$D/tst_b.py", "1"]],
+        "tst_list_slow": [],
+        "ran_discover": False,
+        "shared_setup": None,
+        "timeouts": {},
+        "run_modes": {},
+    }
+
+
+def test_extract_all_in_workers(tmp_path):
+    paths = [
+        _module(tmp_path, f"mod{i}", f"tst_list = ['$D/tst_{i}.py']\n")
+        for i in range(3)
+    ]
+    # Can't be read statically, and importing it fails
+    broken = _module(
+        tmp_path, "broken", "import not_a_module\ntst_list = not_a_module.tests()\n"
+    )
+
+    times = {}
+    results = extract_all(paths + [broken], workers=2, times=times)
+    assert set(results) == set(paths)
+    assert set(times) == set(paths) and all(x > 0 for x in times.values())
+    assert [results[x].tst_list for x in paths] == [
+        ["$D/tst_0.py"],
+        ["$D/tst_1.py"],
+        ["$D/tst_2.py"],
+    ]
+
+
+def test_plugin_reads_ahead(run_libtbx, libtbx):
+    for name in ("mod_a", "mod_b"):
+        libtbx.add_tests(name, ["$D/tst_a.py", ["$D/tst_b.py", "1"]], {})
+    args = ("--collect-only", "-q", "--libtbx-collect-profile")
+
+    result = run_libtbx("--libtbx-collect-workers=2", *args)
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(
+        [
+            "Read 2 ahead of collection in *s wall with 2 processes*",
+            "4 tests collected*",
+        ]
+    )
+    # The profile lists the slowest first
+    result.stdout.fnmatch_lines_random(
+        ["* pool *mod_a/run_tests.py", "* pool *mod_b/run_tests.py"]
+    )
+
+    # Nothing left to read once cached
+    result = run_libtbx("--libtbx-collect-workers=2", *args)
+    result.stdout.fnmatch_lines(["4 tests collected*"])
+    assert not [x for x in result.outlines if "ahead of collection" in x]
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+from pytest_libtbx.deps import bootstrap_environment
+from pytest_libtbx.forkserver import ForkServerRunner
+from pytest_libtbx.profiler import SamplingProfiler, merge_collapsed
+
+BUSY_SCRIPT = """\
+import time
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+spin(0.3)
+"""
+
+
+def _read_collapsed(path):
+    with open(path) as f:
+        return dict(line.rstrip("\n").rsplit(" ", 1) for line in f)
+
+
+def test_profiler_samples_thread():
+    def spin_here(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    with SamplingProfiler(interval=0.001) as profiler:
+        spin_here(0.2)
+    assert sum(profiler.counts.values()) > 10
+    stacks = [x for x in profiler.counts if "spin_here (tests/test_profiler.py:" in x]
+    assert stacks
+    assert all(x.split(";")[-1].startswith("spin_here ") for x in stacks)
+
+
+def test_profiler_trims_to_root(tmpdir):
+    script = tmpdir / "tst_busy.py"
+    script.write(BUSY_SCRIPT)
+    with SamplingProfiler(interval=0.001, root_filename=str(script)) as profiler:
+        runpy.run_path(str(script), run_name="__main__")
+    assert profiler.counts
+    # Stacks start at the script, leaving out runpy and pytest
+    assert all(x.startswith("<module> (") for x in profiler.counts)
+    leaf = f";spin ({tmpdir.basename}/tst_busy.py:4)"
+    assert any(x.endswith(leaf) for x in profiler.counts)
+
+
+def test_write_and_merge(tmpdir):
+    profile = tmpdir / "test.collapsed"
+    profiler = SamplingProfiler()
+    profiler.counts = {"a (m/a.py:1);b (m/b.py:2)": 3, "a (m/a.py:1)": 1}
+    profiler.write(profile)
+    profiler.write(profile)
+    assert len(profile.readlines()) == 4
+    assert merge_collapsed(profile) == 8
+    assert profile.read() == "a (m/a.py:1) 2\na (m/a.py:1);b (m/b.py:2) 6\n"
+
+    # Nothing sampled, nothing written
+    SamplingProfiler().write(tmpdir / "empty.collapsed")
+    assert not (tmpdir / "empty.collapsed").exists()
+
+
+def test_forkserver_profiles(tmpdir):
+    script = tmpdir / "tst_fork_busy.py"
+    script.write(BUSY_SCRIPT)
+    profile = tmpdir / "fork.collapsed"
+    result = ForkServerRunner(preload=[]).run(
+        script, [str(script)], tmpdir, profile_file=str(profile)
+    )
+    assert result.exitcode == 0
+    stacks = _read_collapsed(profile)
+    assert all(x.startswith("<module> (") for x in stacks)
+    assert any(";spin (" in x for x in stacks)
+
+
+def test_bootstrapped_subprocess_profiles(tmpdir):
+    script = tmpdir / "tst_sub_busy.py"
+    script.write(BUSY_SCRIPT)
+    profile = tmpdir / "sub.collapsed"
+    env = dict(os.environ)
+    env.update(bootstrap_environment(None, env, profile_file=profile))
+    assert "PYTEST_LIBTBX_DEPS_FILE" not in bootstrap_environment(None, env)
+    subprocess.run([sys.executable, str(script)], env=env, cwd=tmpdir, check=True)
+    stacks = _read_collapsed(profile)
+    assert any(";spin (" in x for x in stacks)
+
+
+def test_plugin_profile_directory(run_libtbx, libtbx, testdir):
+    libtbx.add_tests(
+        "mymod",
+        ["$D/tst_busy.py", "$D/tst_other.py"],
+        {"tst_busy.py": BUSY_SCRIPT, "tst_other.py": ""},
+    )
+    basetemp = testdir.tmpdir / "basetemp"
+
+    result = run_libtbx("--libtbx-profile=*tst_busy*", f"--basetemp={basetemp}")
+    result.assert_outcomes(passed=2)
+    profiles = basetemp / "libtbx-profiles"
+    result.stdout.fnmatch_lines([f"Wrote 1 test profiles to {profiles}"])
+    (profile,) = profiles.listdir()
+    assert "tst_busy" in profile.basename
+    assert not (testdir.tmpdir / "libtbx-profiles").exists()
+
+    # Kept with the junit report, if there is one
+    reports = testdir.tmpdir / "reports"
+    result = run_libtbx(
+        "--libtbx-profile=*tst_busy*", f"--junitxml={reports / 'junit.xml'}"
+    )
+    result.assert_outcomes(passed=2)
+    assert len((reports / "libtbx-profiles").listdir()) == 1
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from pytest_libtbx.resources import ResourceMonitor, summarise_usage, wait_with_usage
+
+BUSY_COMMAND = [sys.executable, "-c", "import time; sum(range(10**7)); time.sleep(0.2)"]
+
+
+def test_monitor_counts_child_processes():
+    with ResourceMonitor(interval=0.01) as monitor:
+        subprocess.run(
+            [sys.executable, "-c", "import time; sum(range(10**6)); time.sleep(0.2)"],
+            check=True,
+        )
+    usage = monitor.usage
+    assert usage.child_processes == 1
+    assert usage.wall >= 0.2
+    assert usage.user + usage.system > 0
+    assert usage.child_peak_rss is None or usage.child_peak_rss > 0
+
+
+def test_monitor_external_usage():
+    with ResourceMonitor() as monitor:
+        monitor.add_external(1.5, 0.5, 100 * 1024**2)
+    assert monitor.usage.user >= 1.5
+    assert monitor.usage.system >= 0.5
+    assert monitor.usage.child_peak_rss >= 100 * 1024**2
+    assert monitor.usage.child_processes == 1
+    properties = dict(monitor.usage.as_properties())
+    assert properties["libtbx_child_processes"] == 1
+
+
+def test_wait_with_usage():
+    process = subprocess.Popen(BUSY_COMMAND)
+    user, system, peak_rss = wait_with_usage(process)
+    assert process.returncode == 0
+    assert user + system > 0 and peak_rss > 0
+
+    process = subprocess.Popen(["sleep", "10"])
+    with pytest.raises(subprocess.TimeoutExpired):
+        wait_with_usage(process, timeout=0.1)
+    process.kill()
+    wait_with_usage(process)
+    assert process.returncode == -9
+
+
+def test_monitor_leaves_out_measured_processes():
+    # As if run in the background for another test, while this one runs
+    process = subprocess.Popen(BUSY_COMMAND)
+    waiter = threading.Thread(target=wait_with_usage, args=(process,))
+    waiter.start()
+    with ResourceMonitor(interval=0.01) as monitor:
+        waiter.join()
+    assert monitor.usage.child_processes == 0
+    assert monitor.usage.child_peak_rss is None
+    assert monitor.usage.user + monitor.usage.system < 0.05
+
+
+def test_summarise_usage():
+    reports = []
+    for name, cpu, rss in [("a", 1.0, 10), ("b", 3.0, None), ("c", 2.0, 50)]:
+        reports.append(
+            (
+                name,
+                {
+                    "libtbx_wall": cpu,
+                    "libtbx_cpu_user": cpu,
+                    "libtbx_cpu_system": 0.0,
+                    "libtbx_peak_rss_delta": rss,
+                    "libtbx_child_peak_rss": None,
+                    "libtbx_child_processes": 0,
+                },
+            )
+        )
+    lines = []
+    summarise_usage(reports, lines.append, top=2)
+    assert lines[0].startswith("3 tests: 6.0s wall")
+    cpu = lines[lines.index("Most CPU time:") + 1 :][:2]
+    assert [x.split()[-1] for x in cpu] == ["b", "c"]
+    assert lines[-2].endswith("c")
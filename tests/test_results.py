@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import os
+
+from pytest_libtbx.results import ResultCache
+
+
+def test_result_key_tracks_content(tmp_path):
+    script = tmp_path / "tst_a.py"
+    module = tmp_path / "helper.py"
+    script.write_text("import helper\n")
+    module.write_text("X = 1\n")
+    cache = ResultCache(None, "env")
+
+    files = [str(script), str(module)]
+    key = cache.key(["tst_a.py", "1"], files)
+    assert key == cache.key(["tst_a.py", "1"], files)
+    assert key != cache.key(["tst_a.py", "2"], files)
+    assert key != ResultCache(None, "other-env").key(["tst_a.py", "1"], files)
+
+    # Touching without changing keeps the key, but any change alters it
+    os.utime(module, ns=(0, 0))
+    assert cache.key(["tst_a.py", "1"], files) == key
+    module.write_text("X = 2\n")
+    assert cache.key(["tst_a.py", "1"], files) != key
+
+    assert cache.key(["tst_a.py"], [str(tmp_path / "missing.py")]) is None
+
+
+def test_results_persist_and_merge(tmp_path, store):
+    first = ResultCache(store, "env")
+    first.record("a", "key-a", passed=True)
+    first.record("b", "key-b", passed=True)
+    first.save()
+
+    # A parallel session fails b, and another passes c
+    second = ResultCache(store, "env")
+    third = ResultCache(store, "env")
+    second.record("b", None, passed=False)
+    third.record("c", "key-c", passed=True)
+    second.save()
+    third.save()
+
+    cache = ResultCache(store, "env")
+    assert cache.passed("a", "key-a")
+    assert not cache.passed("a", "changed")
+    assert not cache.passed("b", "key-b")
+    assert cache.passed("c", "key-c")
+    assert not cache.passed("a", None)
+
+    assert not ResultCache(store, "new-env").passed("a", "key-a")
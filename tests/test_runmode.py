@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from pytest_libtbx.runmode import RunModePolicy
+
+
+def test_choices():
+    policy = RunModePolicy(None, max_retained_rss=1000, isolate_after=10)
+    assert policy.choose("new.py") == ("inprocess", "not run before")
+
+    policy.observe("fast.py", 0.5, retained_rss=10)
+    policy.observe("leaky.py", 0.5, leaks=["environ"])
+    policy.observe("leaky.py", 0.5, leaks=["signals"])
+    policy.observe("big.py", 0.5, retained_rss=2000)
+    policy.observe("big.py", 0.5, retained_rss=0)
+    policy.observe("slow.py", 30)
+    assert policy.choose("fast.py")[0] == "inprocess"
+    assert policy.choose("leaky.py") == ("forkserver", "leaked environ, signals")
+    assert policy.choose("big.py")[0] == "forkserver"
+    assert policy.choose("slow.py")[0] == "forkserver"
+
+    # Durations are smoothed, so one quick run doesn't undo it
+    policy.observe("slow.py", 1)
+    assert policy.choose("slow.py")[0] == "forkserver"
+
+
+def test_persistence_merges(store):
+    first = RunModePolicy(store)
+    second = RunModePolicy(store)
+    first.observe("a.py", 1)
+    second.observe("b.py", 1, leaks=["cwd"])
+    first.save()
+    second.save()
+
+    policy = RunModePolicy(store)
+    assert policy.choose("a.py")[0] == "inprocess"
+    assert policy.choose("b.py")[0] == "forkserver"
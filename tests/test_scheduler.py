@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import pytest
+
+from pytest_libtbx.history import HISTORY_KEY, TestHistory
+from pytest_libtbx.scheduler import plan_work_units
+
+
+def test_history_smooths_durations():
+    history = TestHistory(None)
+    history.record("a::main", 10.0, group="mod/run_tests.py")
+    history.record("a::main", 20.0)
+    assert history.duration("a::main") == 15.0
+    assert history.group("a::main") == "mod/run_tests.py"
+    assert history.duration("b::main", 3) == 3
+
+
+def test_plan_longest_first_keeps_groups():
+    history = TestHistory(None)
+    for nodeid, duration, group in [
+        ("a/tst_1.py::main", 1.0, "a"),
+        ("a/tst_2.py::main", 1.0, "a"),
+        ("b/tst_1.py::main", 5.0, "b"),
+        ("c/tst_1.py::main", 3.0, "c"),
+    ]:
+        history.record(nodeid, duration, group=group)
+
+    plan = plan_work_units(
+        [
+            "a/tst_1.py::main",
+            "a/tst_2.py::main",
+            "b/tst_1.py::main",
+            "c/tst_1.py::main",
+        ],
+        history,
+        workers=2,
+    )
+    assert [members for _, members in plan] == [
+        ["b/tst_1.py::main"],
+        ["c/tst_1.py::main"],
+        ["a/tst_1.py::main", "a/tst_2.py::main"],
+    ]
+
+
+def test_plan_splits_dominant_groups():
+    history = TestHistory(None)
+    nodeids = [f"a/tst_{i}.py::main" for i in range(4)]
+    for nodeid in nodeids:
+        history.record(nodeid, 1.0, group="a")
+
+    plan = plan_work_units(nodeids, history, workers=2)
+    assert [members for _, members in plan] == [nodeids[:2], nodeids[2:]]
+    assert len({scope for scope, _ in plan}) == 2
+
+
+def test_plugin_records_durations(run_libtbx, libtbx, testdir):
+    module = libtbx.add_tests(
+        "mymod",
+        ["$D/tst_pass.py", "$D/tst_fail.py"],
+        {
+            "tst_pass.py": "import time\ntime.sleep(0.05)\n",
+            "tst_fail.py": "raise RuntimeError()\n",
+            "tst_slow.py": "",
+        },
+        tst_list_slow=["$D/tst_slow.py"],
+    )
+    result = run_libtbx()
+    result.assert_outcomes(passed=1, failed=1, skipped=1)
+
+    # Only tests that ran to completion tell us how long they take
+    records = testdir.parseconfigure().cache.get(HISTORY_KEY, None)
+    assert set(records) == {"mymod/tst_pass.py::main"}
+    record = records["mymod/tst_pass.py::main"]
+    assert record["duration"] >= 0.05
+    assert record["group"] == str(module / "run_tests.py")
+
+
+def test_plugin_only_schedules_when_asked(testdir):
+    config = testdir.parseconfig("-p", "pytest_libtbx.plugin")
+    plugin = config.pluginmanager.get_plugin("pytest_libtbx.plugin")
+    assert plugin.pytest_xdist_make_scheduler(config=config, log=None) is None
+
+    pytest.importorskip("xdist")
+    from pytest_libtbx._xdist import DurationScheduling
+
+    config = testdir.parseconfig(
+        "-p", "pytest_libtbx.plugin", "--tx", "2*popen", "--libtbx-schedule"
+    )
+    scheduler = plugin.pytest_xdist_make_scheduler(config=config, log=None)
+    assert isinstance(scheduler, DurationScheduling)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import sys
+
+import pytest
+
+from pytest_libtbx.shared import SharedData, SharedSetupError, clone_tree
+from pytest_libtbx.static import extract_static
+
+
+def _tree(root):
+    (root / "sub").mkdir(parents=True)
+    (root / "a.txt").write_text("a")
+    (root / "sub" / "b.txt").write_text("b")
+
+
+@pytest.mark.parametrize("method", ["auto", "copy", "hardlink"])
+def test_clone_tree(tmp_path, method):
+    _tree(tmp_path / "source")
+    (tmp_path / "dest").mkdir()
+    clone_tree(tmp_path / "source", tmp_path / "dest", method)
+    assert (tmp_path / "dest" / "a.txt").read_text() == "a"
+    assert (tmp_path / "dest" / "sub" / "b.txt").read_text() == "b"
+    linked = (tmp_path / "dest" / "a.txt").stat().st_ino == (
+        tmp_path / "source" / "a.txt"
+    ).stat().st_ino
+    assert linked == (method == "hardlink")
+
+
+def test_shared_data_built_once(tmp_path):
+    script = tmp_path / "make_data.py"
+    script.write_text(
+        "import os\n"
+        "with open('counter', 'a') as f:\n"
+        "    f.write('x')\n"
+        "with open('data.txt', 'w') as f:\n"
+        "    f.write(str(len(os.listdir('.'))))\n"
+    )
+    shared = SharedData(tmp_path / "base")
+    for name in ["one", "two"]:
+        (tmp_path / name).mkdir()
+        shared.prepare([str(script)], tmp_path / name)
+        assert (tmp_path / name / "counter").read_text() == "x"
+
+    # Modifying one test's copy doesn't affect the others
+    (tmp_path / "one" / "counter").write_text("changed")
+    (tmp_path / "three").mkdir()
+    shared.prepare([str(script)], tmp_path / "three")
+    assert (tmp_path / "three" / "counter").read_text() == "x"
+
+
+def test_shared_data_failure_is_remembered(tmp_path):
+    shared = SharedData(tmp_path / "base")
+    command = [sys.executable, "-c", "import sys; sys.exit('no data')"]
+    with pytest.raises(SharedSetupError, match="no data"):
+        shared.prepare(command, tmp_path)
+    with pytest.raises(SharedSetupError):
+        shared.prepare(command, tmp_path)
+    assert len(list((tmp_path / "base").iterdir())) == 1
+
+
+def test_shared_data_missing_command(tmp_path):
+    shared = SharedData(tmp_path / "base")
+    command = [str(tmp_path / "not_a_command")]
+    with pytest.raises(SharedSetupError, match="could not be run"):
+        shared.prepare(command, tmp_path)
+    with pytest.raises(SharedSetupError):
+        shared.prepare(command, tmp_path)
+
+
+def test_plugin_missing_shared_setup(run_libtbx, libtbx):
+    module = libtbx.add_tests(
+        "mymod",
+        ["$D/tst_a.sh", "$D/tst_b.py"],
+        {"tst_a.sh": "#!/bin/sh\n", "tst_b.py": ""},
+    )
+    (module / "tst_a.sh").chmod(0o755)
+    with (module / "run_tests.py").open("a") as f:
+        f.write("tst_shared_setup = ['$D/missing_setup']\n")
+    # Launched ahead as well as run in turn, and both fail the same way
+    for args in ([], ["--libtbx-async-procs=2"]):
+        result = run_libtbx("-p", "no:cacheprovider", *args)
+        result.assert_outcomes(failed=2)
+        result.stdout.fnmatch_lines(["*Shared setup *missing_setup could not be run*"])
+
+
+def test_static_reads_shared_setup():
+    info = extract_static(
+        "tst_list = ['$D/tst_a.py']\ntst_shared_setup = ['$D/make.py', 'x']\n"
+    )
+    assert info.shared_setup == ["$D/make.py", "x"]
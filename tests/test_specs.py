@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import py.path
+import pytest
+
+from pytest_libtbx import plugin
+from pytest_libtbx.marks import MarkRules
+from pytest_libtbx.runtests import RunTestsInfo
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    rules = MarkRules()
+    monkeypatch.setattr(plugin, "_mark_rules", rules)
+    return rules
+
+
+def test_spec_from_entries(rules, tmp_path):
+    runtests = py.path.local(tmp_path / "mod" / "run_tests.py")
+    rules.add(str(tmp_path / "mod" / "slow"), pytest.mark.skip(reason="slow"))
+
+    spec = plugin._spec_from_list_entry("$D/tst_a.py", runtests, "/build/mod")
+    assert spec.name == "main"
+    assert spec.shortpath == "tst_a.py"
+    assert spec.command == str(tmp_path / "mod" / "tst_a.py")
+    assert spec.origin == runtests
+
+    spec = plugin._spec_from_list_entry(
+        ["$B/slow/prog", 1, "--x"], runtests, "/build/mod"
+    )
+    assert spec.name == "1_--x"
+    assert spec.shortpath == "build/slow/prog"
+    assert spec.command == "/build/mod/slow/prog"
+    assert spec.params == ["1", "--x"]
+    assert [x.name for x in spec.markers] == ["usefixtures"]
+
+    spec = plugin._spec_from_list_entry("$D/slow/tst_b.py", runtests, "/build/mod")
+    assert [x.name for x in spec.markers] == ["usefixtures", "skip"]
+
+    spec = plugin._spec_from_list_entry(None, runtests, "/build/mod")
+    assert spec.name == "inline"
+    assert spec.markers[-1].name == "skip"
+
+
+def test_spec_is_compact(rules, tmp_path):
+    runtests = py.path.local(tmp_path / "run_tests.py")
+    spec = plugin._spec_from_list_entry("$D/tst_a.py", runtests, "/build")
+    assert not hasattr(spec, "__dict__")
+
+
+def _marks(spec, name):
+    return [x.args for x in spec.markers if x.name == name]
+
+
+def test_entry_settings_follow_rules(rules, tmp_path):
+    runtests = py.path.local(tmp_path / "run_tests.py")
+    rules.add(str(tmp_path), pytest.mark.libtbx_timeout(600))
+    rules.add(str(tmp_path), pytest.mark.libtbx_run_mode("forkserver"))
+    info = RunTestsInfo(
+        timeouts={"$D/tst_a.py": 30}, run_modes={"$D/tst_a.py": "subprocess"}
+    )
+
+    spec = plugin._spec_from_list_entry(["$D/tst_a.py", "x"], runtests, "/build", info)
+    assert _marks(spec, "libtbx_timeout") == [(600,), (30.0,)]
+    assert _marks(spec, "libtbx_run_mode") == [("forkserver",), ("subprocess",)]
+    spec = plugin._spec_from_list_entry("$D/tst_b.py", runtests, "/build", info)
+    assert _marks(spec, "libtbx_timeout") == [(600,)]
+    assert _marks(spec, "libtbx_run_mode") == [("forkserver",)]
+
+
+def test_invalid_entry_run_mode(rules, tmp_path):
+    runtests = py.path.local(tmp_path / "run_tests.py")
+    info = RunTestsInfo(run_modes={"$D/tst_a.py": "sideways"})
+    with pytest.raises(pytest.UsageError):
+        plugin._spec_from_list_entry("$D/tst_a.py", runtests, "/build", info)
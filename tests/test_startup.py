@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+# Modules the plugin must not import just by being registered
+HEAVY_MODULES = [
+    "asyncio",
+    "concurrent.futures",
+    "libtbx",
+    "multiprocessing",
+    "procrunner",
+    "six",
+]
+
+
+def test_plugin_import_is_lightweight():
+    script = (
+        "import sys, pytest\n"
+        "import pytest_libtbx.plugin\n"
+        f"print(' '.join(x for x in {HEAVY_MODULES!r} if x in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.split() == []
+
+
+def test_libtbx_loaded_lazily(testdir, disk_libtbx):
+    disk_libtbx.add_tests("mymod", ["$D/tst_a.py"], {"tst_a.py": ""})
+    (testdir.mkdir("elsewhere") / "test_plain.py").write(
+        "def test_plain():\n    pass\n"
+    )
+
+    # Nothing collected is inside the distribution, so it isn't loaded
+    result = disk_libtbx.runpytest("elsewhere")
+    result.assert_outcomes(passed=1)
+    assert not (disk_libtbx.root / "loaded").exists()
+
+    result = disk_libtbx.runpytest(str(disk_libtbx.root))
+    result.assert_outcomes(passed=1)
+    assert (disk_libtbx.root / "loaded").exists()
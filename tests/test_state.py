@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import sys
+
+from pytest_libtbx.state import InterpreterSnapshot
+
+
+def test_restores_interpreter_state(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(tmpdir)
+    (tmpdir / "tst_local_helper.py").write("value = 1\n")
+    monkeypatch.setenv("LIBTBX_EXISTING", "1")
+    prior_cwd = os.getcwd()
+    prior_handlers = list(logging.getLogger().handlers)
+    prior_sigusr1 = signal.getsignal(signal.SIGUSR1)
+
+    with InterpreterSnapshot(local_paths=[tmpdir]) as snapshot:
+        import tst_local_helper  # noqa: F401
+
+        os.environ["LIBTBX_NEW"] = "1"
+        del os.environ["LIBTBX_EXISTING"]
+        os.chdir(tmpdir)
+        logging.getLogger().addHandler(logging.NullHandler())
+        signal.signal(signal.SIGUSR1, lambda *args: None)
+
+    assert "tst_local_helper" not in sys.modules
+    assert snapshot.dropped_modules == ["tst_local_helper"]
+    assert "LIBTBX_NEW" not in os.environ
+    assert os.environ["LIBTBX_EXISTING"] == "1"
+    assert os.getcwd() == prior_cwd
+    assert logging.getLogger().handlers == prior_handlers
+    assert signal.getsignal(signal.SIGUSR1) is prior_sigusr1
+    assert snapshot.leaks == ["environ", "cwd", "logging", "signals"]
+
+
+def test_library_modules_stay_imported(tmpdir):
+    sys.modules.pop("colorsys", None)
+    with InterpreterSnapshot(local_paths=[tmpdir]) as snapshot:
+        import colorsys  # noqa: F401
+    assert "colorsys" in sys.modules
+    assert not snapshot.leaks
+
+
+def test_packages_below_script_stay_imported(tmpdir, monkeypatch):
+    # A script at the root of a libtbx module, which is itself a package
+    module = tmpdir.mkdir("libmod")
+    (module / "__init__.py").write("")
+    (module.mkdir("sub") / "__init__.py").write("")
+    (module / "sub" / "deep.py").write("")
+    (module / "tst_local_helper.py").write("")
+    (module.mkdir("local_pkg") / "__init__.py").write("")
+    (module / "local_pkg" / "part.py").write("")
+    monkeypatch.syspath_prepend(tmpdir)
+    monkeypatch.syspath_prepend(module)
+    try:
+        with InterpreterSnapshot(local_paths=[module]) as snapshot:
+            import libmod.sub.deep  # noqa: F401
+            import local_pkg.part  # noqa: F401
+            import tst_local_helper  # noqa: F401
+        assert {"libmod", "libmod.sub", "libmod.sub.deep"} <= set(sys.modules)
+        assert sorted(snapshot.dropped_modules) == [
+            "local_pkg",
+            "local_pkg.part",
+            "tst_local_helper",
+        ]
+    finally:
+        for name in ["libmod", "libmod.sub", "libmod.sub.deep"]:
+            sys.modules.pop(name, None)
+
+
+def test_new_loggers_are_not_leaks():
+    with InterpreterSnapshot() as snapshot:
+        # As a library might when first imported
+        library_logger = logging.getLogger("pytest_libtbx_test.library")
+        library_logger.addHandler(logging.NullHandler())
+        library_logger.setLevel(logging.INFO)
+    assert library_logger.handlers and library_logger.level == logging.INFO
+    assert not snapshot.leaks
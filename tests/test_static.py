@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import pytest
+
+from pytest_libtbx.static import Unresolvable, extract_static
+
+
+def test_literal_lists():
+    info = extract_static(
+        """
+from __future__ import annotations
+from libtbx import test_utils
+import libtbx.load_env
+
+common = ["$D/tst_a.py", ["$D/tst_b.py", 3, "--flag"]]
+tst_list = common + ("$B/tst_c",)
+tst_list += ["$D/tst_d.py"]
+tst_list.append("$D/tst_e.py")
+tst_list_slow = ["$D/tst_slow.py"]
+
+def run():
+    build_dir = libtbx.env.under_build("x")
+    test_utils.run_tests(build_dir, None, tst_list)
+
+if __name__ == "__main__":
+    run()
+"""
+    )
+    assert info.tst_list == [
+        "$D/tst_a.py",
+        ["$D/tst_b.py", "3", "--flag"],
+        "$B/tst_c",
+        "$D/tst_d.py",
+        "$D/tst_e.py",
+    ]
+    assert info.tst_list_slow == ["$D/tst_slow.py"]
+    assert not info.ran_discover
+
+
+def test_helper_lists_changed_in_place():
+    info = extract_static(
+        'common=["$D/a.py"]; common.append("$D/b.py"); tst_list = common'
+    )
+    assert info.tst_list == ["$D/a.py", "$D/b.py"]
+
+    info = extract_static(
+        "common = ['$D/a.py']\n"
+        "common.append('$D/b.py')\n"
+        "alias = common\n"
+        "alias.extend(['$D/c.py'])\n"
+        "alias += ['$D/d.py']\n"
+        "tst_list = common\n"
+    )
+    assert info.tst_list == ["$D/a.py", "$D/b.py", "$D/c.py", "$D/d.py"]
+
+
+def test_timeouts():
+    info = extract_static(
+        """
+slow = 3600
+tst_list = ["$D/tst_a.py", ["$D/tst_b.py", "1"]]
+tst_timeouts = {"$D/tst_b.py": slow, "$D/tst_a.py": 30}
+"""
+    )
+    assert info.timeouts == {"$D/tst_b.py": 3600.0, "$D/tst_a.py": 30.0}
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "from libtbx.test_utils.pytest import discover\ntst_list = discover()",
+        "from libtbx.test_utils import pytest\ntst_list = pytest.discover() + ['a']",
+        "import libtbx.test_utils.pytest\ntst_list = libtbx.test_utils.pytest.discover()",
+        "import libtbx.test_utils.pytest as p\np.discover()",
+    ],
+)
+def test_discover(source):
+    info = extract_static(source)
+    assert info.ran_discover
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "import libtbx.load_env\ntst_list = [libtbx.env.under_dist('x', 'y')]",
+        "import sys\ntst_list = []\nif sys.platform == 'win32':\n    tst_list.append('a')",
+        "tst_list = [x for x in ('a', 'b')]",
+        "from libtbx.test_utils.pytest import discover\ndef f():\n    return discover()",
+        "from other import discover\ntst_list = discover()",
+        "tst_list = [",
+        "tst_timeouts = {}\ntst_timeouts['$D/tst_a.py'] = 10",
+        "tst_timeouts = {**other}",
+        # Changes made through an alias or by a function are invisible
+        "tst_list = ['$D/tst_a.py']\nalias = tst_list\nalias.append('$D/tst_b.py')",
+        "from helpers import add_tests\ntst_list = ['$D/tst_a.py']\nadd_tests(tst_list)",
+        "tst_list = []\nx = tst_list.append('a')",
+        "tst_list = []\ndef add(x):\n    helper(tst_list)\nadd(1)",
+        # Other lists changed in ways that aren't followed
+        "common = ['$D/a.py']\ncommon.sort()\ntst_list = common",
+        "common = ['$D/a.py']\nhelper(common)\ntst_list = common",
+        "common = ['$D/a.py']\nx = common.pop()\ntst_list = common",
+        "common = ['$D/a.py']\nalias = common\nalias[0] = 'b'\ntst_list = common",
+        "import sys\n"
+        "from libtbx.test_utils.pytest import discover\n"
+        "tst_list_base = ['$D/a.py']\n"
+        "tst_list_fail = []\n"
+        "if sys.version_info.major >= 3:\n"
+        "    tst_list_fail += ['$D/py3_only.py']\n"
+        "tst_list = tst_list_base + tst_list_fail + discover()\n",
+        "common = []\nfor x in 'ab':\n    common.append(x)\ntst_list = common",
+        "common = []\ndef add():\n    common.append('$D/b.py')\nadd()\n"
+        "tst_list = common",
+    ],
+)
+def test_unresolvable(source):
+    with pytest.raises(Unresolvable):
+        extract_static(source)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+import time
+
+import pytest
+
+from pytest_libtbx.async_runner import AsyncCommandRunner
+from pytest_libtbx.capture import run_streaming
+from pytest_libtbx.forkserver import ForkServerRunner
+from pytest_libtbx.timeouts import TestTimeout, alarm, timeout_message
+
+# Starts a background child, then hangs; the child's pid is written to a file
+HANGING = "echo started; sleep 30 & echo $! > child.pid; wait"
+
+
+def _running(pid):
+    """Is a process still running (and not just waiting to be reaped)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _wait_for_exit(pid, timeout=5):
+    deadline = time.monotonic() + timeout
+    while _running(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return not _running(pid)
+
+
+def test_streaming_timeout_kills_group(tmpdir):
+    start = time.monotonic()
+    result = run_streaming(["sh", "-c", HANGING], None, cwd=tmpdir, timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert result.timed_out
+    assert result.stdout == "started\n"
+    assert _wait_for_exit(int((tmpdir / "child.pid").read()))
+
+
+def test_streaming_without_timeout(tmpdir):
+    result = run_streaming(["sh", "-c", "echo ok"], None, cwd=tmpdir, timeout=10)
+    assert not result.timed_out
+    assert result.exitcode == 0 and result.stdout == "ok\n"
+
+
+def test_async_timeout_kills_group(tmpdir):
+    runner = AsyncCommandRunner(limit=2)
+    try:
+        hung = runner.submit(["sh", "-c", HANGING], tmpdir, timeout=0.5)
+        quick = runner.submit(["sh", "-c", "echo ok"], tmpdir, timeout=10)
+        result = hung.result(timeout=10)
+        assert not quick.result(timeout=10).timed_out
+    finally:
+        runner.shutdown()
+    assert result.timed_out
+    assert result.stdout == "started\n"
+    assert _wait_for_exit(int((tmpdir / "child.pid").read()))
+
+
+def test_forkserver_timeout(tmpdir):
+    script = tmpdir / "tst_hang.py"
+    script.write(
+        "import subprocess, time\n"
+        "child = subprocess.Popen(['sleep', '30'])\n"
+        "open('child.pid', 'w').write(str(child.pid))\n"
+        "print('started', flush=True)\n"
+        "time.sleep(30)\n"
+    )
+    runner = ForkServerRunner(preload=[])
+    start = time.monotonic()
+    result = runner.run(script, [str(script)], tmpdir, timeout=1)
+    assert time.monotonic() - start < 10
+    assert result.timed_out
+    assert result.stdout == "started\n"
+    assert _wait_for_exit(int((tmpdir / "child.pid").read()))
+
+
+def test_alarm_interrupts():
+    start = time.monotonic()
+    with pytest.raises(TestTimeout):
+        with alarm(0.2):
+            time.sleep(5)
+    assert time.monotonic() - start < 2
+    # And nothing is left to go off later
+    with alarm(None):
+        time.sleep(0.3)
+
+
+def test_timeout_message():
+    stdout = "".join(f"line {i}\n" for i in range(50))
+    message = timeout_message(2, stdout, "")
+    assert message.startswith("Timed out after 2s")
+    assert "Last 20 lines of stdout:\nline 30\n" in message
+    assert message.endswith("line 49")
+    assert "stderr" not in message
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="Needs /proc")
+def test_proc_helper():
+    assert _running(os.getpid())
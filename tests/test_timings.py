@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from pytest_libtbx.timings import (
+    FIELDS,
+    TimingsWriter,
+    compare,
+    main,
+    read_timings,
+    t_sf,
+    welch_test,
+)
+
+
+class FakeReport:
+    def __init__(self, nodeid, when, outcome, duration, properties=()):
+        self.nodeid = nodeid
+        self.when = when
+        self.outcome = outcome
+        self.passed = outcome == "passed"
+        self.failed = outcome == "failed"
+        self.duration = duration
+        self.user_properties = list(properties)
+
+
+def _write(path, durations, outcome="passed"):
+    """Write a timings file with a single passing run of each test"""
+    path.parent.mkdir(exist_ok=True)
+    writer = TimingsWriter(str(path))
+    origin = ("libtbx_origin", "/mod/run_tests.py")
+    for nodeid, duration in durations.items():
+        writer.add(FakeReport(nodeid, "setup", "passed", 0.1, [origin]))
+        writer.add(
+            FakeReport(
+                nodeid,
+                "call",
+                outcome,
+                duration,
+                [origin, ("libtbx_mode", "inprocess")],
+            )
+        )
+        writer.add(FakeReport(nodeid, "teardown", "passed", 0.0, [origin]))
+    writer.close()
+
+
+def test_writer(tmp_path):
+    writer = TimingsWriter(str(tmp_path / "t.jsonl"))
+    origin = ("libtbx_origin", "/mod/run_tests.py")
+    script = [("libtbx_script", "/mod/tst_a.py"), ("libtbx_params", ["1"])]
+    writer.add(FakeReport("other.py::test", "setup", "passed", 1))
+    writer.add(FakeReport("tst_a.py::1", "setup", "passed", 0.5, [origin, *script]))
+    writer.add(
+        FakeReport(
+            "tst_a.py::1",
+            "call",
+            "failed",
+            2,
+            [origin, *script, ("libtbx_mode", "forkserver")],
+        )
+    )
+    writer.add(FakeReport("tst_a.py::1", "teardown", "passed", 0.25, [origin]))
+    writer.add(FakeReport("tst_b.py::main", "setup", "skipped", 0, [origin]))
+    writer.add(FakeReport("tst_b.py::main", "teardown", "passed", 0, [origin]))
+    writer.close()
+
+    lines = (tmp_path / "t.jsonl").read_text().splitlines()
+    assert json.loads(lines[0]) == list(FIELDS)
+    assert len(lines) == 3
+    records = read_timings([str(tmp_path / "t.jsonl")])
+    assert set(records) == {"tst_a.py::1", "tst_b.py::main"}
+    assert records["tst_a.py::1"] == [
+        {
+            "nodeid": "tst_a.py::1",
+            "origin": "/mod/run_tests.py",
+            "script": "/mod/tst_a.py",
+            "params": ["1"],
+            "mode": "forkserver",
+            "outcome": "failed",
+            "setup": 0.5,
+            "call": 2,
+            "teardown": 0.25,
+        }
+    ]
+    assert records["tst_b.py::main"][0]["outcome"] == "skipped"
+    assert records["tst_b.py::main"][0]["call"] is None
+
+
+def test_t_distribution():
+    # Reference values from tables of Student's t distribution
+    assert t_sf(2.0, 10) == pytest.approx(0.03669, abs=1e-5)
+    assert t_sf(-2.0, 10) == pytest.approx(1 - 0.03669, abs=1e-5)
+    assert t_sf(0, 5) == pytest.approx(0.5)
+    assert t_sf(2.228, 10) == pytest.approx(0.025, abs=1e-4)
+    assert t_sf(12.706, 1) == pytest.approx(0.025, abs=1e-4)
+
+
+def test_welch_test():
+    assert welch_test([1.0], [2.0, 2.1]) is None
+    assert welch_test([1.0, 1.1, 0.9], [2.0, 2.1, 1.9]) < 0.001
+    assert welch_test([1.0, 1.5, 0.5], [1.1, 1.6, 0.6]) > 0.3
+    assert welch_test([2.0, 2.1, 1.9], [1.0, 1.1, 0.9]) > 0.99
+
+
+def test_compare_single_runs(tmp_path):
+    _write(tmp_path / "old", {"a": 10, "b": 10, "c": 0.1, "d": 10})
+    _write(tmp_path / "new", {"a": 11, "b": 20, "c": 0.3, "e": 10})
+    slower, log_ratios = compare(
+        read_timings([str(tmp_path / "old")]), read_timings([str(tmp_path / "new")])
+    )
+    # c is three times slower, but by too little to matter
+    assert [x[0] for x in slower] == ["b"]
+    assert slower[0][1:] == (10, 20, None)
+    assert len(log_ratios) == 3
+
+
+def test_compare_repeated_runs(tmp_path):
+    for i, (a, b) in enumerate([(10, 10), (14, 10.1), (6, 9.9)]):
+        _write(tmp_path / "old" / f"{i}.jsonl", {"noisy": a, "steady": b})
+    for i, (a, b) in enumerate([(15, 13), (9, 13.1), (12, 12.9)]):
+        _write(tmp_path / "new" / f"{i}.jsonl", {"noisy": a, "steady": b})
+    _write(tmp_path / "new" / "failed.jsonl", {"steady": 100}, outcome="failed")
+
+    slower, _ = compare(
+        read_timings([str(tmp_path / "old")]), read_timings([str(tmp_path / "new")])
+    )
+    assert [x[0] for x in slower] == ["steady"]
+    assert slower[0][3] < 0.01
+
+
+@pytest.fixture
+def _dirs(tmp_path):
+    for name in ("old", "new"):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+
+def test_main(_dirs, capsys):
+    _write(_dirs / "old" / "t.jsonl", {"a": 10, "b": 1})
+    _write(_dirs / "new" / "t.jsonl", {"a": 10, "b": 1})
+    main([str(_dirs / "old"), str(_dirs / "new")])
+    assert "1.000x" in capsys.readouterr().out
+
+    _write(_dirs / "new" / "t.jsonl", {"a": 30, "b": 1})
+    with pytest.raises(SystemExit, match="1 tests got slower"):
+        main([str(_dirs / "old"), str(_dirs / "new")])
+    assert "3.00x" in capsys.readouterr().out
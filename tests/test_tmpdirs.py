@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import os
+import time
+
+from pytest_libtbx.tmpdirs import ROOT_PREFIX, TempDirPool
+
+
+def _wait_for(condition, timeout=10):
+    start = time.monotonic()
+    while not condition():
+        assert time.monotonic() - start < timeout
+        time.sleep(0.05)
+
+
+def test_directories_are_reused_empty(tmp_path):
+    pool = TempDirPool(tmp_path)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first != second
+    with open(os.path.join(first, "output"), "w") as f:
+        f.write("x")
+    pool.release(first)
+    pool.release(second)
+
+    assert {pool.acquire(), pool.acquire()} == {first, second}
+    assert not os.listdir(first)
+    pool.cleanup()
+
+
+def test_failed_directories_are_kept(tmp_path):
+    pool = TempDirPool(tmp_path)
+    path = pool.acquire()
+    with open(os.path.join(path, "output"), "w") as f:
+        f.write("x")
+    pool.release(path, keep_as="tst_a")
+    assert not os.listdir(path)
+    kept = os.path.join(pool.root, "kept", "tst_a-1", "output")
+    assert os.path.isfile(kept)
+
+    pool.cleanup()
+    _wait_for(lambda: not os.path.exists(path))
+    assert os.path.isfile(kept)
+
+
+def test_cleanup_removes_old_sessions(tmp_path):
+    active = TempDirPool(tmp_path)
+    old = [TempDirPool(tmp_path) for _ in range(4)]
+    for pool in old:
+        pool.cleanup()
+    _wait_for(lambda: len(os.listdir(tmp_path)) == 4)
+    remaining = os.listdir(tmp_path)
+    assert all(x.startswith(ROOT_PREFIX) for x in remaining)
+    # Still in use, so never removed
+    assert os.path.basename(active.root) in remaining
+    active.cleanup()